@@ -0,0 +1,149 @@
+"""Activity feed: who followed you, and who liked your warbles.
+
+Entries are written as events happen, by add_follow and add_like, in the
+same transaction as the follow or like, so reading the feed never has to
+search `follows` or `likes`. Each event is one upsert: while an entry is
+unread, later events of the same kind (and, for likes, the same message)
+are folded into it, bumping its actor count, its few most recent actors
+and its position, so a burst of likes shows as "5 people liked your
+warble" at the top of the feed. Once the feed has been seen, the next
+event starts a new entry.
+
+The count is of people, not events: everyone folded into an unread entry
+has a row in `activity_actors`, so liking, unliking and liking again (or
+refollowing) doesn't count anyone twice. Those rows are only needed while
+the entry is unread and are deleted when it is read.
+
+Each user's unread entry count is kept in `activity_counters`, bumped only
+when an event starts a new entry and reset when the feed is read, so the
+navbar badge is a primary-key lookup. The feed is paged by position, the
+snowflake id of an entry's latest event.
+"""
+
+from sqlalchemy import literal_column
+from sqlalchemy.dialects.postgresql import insert
+
+import snowflake
+from models import (db, User, Message, Activity, ActivityActor,
+                    ActivityCounter)
+
+PER_PAGE = 20
+
+# actors remembered per entry, for "alice, bob and 3 others ..."
+ACTORS_SHOWN = 3
+
+FOLLOW = 'follow'
+LIKE = 'like'
+
+
+def record(user_id, kind, actor_id, message_id=None):
+    """Add an event to `user_id`'s feed in the current transaction."""
+
+    if user_id == actor_id:
+        return
+
+    activity = Activity.__table__
+    actors = ActivityActor.__table__
+    position = snowflake.generator.next_id(db.engine)
+
+    # find or start the unread entry; the no-op update locks it, so
+    # concurrent events for it are folded in one at a time
+    stmt = insert(activity).values(user_id=user_id, kind=kind,
+                                   message_id=message_id,
+                                   actor_ids=[actor_id], actor_count=1,
+                                   position=position, read=False)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[activity.c.user_id, activity.c.kind,
+                        db.func.coalesce(activity.c.message_id, 0)],
+        index_where=~activity.c.read,
+        set_=dict(position=activity.c.position),
+    ).returning(activity.c.id, literal_column('xmax = 0'))
+    entry_id, created = db.session.execute(stmt).first()
+
+    new_actor = db.session.execute(
+        insert(actors)
+        .values(activity_id=entry_id, actor_id=actor_id)
+        .on_conflict_do_nothing()
+        .returning(actors.c.actor_id)).first() is not None
+
+    if created:
+        counters = ActivityCounter.__table__
+        bump = insert(counters).values(user_id=user_id, unread=1)
+        db.session.execute(bump.on_conflict_do_update(
+            index_elements=[counters.c.user_id],
+            set_=dict(unread=counters.c.unread + 1)))
+    elif new_actor:
+        db.session.execute(
+            activity.update()
+            .where(activity.c.id == entry_id)
+            .values(actor_ids=literal_column(
+                        f"(ARRAY[{int(actor_id)}] || activity.actor_ids)"
+                        f"[1:{ACTORS_SHOWN}]"),
+                    actor_count=activity.c.actor_count + 1,
+                    position=position))
+
+
+def record_follow(follower_id, followed_id):
+    record(followed_id, FOLLOW, follower_id)
+
+
+def record_like(liker_id, message):
+    record(message.user_id, LIKE, liker_id, message.id)
+
+
+def unread_count(user_id):
+    return (db.session
+            .query(ActivityCounter.unread)
+            .filter(ActivityCounter.user_id == user_id)
+            .scalar()) or 0
+
+
+def mark_read(user_id):
+    """Mark all of a user's entries read, in the current transaction."""
+
+    unread = (db.session
+              .query(Activity.id)
+              .filter(Activity.user_id == user_id, ~Activity.read))
+    (ActivityActor
+     .query
+     .filter(ActivityActor.activity_id.in_(unread.subquery()))
+     .delete(synchronize_session=False))
+    unread.update({'read': True}, synchronize_session=False)
+    (ActivityCounter
+     .query
+     .filter(ActivityCounter.user_id == user_id)
+     .update({'unread': 0}, synchronize_session=False))
+
+
+def feed(user_id, before=None, limit=PER_PAGE):
+    """Return (entries, next_before) for a page of a user's feed.
+
+    Entries get `actors` (newest first), `message` for likes, and `new`,
+    whether they were unread, which survives marking them read.
+    """
+
+    query = Activity.query.filter(Activity.user_id == user_id)
+    if before is not None:
+        query = query.filter(Activity.position < before)
+    entries = query.order_by(Activity.position.desc()).limit(limit + 1).all()
+
+    next_before = None
+    if len(entries) > limit:
+        entries = entries[:limit]
+        next_before = entries[-1].position
+
+    user_ids = {actor_id for entry in entries for actor_id in entry.actor_ids}
+    message_ids = {entry.message_id for entry in entries if entry.message_id}
+    users = {user.id: user
+             for user in User.query.filter(User.id.in_(user_ids))}
+    messages = {message.id: message
+                for message in Message.query.filter(
+                    Message.id.in_(message_ids))}
+
+    for entry in entries:
+        entry.actors = [users[actor_id] for actor_id in entry.actor_ids
+                        if actor_id in users]
+        entry.message = messages.get(entry.message_id)
+        entry.new = not entry.read
+
+    return entries, next_before
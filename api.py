@@ -0,0 +1,179 @@
+"""Batch JSON lookups of users and messages.
+
+GET /api/users?ids=1,2,3 and GET /api/messages?ids=... return the rows for
+up to MAX_IDS ids from one query, in the order asked for (repeated ids are
+returned once), and list the ids that don't exist under "missing". An
+optional `fields` parameter, such as fields=username,image_url, narrows
+each item to those fields and the query to their columns; "id" is always
+included so items can be matched to requests.
+
+Message ids are snowflakes, too big for JavaScript numbers, so they are
+sent as strings, as push.py does. Archived messages are looked up in the
+archive store only for ids the hot table doesn't have.
+"""
+
+from sqlalchemy import select
+
+import archive
+from models import User, Message, ArchivedMessage
+from readmodels import execute
+
+MAX_IDS = 100
+
+users = User.__table__
+
+# public profile fields; never email or password
+USER_FIELDS = ('id', 'username', 'image_url', 'header_image_url', 'bio',
+               'location', 'influence', 'follower_count')
+
+# 'user' is the author as {id, username, image_url}
+MESSAGE_FIELDS = ('id', 'text', 'timestamp', 'user_id', 'user')
+AUTHOR_COLUMNS = ('id', 'username', 'image_url')
+
+
+def parse_ids(values):
+    """Turn ids=1,2&ids=3 values into a list of unique ints, in order.
+
+    Raises ValueError with a message for the client.
+    """
+
+    ids = []
+    for value in values:
+        for part in value.split(','):
+            part = part.strip()
+            if not part:
+                continue
+            try:
+                ids.append(int(part))
+            except ValueError:
+                raise ValueError(f"Not an id: {part!r}.")
+
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        raise ValueError("Pass ids, separated by commas.")
+    if len(ids) > MAX_IDS:
+        raise ValueError(f"At most {MAX_IDS} ids at a time.")
+    return ids
+
+
+def parse_fields(value, allowed):
+    """Turn fields=a,b into a tuple of field names, id first.
+
+    All of `allowed` when `value` is empty; raises ValueError for unknown
+    fields.
+    """
+
+    if not value:
+        return allowed
+
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. "
+                         f"Choose from {', '.join(allowed)}.")
+    return tuple(dict.fromkeys(['id'] + fields))
+
+
+def in_order(ids, found):
+    """Return (items for ids in `found`, in order; the other ids)."""
+
+    return ([found[item_id] for item_id in ids if item_id in found],
+            [item_id for item_id in ids if item_id not in found])
+
+
+##############################################################################
+# Users
+
+
+def get_users(ids, fields=USER_FIELDS):
+    """Return (user dicts with `fields`, missing ids) for `ids`."""
+
+    rows = execute(select([users.c[field] for field in fields])
+                   .where(users.c.id.in_(ids)))
+    found = {row.id: dict(zip(fields, row)) for row in rows}
+    return in_order(ids, found)
+
+
+##############################################################################
+# Messages
+
+
+def get_messages(ids, fields=MESSAGE_FIELDS):
+    """Return (message dicts with `fields`, missing ids) for `ids`.
+
+    Hot messages and their authors come from one query; the archive is
+    only read for ids that query didn't find.
+    """
+
+    found = {}
+    found.update(hot_messages(ids, fields))
+
+    missing = [message_id for message_id in ids if message_id not in found]
+    if missing and archive.hot_boundary() is not None:
+        found.update(archived_messages(missing, fields))
+
+    items, missing = in_order(ids, found)
+    return items, [str(message_id) for message_id in missing]
+
+
+def message_columns(table, fields):
+    # the author's id is needed to look them up, even if not asked for
+    names = [field for field in fields if field != 'user']
+    if 'user' in fields and 'user_id' not in names:
+        names.append('user_id')
+    return [table.c[name] for name in names]
+
+
+def hot_messages(ids, fields):
+    messages = Message.__table__
+    columns = message_columns(messages, fields)
+    stmt = select(columns).where(messages.c.id.in_(ids))
+
+    if 'user' in fields:
+        # authors in the same query
+        stmt = stmt.select_from(
+            messages.join(users, users.c.id == messages.c.user_id))
+        for name in AUTHOR_COLUMNS:
+            stmt = stmt.column(users.c[name])
+
+    found = {}
+    for row in execute(stmt):
+        item = dict(zip((column.name for column in columns), row))
+        if 'user' in fields:
+            item['user'] = dict(zip(AUTHOR_COLUMNS, row[len(columns):]))
+        found[row[0]] = message_json(item, fields)
+    return found
+
+
+def archived_messages(ids, fields):
+    table = ArchivedMessage.__table__
+    columns = message_columns(table, fields)
+    items = [dict(zip((column.name for column in columns), row))
+             for row in execute(select(columns).where(table.c.id.in_(ids)),
+                                ArchivedMessage)]
+
+    if 'user' in fields:
+        # the archive may be another database, so no join
+        user_ids = {item['user_id'] for item in items}
+        rows = execute(select([users.c[name] for name in AUTHOR_COLUMNS])
+                       .where(users.c.id.in_(user_ids)))
+        authors = {row.id: dict(zip(AUTHOR_COLUMNS, row)) for row in rows}
+        for item in items:
+            item['user'] = authors.get(item['user_id'])
+
+    found = {}
+    for item in items:
+        found[item['id']] = message_json(item, fields)
+    return found
+
+
+def message_json(item, fields):
+    """Return a copy of a message's row, JSON-ready and with just `fields`."""
+
+    item = dict(item, id=str(item['id']))
+    if 'timestamp' in item:
+        item['timestamp'] = item['timestamp'].isoformat()
+    if 'user_id' not in fields:
+        # only selected to find the author
+        item.pop('user_id', None)
+    return item
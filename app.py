@@ -1,42 +1,149 @@
 import os
 
-from flask import Flask, render_template, request, flash, redirect, session, g
-from flask_debugtoolbar import DebugToolbarExtension
+from flask import (Blueprint, Flask, Response, render_template, request,
+                   flash, redirect, session, g, url_for, jsonify,
+                   stream_with_context)
+from jinja2 import FileSystemBytecodeCache
 from sqlalchemy.exc import IntegrityError
 
+from config import PROFILES
 from forms import UserAddForm, LoginForm, MessageForm, UserEditForm
 from models import db, connect_db, User, Message, Likes
-
-import pdb
+from jobs import jobs_cli
+from recommendations import suggestions_cli
+from influence import influence_cli
+import trending
+import search
+import tags
+import ratelimit
+import availability
+import entity_cache
+import timelines
+import archive
+import snowflake
+import profiling
+import userdata
+import activity
+import compression
+import readmodels
+import push
+import pagecache
+import api
 
 CURR_USER_KEY = "curr_user"
 
-app = Flask(__name__)
+bp = Blueprint('warbler', __name__)
+
 
-# Get DB_URI from environ variable (useful for production/testing) or,
-# if not set there, use development local db.
-app.config['SQLALCHEMY_DATABASE_URI'] = (
-    os.environ.get('DATABASE_URL', 'postgres:///warbler'))
+def create_app(config=None):
+    """Create and configure the Warbler app.
 
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ECHO'] = False
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
-toolbar = DebugToolbarExtension(app)
+    `config` is a profile name from config.PROFILES, or a dict of settings
+    applied on top of the profile picked by WARBLER_CONFIG / FLASK_ENV.
+    """
 
-connect_db(app)
+    if isinstance(config, str):
+        profile, overrides = config, {}
+    else:
+        profile, overrides = None, config or {}
+
+    if profile is None:
+        profile = os.environ.get('WARBLER_CONFIG') or (
+            'production' if os.environ.get('FLASK_ENV') == 'production'
+            else 'development')
+
+    app = Flask(__name__)
+    app.config.from_object(PROFILES[profile])
+
+    # Get DB_URI from environ variable (useful for production/testing) or,
+    # if not set there, use development local db.
+    app.config['SQLALCHEMY_DATABASE_URI'] = (
+        os.environ.get('DATABASE_URL', 'postgres:///warbler'))
+    # archived message partitions; see archive.py
+    app.config['SQLALCHEMY_BINDS'] = {
+        'archive': os.environ.get('ARCHIVE_DATABASE_URL',
+                                  app.config['SQLALCHEMY_DATABASE_URI']),
+    }
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+    app.config['TRENDING_SNAPSHOT_DIR'] = os.environ.get(
+        'TRENDING_SNAPSHOT_DIR', os.path.join(app.instance_path, 'trending'))
+    app.config['RATELIMIT_STORAGE'] = os.environ.get(
+        'RATELIMIT_STORAGE',
+        os.path.join(app.instance_path, 'ratelimit.buckets'))
+    app.config['JINJA_CACHE_DIR'] = os.path.join(app.instance_path, 'jinja')
+    app.config['SNOWFLAKE_WORKER_ID'] = os.environ.get('SNOWFLAKE_WORKER_ID')
+    # where browsers open the push.py event stream; unset, pages don't
+    app.config['PUSH_URL'] = os.environ.get('PUSH_URL')
+    app.config.update(overrides)
+
+    if app.config['JINJA_BYTECODE_CACHE']:
+        # must be set before the template environment is first used
+        cache_dir = app.config['JINJA_CACHE_DIR']
+        os.makedirs(cache_dir, exist_ok=True)
+        app.jinja_options = dict(app.jinja_options,
+                                 bytecode_cache=FileSystemBytecodeCache(cache_dir))
+
+    if app.config['DEBUG_TOOLBAR']:
+        from flask_debugtoolbar import DebugToolbarExtension
+        DebugToolbarExtension(app)
+
+    connect_db(app)
+    app.cli.add_command(jobs_cli)
+    app.cli.add_command(suggestions_cli)
+    app.cli.add_command(influence_cli)
+    app.cli.add_command(search.search_cli)
+    app.cli.add_command(tags.tags_cli)
+    app.cli.add_command(archive.archive_cli)
+    app.cli.add_command(userdata.data_cli)
+    trending.init_app(app)
+    entity_cache.init_app(app)
+    pagecache.init_app(app)
+    snowflake.init_app(app)
+    app.extensions['push'] = push.init_app(app)
+
+    # must be the first before_request hook, so throttled requests never
+    # touch the database
+    app.extensions['ratelimit'] = ratelimit.init_app(app, CURR_USER_KEY)
+    app.extensions['profiler'] = profiling.init_app(app)
+
+    if app.config['COMPRESS']:
+        app.extensions['compression'] = compression.init_app(app)
+
+    app.register_blueprint(bp)
+
+    return app
+
+
+_default_app = None
+
+
+def __getattr__(name):
+    """Build the default app on first use of `app.app`.
+
+    Keeps `from app import app` (tests, FLASK_APP=app) working without
+    building an app just because this module was imported.
+    """
+
+    global _default_app
+
+    if name != 'app':
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    if _default_app is None:
+        _default_app = create_app()
+    return _default_app
 
 
 ##############################################################################
 # User signup/login/logout
 
 
-@app.before_request
+@bp.before_app_request
 def add_user_to_g():
     """If we're logged in, add curr user to Flask global."""
 
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        g.user = entity_cache.get(User, session[CURR_USER_KEY])
 
     else:
         g.user = None
@@ -55,7 +162,29 @@ def do_logout():
         del session[CURR_USER_KEY]
 
 
-@app.route('/signup', methods=["GET", "POST"])
+def viewer_following_ids():
+    """Ids of the users the logged-in user follows, for Follow buttons."""
+
+    return g.user.following_ids() if g.user else frozenset()
+
+
+def flash_taken(username, email, user_id=None):
+    """Flash which of `username` and `email` a unique constraint refused.
+
+    `user_id` is the user being edited, who may keep their own.
+    """
+
+    owner = User.get_by_username(username)
+    if owner is not None and owner.id != user_id:
+        flash(f'The username "{username}" is already associated with an '
+              f'account.', 'danger')
+    else:
+        flash(f'The email address "{email}" is already associated with an '
+              f'account.', 'danger')
+
+
+@bp.route('/signup', methods=["GET", "POST"])
+@pagecache.cached()
 def signup():
     """Handle user signup.
 
@@ -80,7 +209,8 @@ def signup():
             db.session.commit()
 
         except IntegrityError:
-            flash("Username already taken", 'danger')
+            # taken in another process since the form was checked
+            flash_taken(form.username.data, form.email.data)
             return render_template('users/signup.html', form=form)
 
         do_login(user)
@@ -91,7 +221,8 @@ def signup():
         return render_template('users/signup.html', form=form)
 
 
-@app.route('/login', methods=["GET", "POST"])
+@bp.route('/login', methods=["GET", "POST"])
+@pagecache.cached()
 def login():
     """Handle user login."""
 
@@ -111,7 +242,24 @@ def login():
     return render_template('users/login.html', form=form)
 
 
-@app.route('/logout')
+@bp.route('/users/available')
+def check_available():
+    """JSON: is the 'username' or 'email' in querystring free to sign up with?"""
+
+    username = request.args.get('username')
+    email = request.args.get('email')
+
+    if username:
+        return jsonify(username=username,
+                       available=availability.username_available(username))
+    if email:
+        return jsonify(email=email,
+                       available=availability.email_available(email))
+
+    return jsonify(error="Pass a username or email."), 400
+
+
+@bp.route('/logout')
 def logout():
     """Handle logout of user."""
 
@@ -123,41 +271,43 @@ def logout():
 ##############################################################################
 # General user routes:
 
-@app.route('/users')
+@bp.route('/users')
 def list_users():
     """Page with listing of users.
 
     Can take a 'q' param in querystring to search by that username.
     """
 
-    search = request.args.get('q')
-
-    if not search:
-        users = User.query.all()
-    else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+    users = readmodels.list_users(request.args.get('q'))
 
-    return render_template('users/index.html', users=users)
+    return render_template('users/index.html', users=users,
+                           following_ids=viewer_following_ids())
 
 
-@app.route('/users/<int:user_id>')
+@bp.route('/users/<int:user_id>')
+@pagecache.cached(lambda user_id: [('user', user_id)])
 def users_show(user_id):
-    """Show user profile."""
+    """Show user profile.
+
+    Takes a 'before' message id param in querystring for the next page.
+    """
+
+    user = entity_cache.get_or_404(User, user_id)
 
-    user = User.query.get_or_404(user_id)
+    # newest first, reaching into the archive for older pages
+    messages, next_before = archive.user_messages(
+        user_id, before=request.args.get('before', type=int))
 
-    # snagging messages in order from the database;
-    # user.messages won't be in order by default
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
-    return render_template('users/show.html', user=user, messages=messages)
+    next_url = next_before and url_for(
+        '.users_show', user_id=user_id, before=next_before)
 
+    return render_template('users/show.html', user=user, messages=messages,
+                           next_url=next_url,
+                           stats=readmodels.user_stats(user_id),
+                           following_ids=viewer_following_ids())
 
-@app.route('/users/<int:user_id>/following')
+
+@bp.route('/users/<int:user_id>/following')
 def show_following(user_id):
     """Show list of people this user is following."""
 
@@ -165,11 +315,14 @@ def show_following(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    user = entity_cache.get_or_404(User, user_id)
+    return render_template('users/following.html', user=user,
+                           users=readmodels.following(user_id),
+                           stats=readmodels.user_stats(user_id),
+                           following_ids=viewer_following_ids())
 
 
-@app.route('/users/<int:user_id>/followers')
+@bp.route('/users/<int:user_id>/followers')
 def users_followers(user_id):
     """Show list of followers of this user."""
 
@@ -177,23 +330,77 @@ def users_followers(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    user = entity_cache.get_or_404(User, user_id)
+    return render_template('users/followers.html', user=user,
+                           users=readmodels.followers(user_id),
+                           stats=readmodels.user_stats(user_id),
+                           following_ids=viewer_following_ids())
 
 
-@app.route('/users/<int:user_id>/likes')
+@bp.route('/users/<int:user_id>/likes')
 def users_likes(user_id):
     """Show user's liked messages."""
 
-    user = User.query.get_or_404(user_id)
+    user = entity_cache.get_or_404(User, user_id)
+
+    messages = readmodels.liked_messages(user_id)
+
+    return render_template('users/likes.html', user=user, messages=messages,
+                           stats=readmodels.user_stats(user_id),
+                           following_ids=viewer_following_ids())
+
+
+@bp.route('/users/<int:user_id>/mentions')
+def users_mentions(user_id):
+    """Show messages that @mention this user.
+
+    Takes a 'before' message id param in querystring for the next page.
+    """
+
+    user = entity_cache.get_or_404(User, user_id)
+    messages, next_before = tags.mentioning_messages(
+        user_id, before=request.args.get('before', type=int))
+
+    next_url = next_before and url_for(
+        '.users_mentions', user_id=user_id, before=next_before)
 
-    messages = db.session.query(Likes, Message).filter(
-        Likes.user_id == user_id).join(Message).order_by(Message.timestamp.desc()).limit(100).all()
+    return render_template('messages/list.html', messages=messages,
+                           heading=f"Mentions of @{user.username}",
+                           next_url=next_url)
 
-    return render_template('users/likes.html', user=user, messages=messages)
 
+@bp.route('/users/export')
+def export_data():
+    """Download the logged-in user's profile, warbles, follows and likes.
+
+    Streamed as NDJSON; see userdata.py.
+    """
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
 
-@app.route('/users/follow/<int:follow_id>', methods=['POST'])
+    lines = userdata.export_lines(g.user.id)
+    return ndjson_response(lines, f"warbler-{g.user.username}.ndjson")
+
+
+@bp.route('/users/<int:user_id>/messages.ndjson')
+def export_messages(user_id):
+    """Download all of a user's warbles as NDJSON."""
+
+    user = entity_cache.get_or_404(User, user_id)
+    lines = userdata.message_lines(user.id)
+    return ndjson_response(lines, f"warbler-{user.username}-messages.ndjson")
+
+
+def ndjson_response(lines, filename):
+    return Response(
+        stream_with_context(userdata.chunked(lines)),
+        mimetype='application/x-ndjson',
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+
+@bp.route('/users/follow/<int:follow_id>', methods=['POST'])
 def add_follow(follow_id):
     """Add a follow for the currently-logged-in user."""
 
@@ -201,14 +408,18 @@ def add_follow(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get_or_404(follow_id)
-    g.user.following.append(followed_user)
+    followed_user = entity_cache.get_or_404(User, follow_id)
+    if g.user.follow(followed_user.id):
+        activity.record_follow(g.user.id, followed_user.id)
     db.session.commit()
 
+    # follows are written with Core, which the page cache doesn't see
+    pagecache.touch(('user', g.user.id), ('user', followed_user.id))
+
     return redirect(f"/users/{g.user.id}/following")
 
 
-@app.route('/users/stop-following/<int:follow_id>', methods=['POST'])
+@bp.route('/users/stop-following/<int:follow_id>', methods=['POST'])
 def stop_following(follow_id):
     """Have currently-logged-in-user stop following this user."""
 
@@ -216,14 +427,15 @@ def stop_following(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get(follow_id)
-    g.user.following.remove(followed_user)
+    g.user.stop_following(follow_id)
     db.session.commit()
 
+    pagecache.touch(('user', g.user.id), ('user', follow_id))
+
     return redirect(f"/users/{g.user.id}/following")
 
 
-@app.route('/users/profile', methods=["GET", "POST"])
+@bp.route('/users/profile', methods=["GET", "POST"])
 def profile():
     """Update profile for current user."""
 
@@ -244,13 +456,13 @@ def profile():
             return render_template('/users/edit.html', form=form, user=g.user)
 
         username = form.username.data
-        if username != current_username and User.get_by_username(username) != None:
+        if username != current_username and not availability.username_available(username):
             flash(
                 f'The username "{username}" is already associated with an account.', 'danger')
             return render_template('/users/edit.html', form=form, user=g.user)
 
         email = form.email.data
-        if email != current_email and User.get_by_email(email) != None:
+        if email != current_email and not availability.email_available(email):
             flash(
                 f'The email address "{email}" is already associated with an account.', 'danger')
             return render_template('/users/edit.html', form=form, user=g.user)
@@ -260,7 +472,12 @@ def profile():
         user.image_url = form.image_url.data or User.image_url.default.arg
         user.header_image_url = form.header_image_url.data or User.header_image_url.default.arg
         user.bio = form.bio.data
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            flash_taken(username, email, user.id)
+            return render_template('/users/edit.html', form=form, user=g.user)
 
         flash(f'Profile updated!', 'info')
         return redirect(f"/users/{g.user.id}")
@@ -269,7 +486,7 @@ def profile():
         return render_template('/users/edit.html', form=form, user=g.user)
 
 
-@app.route('/users/delete', methods=["POST"])
+@bp.route('/users/delete', methods=["POST"])
 def delete_user():
     """Delete user."""
 
@@ -279,16 +496,20 @@ def delete_user():
 
     do_logout()
 
+    user_id = g.user.id
+    archive.forget_user(user_id)
     db.session.delete(g.user)
     db.session.commit()
 
+    timelines.recent_posts.forget_author(user_id)
+
     return redirect("/signup")
 
 
 ##############################################################################
 # Messages routes:
 
-@app.route('/messages/new', methods=["GET", "POST"])
+@bp.route('/messages/new', methods=["GET", "POST"])
 def messages_add():
     """Add a message:
 
@@ -302,24 +523,31 @@ def messages_add():
     form = MessageForm()
 
     if form.validate_on_submit():
-        msg = Message(text=form.text.data)
-        g.user.messages.append(msg)
+        msg = Message(text=form.text.data, user_id=g.user.id)
+        db.session.add(msg)
+        search.index_message(msg)
+        tags.record_message(msg)
+        push.publish(msg)
         db.session.commit()
 
+        timelines.record_post(g.user.id, msg.id)
+
         return redirect(f"/users/{g.user.id}")
 
     return render_template('messages/new.html', form=form)
 
 
-@app.route('/messages/<int:message_id>', methods=["GET"])
+@bp.route('/messages/<int:message_id>', methods=["GET"])
+@pagecache.cached(lambda message_id: [('message', message_id), ('users',)])
 def messages_show(message_id):
     """Show a message."""
 
-    msg = Message.query.get(message_id)
+    msg = (entity_cache.get(Message, message_id)
+           or archive.get_message(message_id))
     return render_template('messages/show.html', message=msg)
 
 
-@app.route('/messages/<int:message_id>/delete', methods=["POST"])
+@bp.route('/messages/<int:message_id>/delete', methods=["POST"])
 def messages_destroy(message_id):
     """Delete a message."""
 
@@ -327,17 +555,36 @@ def messages_destroy(message_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    msg = Message.query.get(message_id)
+    msg = entity_cache.get(Message, message_id)
+    archived = None if msg else archive.get_message(message_id)
+    if msg is None and archived is None:
+        return redirect(f"/users/{g.user.id}")
+
+    author_id = (msg or archived).user_id
+    if author_id != g.user.id:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    if archived is not None:
+        archive.delete_message(message_id)
+        db.session.commit()
+        pagecache.touch(('message', message_id), ('user', author_id))
+        return redirect(f"/users/{g.user.id}")
+
+    search.unindex_message(message_id)
     db.session.delete(msg)
     db.session.commit()
 
+    trending.discard(message_id)
+    timelines.forget_post(author_id, message_id)
+
     return redirect(f"/users/{g.user.id}")
 
 ##############################################################################
 # Adding and removing likes
 
 
-@app.route('/users/add_like/<int:message_id>', methods=['POST'])
+@bp.route('/users/add_like/<int:message_id>', methods=['POST'])
 def add_like(message_id):
     """Add a like to a message."""
 
@@ -345,7 +592,7 @@ def add_like(message_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    message = Message.query.get_or_404(message_id)
+    message = entity_cache.get_or_404(Message, message_id)
     if message.user_id == g.user.id:
         flash("Cannot like your own message.", "danger")
         return redirect("/")
@@ -355,12 +602,15 @@ def add_like(message_id):
 
         new_like = Likes(message_id=message_id, user_id=g.user.id)
         db.session.add(new_like)
+        activity.record_like(g.user.id, message)
         db.session.commit()
 
+        trending.record_like(message_id)
+
     return redirect(f'/')
 
 
-@app.route('/users/remove_like/<int:message_id>', methods=['POST'])
+@bp.route('/users/remove_like/<int:message_id>', methods=['POST'])
 def remove_like(message_id):
     """Remove a like to a message."""
 
@@ -368,7 +618,7 @@ def remove_like(message_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    message = Message.query.get_or_404(message_id)
+    message = entity_cache.get_or_404(Message, message_id)
     if message.user_id == g.user.id:
         flash("Cannot like your own message.", "danger")
         return redirect("/")
@@ -379,14 +629,149 @@ def remove_like(message_id):
         db.session.delete(like)
         db.session.commit()
 
+        trending.record_unlike(message_id)
+
     return redirect(f'/')
 
 
+@bp.route('/tags/<tag>')
+def tags_show(tag):
+    """Show messages using a hashtag.
+
+    Takes a 'before' message id param in querystring for the next page.
+    """
+
+    messages, next_before = tags.tagged_messages(
+        tag, before=request.args.get('before', type=int))
+
+    next_url = next_before and url_for('.tags_show', tag=tag, before=next_before)
+
+    return render_template('messages/list.html', messages=messages,
+                           heading=f"#{tag}", next_url=next_url)
+
+
+@bp.route('/search')
+def search_messages():
+    """Page of messages matching the 'q' param in querystring.
+
+    Takes an 'after' param (from the previous page) for the next page.
+    """
+
+    query = request.args.get('q', '')
+    messages, next_cursor = search.search(query, after=request.args.get('after'))
+
+    return render_template('messages/search.html', messages=messages,
+                           query=query, next_cursor=next_cursor)
+
+
+@bp.route('/api/users')
+def api_users():
+    """JSON: users for the 'ids' param in querystring, in that order.
+
+    Takes an optional 'fields' param listing the fields to return.
+    """
+
+    try:
+        ids = api.parse_ids(request.args.getlist('ids'))
+        fields = api.parse_fields(request.args.get('fields'), api.USER_FIELDS)
+    except ValueError as exc:
+        return jsonify(error=str(exc)), 400
+
+    users, missing = api.get_users(ids, fields)
+    return jsonify(users=users, missing=missing)
+
+
+@bp.route('/api/messages')
+def api_messages():
+    """JSON: messages for the 'ids' param in querystring, in that order.
+
+    Takes an optional 'fields' param listing the fields to return.
+    """
+
+    try:
+        ids = api.parse_ids(request.args.getlist('ids'))
+        fields = api.parse_fields(request.args.get('fields'),
+                                  api.MESSAGE_FIELDS)
+    except ValueError as exc:
+        return jsonify(error=str(exc)), 400
+
+    messages, missing = api.get_messages(ids, fields)
+    return jsonify(messages=messages, missing=missing)
+
+
+@bp.route('/stats/cache')
+def cache_stats():
+    """JSON: hit/miss counters for the entity and page caches."""
+
+    return jsonify(dict(entity_cache.stats(), pages=pagecache.stats()))
+
+
+@bp.route('/trending')
+def trending_messages():
+    """Show most-liked recent messages.
+
+    Takes a 'window' param in querystring ('1h' or '24h').
+    """
+
+    window = request.args.get('window', '24h')
+    if window not in trending.WINDOWS:
+        window = '24h'
+
+    ranked = trending.top(window)
+
+    # ranking comes from memory and snapshots; just load the messages
+    messages = readmodels.messages_by_ids(
+        [message_id for message_id, _ in ranked])
+
+    return render_template('messages/trending.html', messages=messages,
+                           window=window, windows=trending.WINDOWS)
+
+
+##############################################################################
+# Activity feed
+
+
+@bp.route('/activity')
+def activity_feed():
+    """Show who followed the logged-in user and liked their warbles.
+
+    Takes a 'before' position param in querystring for the next page.
+    Seeing the first page marks everything read.
+    """
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    before = request.args.get('before', type=int)
+    entries, next_before = activity.feed(g.user.id, before=before)
+    if before is None:
+        activity.mark_read(g.user.id)
+
+    next_url = next_before and url_for('.activity_feed', before=next_before)
+    html = render_template('users/activity.html', entries=entries,
+                           next_url=next_url)
+
+    # after rendering, so the entries aren't expired and reloaded
+    db.session.commit()
+    return html
+
+
+@bp.app_context_processor
+def inject_unread_activity():
+    """Unread activity count for the navbar badge."""
+
+    if not g.get('user'):
+        return {}
+    return {'unread_activity': activity.unread_count(g.user.id)}
+
+
 ##############################################################################
 # Homepage and error pages
 
 
-@app.route('/')
+@bp.route('/')
+@pagecache.cached()
 def homepage():
     """Show homepage:
 
@@ -395,21 +780,39 @@ def homepage():
     """
 
     if g.user:
-        messages = (Message
-                    .query
-                    .filter(Message.user_id.in_(g.user.following_ids_list()))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
+        # merged from per-author buffers of recent posts
+        messages = timelines.home_timeline(g.user.following_ids())
+
+        liked_messages = g.user.liked_message_ids()
 
-        liked_messages = g.user.liked_message_ids_list()
+        # precomputed by `flask suggestions refresh`
+        suggestions = g.user.suggested_users()
 
-        return render_template('home.html', messages=messages, liked_messages=liked_messages)
+        return render_template('home.html', messages=messages, liked_messages=liked_messages,
+                               suggestions=suggestions,
+                               stats=readmodels.user_stats(g.user.id))
 
     else:
         return render_template('home-anon.html')
 
 
+@bp.route('/timeline/new')
+def timeline_new():
+    """HTML for home timeline messages newer than the 'after' message id.
+
+    Fetched by the home page when push.py announces new warbles.
+    """
+
+    if not g.user:
+        return "", 401
+
+    after = request.args.get('after', 0, type=int)
+    messages = timelines.newer_messages(g.user.following_ids(), after)
+
+    return render_template('messages/timeline_items.html', messages=messages,
+                           liked_messages=g.user.liked_message_ids())
+
+
 ##############################################################################
 # Turn off all caching in Flask
 #   (useful for dev; in production, this kind of stuff is typically
@@ -417,7 +820,7 @@ def homepage():
 #
 # https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
 
-@app.after_request
+@bp.after_app_request
 def add_header(req):
     """Add non-caching headers on every request."""
 
@@ -0,0 +1,265 @@
+"""Hot and archived message storage.
+
+The `messages` table is the hot partition: the last HOT_DAYS or so of
+messages, rounded down to a month boundary. `flask archive rollover` moves
+whole months older than that into the archive store (the 'archive'
+database bind, ARCHIVE_DATABASE_URL, which defaults to the main database),
+one month per partition, and records each partition in
+`message_partitions`.
+
+Archived messages are compacted to their text, author, timestamp and likes;
+their search, hashtag and mention index rows go with the hot rows, and the
+home timeline only covers the hot partition. Profile pages page through
+hot messages first and query the archive only once a page reaches back
+past the start of the hot partition.
+"""
+
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+
+import readmodels
+import snowflake
+from jobs import task, enqueue
+from models import (db, Likes, Message, ArchivedMessage, ArchivedLike,
+                    MessagePartition)
+
+HOT_DAYS = 90
+BATCH_SIZE = 5000
+PER_PAGE = 100
+
+# how long a process trusts its copy of the hot partition's start
+BOUNDARY_TTL = 60
+
+
+def month_start(when):
+    return when.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month(when):
+    return month_start(month_start(when) + timedelta(days=32))
+
+
+def partition_name(when):
+    return when.strftime('%Y-%m')
+
+
+##############################################################################
+# Reading
+
+
+_boundary = (None, 0)
+
+
+def hot_boundary():
+    """Start of the hot partition, or None if nothing has been archived."""
+
+    global _boundary
+
+    boundary, expires = _boundary
+    if time.monotonic() < expires:
+        return boundary
+
+    boundary = (db.session
+                .query(MessagePartition.ends_at)
+                .order_by(MessagePartition.ends_at.desc())
+                .limit(1)
+                .scalar())
+    _boundary = (boundary, time.monotonic() + BOUNDARY_TTL)
+    return boundary
+
+
+def user_messages(user_id, before=None, limit=PER_PAGE):
+    """Return (messages, next_before) for a page of a user's messages.
+
+    Messages are newest first; pass the returned message id as `before` for
+    the next page. Hot and archived messages alike are
+    readmodels.MessageItems.
+    """
+
+    def keyset(model, before, limit):
+        table = model.__table__
+        stmt = readmodels.select_messages(model).where(
+            table.c.user_id == user_id)
+        if before is not None:
+            stmt = stmt.where(table.c.id < before)
+        return readmodels.message_items(
+            stmt.order_by(table.c.id.desc()).limit(limit), model)
+
+    messages = keyset(Message, before, limit + 1)
+
+    # ids are time-ordered, so archived messages all sort after hot ones;
+    # the archive is only read once the hot rows run out
+    if len(messages) <= limit and hot_boundary() is not None:
+        oldest = messages[-1].id if messages else before
+        messages += keyset(ArchivedMessage, oldest, limit + 1 - len(messages))
+
+    next_before = None
+    if len(messages) > limit:
+        messages = messages[:limit]
+        next_before = messages[-1].id
+
+    return messages, next_before
+
+
+def get_message(message_id):
+    """Return the archived message with `message_id`, or None."""
+
+    return ArchivedMessage.query.get(message_id)
+
+
+##############################################################################
+# Writing
+
+
+def delete_message(message_id):
+    """Delete an archived message; return whether it existed."""
+
+    ArchivedLike.query.filter_by(message_id=message_id).delete()
+    return bool(ArchivedMessage.query.filter_by(id=message_id).delete())
+
+
+def forget_user(user_id):
+    """Delete a user's archived messages and likes, in this transaction.
+
+    The archive has no foreign keys, so nothing cascades on its own.
+    """
+
+    own = (select([ArchivedMessage.id])
+           .where(ArchivedMessage.user_id == user_id))
+    (ArchivedLike
+     .query
+     .filter((ArchivedLike.user_id == user_id)
+             | ArchivedLike.message_id.in_(own))
+     .delete(synchronize_session=False))
+    (ArchivedMessage
+     .query
+     .filter(ArchivedMessage.user_id == user_id)
+     .delete(synchronize_session=False))
+
+
+@task(name='archive_rollover', queue='batch', max_attempts=3)
+def rollover(hot_days=HOT_DAYS, batch_size=BATCH_SIZE, now=None):
+    """Move whole months older than `hot_days` into the archive.
+
+    Returns the number of messages moved. Each batch's hot rows are locked
+    while its messages and likes are copied, then committed to the archive
+    before they are deleted from `messages`; archive inserts skip rows
+    already there, so an interrupted run is finished by the next one.
+    """
+
+    global _boundary
+
+    now = now or datetime.utcnow()
+    cutoff = month_start(now - timedelta(days=hot_days))
+    engine = db.get_engine(bind='archive')
+
+    moved = 0
+    partitions = set()
+    while True:
+        rows = (db.session
+                .query(Message.id, Message.text, Message.timestamp,
+                       Message.user_id)
+                .filter(Message.id < snowflake.first_id_at(cutoff))
+                .order_by(Message.id)
+                .limit(batch_size)
+                # new likes wait for the FK check until the batch is gone,
+                # so none are added after they are copied below
+                .with_for_update(of=Message)
+                .all())
+        if not rows:
+            break
+
+        ids = [row.id for row in rows]
+        messages = [dict(id=row.id, text=row.text, timestamp=row.timestamp,
+                         user_id=row.user_id,
+                         partition=partition_name(row.timestamp))
+                    for row in rows]
+        likes = [dict(message_id=message_id, user_id=user_id)
+                 for message_id, user_id in (
+                     db.session
+                     .query(Likes.message_id, Likes.user_id)
+                     .filter(Likes.message_id.in_(ids)))]
+
+        with engine.begin() as conn:
+            conn.execute(insert(ArchivedMessage.__table__)
+                         .on_conflict_do_nothing(), messages)
+            if likes:
+                conn.execute(insert(ArchivedLike.__table__)
+                             .on_conflict_do_nothing(), likes)
+
+        # likes, tags, mentions and search postings cascade
+        (Message
+         .query
+         .filter(Message.id.in_(ids))
+         .delete(synchronize_session=False))
+        db.session.commit()
+
+        moved += len(ids)
+        partitions.update(message['partition'] for message in messages)
+
+    if partitions:
+        record_partitions(engine, partitions, now)
+        _boundary = (None, 0)
+
+    return moved
+
+
+def record_partitions(engine, names, now):
+    """Refresh the `message_partitions` rows for partitions `names`."""
+
+    archived = ArchivedMessage.__table__
+    counts = (select([archived.c.partition, func.count()])
+              .where(archived.c.partition.in_(names))
+              .group_by(archived.c.partition))
+
+    with engine.begin() as conn:
+        for name, count in conn.execute(counts):
+            starts_at = datetime.strptime(name, '%Y-%m')
+            row = dict(name=name, starts_at=starts_at,
+                       ends_at=next_month(starts_at), message_count=count,
+                       archived_at=now)
+            conn.execute(insert(MessagePartition.__table__)
+                         .values(**row)
+                         .on_conflict_do_update(
+                             index_elements=['name'],
+                             set_=dict(message_count=count, archived_at=now)))
+
+
+##############################################################################
+# CLI: `flask archive ...`
+
+archive_cli = AppGroup('archive', help="Manage archived message partitions.")
+
+
+@archive_cli.command('rollover')
+@click.option('--days', 'hot_days', default=HOT_DAYS,
+              help="Keep at least this many days of messages hot.")
+@click.option('--batch', 'batch_size', default=BATCH_SIZE,
+              help="Messages moved per transaction.")
+@click.option('--enqueue', 'defer', is_flag=True,
+              help="Queue a job for the worker instead of running now.")
+def rollover_command(hot_days, batch_size, defer):
+    """Move old months of messages into the archive."""
+
+    if defer:
+        enqueue('archive_rollover',
+                {'hot_days': hot_days, 'batch_size': batch_size})
+        db.session.commit()
+        click.echo("Queued rollover.")
+        return
+
+    click.echo(f"Archived {rollover(hot_days, batch_size)} messages.")
+
+
+@archive_cli.command('partitions')
+def partitions_command():
+    """List archived partitions."""
+
+    for partition in MessagePartition.query.order_by(MessagePartition.name):
+        click.echo(f"{partition.name}  {partition.message_count:>10} messages"
+                   f"  archived {partition.archived_at:%Y-%m-%d %H:%M}")
@@ -0,0 +1,177 @@
+"""Fast answers to "is this username / email taken?".
+
+Each process keeps a counting Bloom filter of the usernames and emails in
+the users table. A name the filter has never seen is certainly available
+(as of the last rebuild), so most checks need no query; only names the
+filter reports as present, which are real or about 1% false positives,
+are looked up in the database.
+
+The filters are built on first use and rebuilt every REFRESH_INTERVAL
+seconds, and kept current between rebuilds by mapper events on User.
+Another process's signups reach this one only at its next rebuild, so a
+name taken there can be reported available here. The filters are only a
+fast path for live checks (/users/available and form validation): signup
+and profile edits rely on the unique constraints on users, and report a
+name taken in the meantime when their commit raises IntegrityError.
+"""
+
+import hashlib
+import math
+import threading
+import time
+
+from sqlalchemy import event, inspect
+
+import entity_cache
+from models import db, User
+
+ERROR_RATE = 0.01
+REFRESH_INTERVAL = 5 * 60
+MIN_CAPACITY = 1024
+FETCH_SIZE = 10000
+
+
+class CountingBloomFilter:
+    """Bloom filter with a byte counter per cell, so items can be removed.
+
+    Counters stop at 255 and are never decremented after that, which can
+    only leave false positives behind.
+    """
+
+    def __init__(self, capacity, error_rate=ERROR_RATE):
+        self.size = max(8, int(-capacity * math.log(error_rate)
+                               / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.counters = bytearray(self.size)
+
+    def _cells(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for cell in self._cells(item):
+            if self.counters[cell] < 255:
+                self.counters[cell] += 1
+
+    def remove(self, item):
+        cells = self._cells(item)
+        if not all(self.counters[cell] for cell in cells):
+            return
+
+        for cell in cells:
+            if self.counters[cell] < 255:
+                self.counters[cell] -= 1
+
+    def __contains__(self, item):
+        return all(self.counters[cell] for cell in self._cells(item))
+
+
+class Availability:
+    """Username and email filters for the users table."""
+
+    def __init__(self, refresh_interval=REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self.usernames = None
+        self.emails = None
+        self._built_at = None
+        self._build_lock = threading.Lock()
+        self.db_checks = 0
+
+    def username_available(self, username):
+        """Is `username` free?"""
+
+        self._ensure_fresh()
+        if username not in self.usernames:
+            return True
+
+        self.db_checks += 1
+        return entity_cache.get_user_by_username(username) is None
+
+    def email_available(self, email):
+        """Is `email` free?"""
+
+        self._ensure_fresh()
+        if email not in self.emails:
+            return True
+
+        self.db_checks += 1
+        return User.get_by_email(email) is None
+
+    def add(self, username, email):
+        if self.usernames is not None:
+            self.usernames.add(username)
+            self.emails.add(email)
+
+    def remove(self, username, email):
+        if self.usernames is not None:
+            self.usernames.remove(username)
+            self.emails.remove(email)
+
+    def rebuild(self):
+        """Load every username and email into fresh filters."""
+
+        capacity = max(MIN_CAPACITY, 2 * User.query.count())
+        usernames = CountingBloomFilter(capacity)
+        emails = CountingBloomFilter(capacity)
+
+        for username, email in (db.session
+                                .query(User.username, User.email)
+                                .yield_per(FETCH_SIZE)):
+            usernames.add(username)
+            emails.add(email)
+
+        self.usernames, self.emails = usernames, emails
+        self._built_at = time.monotonic()
+
+    def invalidate(self):
+        """Drop the filters; they are rebuilt on next use."""
+
+        self.usernames = self.emails = self._built_at = None
+
+    def _ensure_fresh(self):
+        if (self._built_at is not None
+                and time.monotonic() - self._built_at < self.refresh_interval):
+            return
+
+        # the first build blocks; later rebuilds are done by whichever
+        # thread gets there first while the others use the old filters
+        if self._build_lock.acquire(blocking=self.usernames is None):
+            try:
+                if (self._built_at is None or time.monotonic()
+                        - self._built_at >= self.refresh_interval):
+                    self.rebuild()
+            finally:
+                self._build_lock.release()
+
+
+registry = Availability()
+
+username_available = registry.username_available
+email_available = registry.email_available
+
+
+@event.listens_for(User, 'after_insert')
+def _user_inserted(mapper, connection, user):
+    registry.add(user.username, user.email)
+
+
+@event.listens_for(User, 'after_update')
+def _user_updated(mapper, connection, user):
+    if registry.usernames is None:
+        return
+
+    state = inspect(user)
+    for attr, bloom in [('username', registry.usernames),
+                        ('email', registry.emails)]:
+        history = state.attrs[attr].history
+        for old in history.deleted:
+            bloom.remove(old)
+        for new in history.added:
+            bloom.add(new)
+
+
+@event.listens_for(User, 'after_delete')
+def _user_deleted(mapper, connection, user):
+    registry.remove(user.username, user.email)
@@ -0,0 +1,112 @@
+"""Compression benchmark: bytes saved against CPU spent, on home.html.
+
+Renders the home timeline (a logged-in user's aside, who-to-follow and a
+page of warbles, with users and text from generator/*.csv) without a
+database, then compresses the page with each encoding and level the same
+way compression.Compressor does, and reports the compressed size and the
+CPU time per page. Streaming adds a sync flush per chunk; --chunk shows
+what that costs when the page is sent in pieces of that many bytes.
+
+    python bench_compression.py --messages 100 --repeat 200
+"""
+
+import csv
+import json
+import os
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+import click
+
+import compression
+import readmodels
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SETTINGS = ([('gzip', level) for level in (1, 4, 6, 9)]
+            + [('br', quality) for quality in (1, 4, 6, 9, 11)])
+
+
+def read_csv(name):
+    with open(os.path.join(HERE, 'generator', name)) as f:
+        return list(csv.DictReader(f))
+
+
+def render_home(messages):
+    """home.html for a user with `messages` warbles in their timeline."""
+
+    import app as warbler
+
+    application = warbler.create_app({'DEBUG_TOOLBAR': False,
+                                      'COMPRESS': False})
+    users = [SimpleNamespace(id=n, **row)
+             for n, row in enumerate(read_csv('users.csv'), 1)]
+    rows = read_csv('messages.csv')[:messages]
+    timeline = [SimpleNamespace(id=7000000000000000000 + n, text=row['text'],
+                                timestamp=datetime.fromisoformat(
+                                    row['timestamp']),
+                                user=users[int(row['user_id']) - 1])
+                for n, row in enumerate(rows)]
+
+    with application.test_request_context('/'):
+        template = application.jinja_env.get_template('home.html')
+        return template.render(
+            g=SimpleNamespace(user=users[0]), messages=timeline,
+            liked_messages={m.id for m in timeline[::5]},
+            suggestions=users[80:85],
+            stats=readmodels.UserStats(messages=20, following=40,
+                                       followers=40, likes=0)).encode('utf-8')
+
+
+def compress(encoding, level, page, chunk):
+    if encoding == 'br':
+        encoder = compression.BrotliEncoder(level)
+    else:
+        encoder = compression.GzipEncoder(level)
+    if not chunk:
+        return encoder.compress(page) + encoder.finish()
+    parts = [encoder.compress(page[start:start + chunk]) + encoder.flush()
+             for start in range(0, len(page), chunk)]
+    return b''.join(parts) + encoder.finish()
+
+
+@click.command()
+@click.option('--messages', default=100, help="Warbles on the page.")
+@click.option('--repeat', default=100, help="Compressions per setting.")
+@click.option('--chunk', default=0,
+              help="Compress in chunks of this many bytes, as when "
+                   "streaming (0: whole page).")
+@click.option('--json', 'as_json', is_flag=True, help="Print JSON results.")
+def main(messages, repeat, chunk, as_json):
+    page = render_home(messages)
+    settings = [(encoding, level) for encoding, level in SETTINGS
+                if encoding == 'gzip' or compression.brotli is not None]
+
+    results = {'identity': {'bytes': len(page), 'ratio': 1.0, 'cpu_ms': 0.0}}
+    for encoding, level in settings:
+        start = time.process_time()
+        for _ in range(repeat):
+            data = compress(encoding, level, page, chunk)
+        cpu = (time.process_time() - start) / repeat
+        results[f'{encoding}-{level}'] = {'bytes': len(data),
+                                          'ratio': len(page) / len(data),
+                                          'cpu_ms': cpu * 1000}
+
+    if as_json:
+        click.echo(json.dumps(results, indent=2))
+        return
+
+    if compression.brotli is None:
+        click.echo("brotli is not installed; gzip only")
+    click.echo(f"{'encoding':<10} {'bytes':>9} {'ratio':>7} {'cpu/page':>10}"
+               f" {'MB/s':>8}")
+    for name, result in results.items():
+        rate = (len(page) / result['cpu_ms'] / 1000
+                if result['cpu_ms'] else float('inf'))
+        click.echo(f"{name:<10} {result['bytes']:>9} {result['ratio']:>6.1f}x"
+                   f" {result['cpu_ms']:>8.2f}ms {rate:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""Import benchmark: rows per second through `flask data import`.
+
+Builds an NDJSON export of made-up users, messages, follows and likes
+(names and text from generator/*.csv), then imports it with
+userdata.import_lines one kind at a time and reports rows per second for
+each. "parse" is the client side alone: decoding the lines and writing
+the COPY text, without sending it. "index" is the job that indexes the
+imported messages for search, hashtags and mentions afterwards, in
+messages per second.
+
+The database in --database is EMPTIED first; it defaults to a scratch one.
+
+    createdb warbler-bench
+    python bench_import.py --users 10000 --per-user 10
+"""
+
+import csv
+import io
+import json
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+import click
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+PASSWORD = "$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe"
+
+
+def read_csv(name):
+    with open(os.path.join(HERE, 'generator', name)) as f:
+        return list(csv.DictReader(f))
+
+
+def export(users, per_user, seed=0):
+    """{kind: [NDJSON line, ...]} for a made-up site of `users` users."""
+
+    import snowflake
+
+    rng = random.Random(seed)
+    texts = [row['text'] for row in read_csv('messages.csv')]
+    start = datetime(2021, 1, 1)
+
+    lines = {kind: [] for kind in ('user', 'message', 'follow', 'like')}
+    for user_id in range(1, users + 1):
+        lines['user'].append(json.dumps(dict(
+            type='user', id=user_id, username=f"user{user_id}",
+            email=f"user{user_id}@test.com", image_url=None,
+            header_image_url=None, bio="Bio", location="Here",
+            password=PASSWORD)))
+
+    message_ids = []
+    for n in range(users * per_user):
+        when = start + timedelta(seconds=n)
+        message_id = snowflake.first_id_at(when) + n % 4096
+        message_ids.append(message_id)
+        lines['message'].append(json.dumps(dict(
+            type='message', id=message_id, text=rng.choice(texts),
+            timestamp=when.isoformat(), user_id=rng.randint(1, users))))
+
+    for follower in range(1, users + 1):
+        for followed in rng.sample(range(1, users + 1), min(per_user, users)):
+            if followed != follower:
+                lines['follow'].append(json.dumps(dict(
+                    type='follow', user_following_id=follower,
+                    user_being_followed_id=followed)))
+
+    for user_id in range(1, users + 1):
+        for message_id in rng.sample(message_ids, per_user):
+            lines['like'].append(json.dumps(dict(
+                type='like', user_id=user_id, message_id=message_id)))
+
+    return lines
+
+
+def parse_rate(lines):
+    """Rows per second decoded and written as COPY text, without a database."""
+
+    import userdata
+
+    start = time.perf_counter()
+    records = [json.loads(line) for line in lines]
+    kind = records[0].pop('type')
+    for record in records:
+        record.pop('type', None)
+    _, columns, _ = userdata.Importer.TABLES[kind]
+    buffer = io.StringIO()
+    for record in records:
+        buffer.write('\t'.join(userdata.copy_value(record.get(column))
+                               for column in columns))
+        buffer.write('\n')
+    return len(lines) / (time.perf_counter() - start)
+
+
+@click.command()
+@click.option('--database', default='postgresql:///warbler-bench',
+              help="Database to import into; it is emptied first.")
+@click.option('--users', default=10000, help="Users to import.")
+@click.option('--per-user', default=10,
+              help="Messages, follows and likes per user.")
+@click.option('--batch', 'batch_size', default=10000,
+              help="Rows per batch, as `flask data import --batch`.")
+@click.option('--json', 'as_json', is_flag=True, help="Print JSON results.")
+def main(database, users, per_user, batch_size, as_json):
+    os.environ['DATABASE_URL'] = database
+    import app as warbler
+    import userdata
+    from models import db
+
+    application = warbler.create_app({'DEBUG_TOOLBAR': False,
+                                      'SQLALCHEMY_DATABASE_URI': database})
+    lines = export(users, per_user)
+
+    results = {}
+    with application.app_context():
+        db.drop_all()
+        db.create_all()
+        for kind, kind_lines in lines.items():
+            start = time.perf_counter()
+            importer = userdata.import_lines(kind_lines, batch_size,
+                                             index=False)
+            seconds = time.perf_counter() - start
+            results[kind] = {'rows': importer.inserted[kind],
+                             'seconds': seconds,
+                             'rows_per_s': len(kind_lines) / seconds,
+                             'parse_rows_per_s': parse_rate(kind_lines)}
+            if importer.message_range is not None:
+                message_range = importer.message_range
+
+        # what the queued job does afterwards, per message
+        start = time.perf_counter()
+        indexed = userdata.index_imported_messages(*message_range)
+        seconds = time.perf_counter() - start
+        results['index'] = {'rows': indexed, 'seconds': seconds,
+                            'rows_per_s': indexed / seconds,
+                            'parse_rows_per_s': None}
+
+    if as_json:
+        click.echo(json.dumps(results, indent=2))
+        return
+
+    click.echo(f"{'kind':<8} {'rows':>9} {'seconds':>8} {'rows/s':>9}"
+               f" {'parse/s':>9}")
+    for kind, result in results.items():
+        parse = result['parse_rows_per_s']
+        click.echo(f"{kind:<8} {result['rows']:>9} {result['seconds']:>8.2f}"
+                   f" {result['rows_per_s']:>9.0f}"
+                   f" {'-' if parse is None else f'{parse:.0f}':>9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Cold-start benchmark: time from `import app` to the first response.
+
+Each run is a fresh interpreter that imports the app module, builds the app
+with the given profile and serves GET /login through the test client, so
+the numbers include module imports, extension setup and template
+compilation. The first production run also fills the Jinja bytecode cache,
+which later runs (and restarted workers) read instead of recompiling.
+
+    python bench_startup.py --runs 10 --profile development --profile production
+"""
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+import click
+
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import app as warbler
+imported = time.perf_counter()
+application = warbler.create_app(sys.argv[1])
+created = time.perf_counter()
+response = application.test_client().get(sys.argv[2])
+assert response.status_code == 200, response.status_code
+done = time.perf_counter()
+print(json.dumps({'import': imported - start, 'create_app': created - imported,
+                  'first_response': done - created, 'total': done - start,
+                  'modules': len(sys.modules)}))
+"""
+
+STAGES = ['import', 'create_app', 'first_response', 'total']
+
+
+def run_once(profile, path):
+    output = subprocess.run(
+        [sys.executable, '-c', CHILD, profile, path],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+@click.command()
+@click.option('--runs', default=5, help="Fresh processes per profile.")
+@click.option('--profile', 'profiles', multiple=True,
+              default=['development', 'production'],
+              help="Config profile to measure (repeatable).")
+@click.option('--path', default='/login', help="Page requested first.")
+@click.option('--json', 'as_json', is_flag=True, help="Print JSON results.")
+def main(runs, profiles, path, as_json):
+    results = {}
+    for profile in profiles:
+        samples = [run_once(profile, path) for _ in range(runs)]
+        results[profile] = {
+            stage: {'median_ms': statistics.median(s[stage] for s in samples)
+                    * 1000,
+                    'min_ms': min(s[stage] for s in samples) * 1000}
+            for stage in STAGES}
+        results[profile]['modules'] = samples[-1]['modules']
+
+    if as_json:
+        click.echo(json.dumps(results, indent=2))
+        return
+
+    click.echo(f"{'profile':<12} " + ' '.join(f"{stage:>15}" for stage in STAGES)
+               + f" {'modules':>8}")
+    for profile, result in results.items():
+        click.echo(f"{profile:<12} "
+                   + ' '.join(f"{result[stage]['median_ms']:>13.1f}ms"
+                              for stage in STAGES)
+                   + f" {result['modules']:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+"""Compression of dynamic responses.
+
+A WSGI middleware around the app: when the client's Accept-Encoding
+allows it, text responses (HTML, JSON, NDJSON, ...) are sent gzip- or
+Brotli-compressed, Brotli preferred. Brotli is only offered when the
+optional `brotli` package is installed.
+
+Responses with a Content-Length (everything Flask renders in one piece)
+are compressed whole, unless they are shorter than COMPRESS_MIN_SIZE, where
+the headers would cost more than the saving. Streamed responses have no
+length; they are compressed chunk by chunk and each chunk is flushed, so
+the client still gets data as the app produces it. Responses that already
+have a Content-Encoding, or ask for no-transform, are passed through.
+
+COMPRESS_LEVEL (gzip, 1-9) and COMPRESS_BROTLI_QUALITY (0-11) trade CPU
+for bytes; `python bench_compression.py` measures both on home.html.
+"""
+
+import zlib
+from itertools import chain
+
+from werkzeug.datastructures import Headers
+from werkzeug.http import parse_accept_header
+from werkzeug.wsgi import ClosingIterator
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+LEVEL = 6
+BROTLI_QUALITY = 4
+MIN_SIZE = 500
+
+COMPRESSIBLE_TYPES = frozenset([
+    'text/html', 'text/plain', 'text/css', 'text/javascript',
+    'application/json', 'application/javascript', 'application/x-ndjson',
+    'application/xml', 'image/svg+xml',
+])
+
+
+class GzipEncoder:
+    name = 'gzip'
+
+    def __init__(self, level):
+        # wbits 31: zlib stream with a gzip header and trailer
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliEncoder:
+    name = 'br'
+
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+def choose_encoding(accept_encoding, offered):
+    """The best of `offered` ('br', 'gzip') the client accepts, or None."""
+
+    accepted = parse_accept_header(accept_encoding)
+    best, best_quality = None, 0
+    for name in offered:
+        quality = accepted.quality(name)
+        if quality > best_quality:
+            best, best_quality = name, quality
+    return best
+
+
+class Compressor:
+    """WSGI middleware compressing responses; see the module docstring."""
+
+    def __init__(self, wsgi_app, level=LEVEL, brotli_quality=BROTLI_QUALITY,
+                 min_size=MIN_SIZE, mimetypes=COMPRESSIBLE_TYPES):
+        self.wsgi_app = wsgi_app
+        self.level = level
+        self.brotli_quality = brotli_quality
+        self.min_size = min_size
+        self.mimetypes = mimetypes
+        self.offered = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+    def encoder(self, name):
+        if name == 'br':
+            return BrotliEncoder(self.brotli_quality)
+        return GzipEncoder(self.level)
+
+    @staticmethod
+    def mimetype(headers):
+        return headers.get('Content-Type', '').split(';')[0].strip()
+
+    def compressible(self, headers):
+        if self.mimetype(headers) not in self.mimetypes:
+            return False
+        if 'Content-Encoding' in headers:
+            return False
+        if 'no-transform' in headers.get('Cache-Control', ''):
+            return False
+        length = headers.get('Content-Length')
+        return length is None or int(length) >= self.min_size
+
+    def __call__(self, environ, start_response):
+        encoding = choose_encoding(environ.get('HTTP_ACCEPT_ENCODING', ''),
+                                   self.offered)
+        if encoding is None or environ['REQUEST_METHOD'] == 'HEAD':
+            return self.wsgi_app(environ, start_response)
+
+        captured = []
+        written = []
+
+        def capture(status, headers, exc_info=None):
+            captured[:] = [status, Headers(headers), exc_info]
+            return written.append
+
+        body = self.wsgi_app(environ, capture)
+        status, headers, exc_info = captured
+
+        if written:
+            # data passed to the legacy write() goes before the body
+            body = ClosingIterator(chain(written, body),
+                                   getattr(body, 'close', None))
+
+        if self.mimetype(headers) in self.mimetypes:
+            headers.add('Vary', 'Accept-Encoding')
+
+        if not self.compressible(headers) or status.startswith(('204', '304')):
+            start_response(status, headers.to_wsgi_list(), exc_info)
+            return body
+
+        headers['Content-Encoding'] = encoding
+        encoder = self.encoder(encoding)
+
+        if 'Content-Length' in headers:
+            try:
+                data = encoder.compress(b''.join(body)) + encoder.finish()
+            finally:
+                if hasattr(body, 'close'):
+                    body.close()
+            headers['Content-Length'] = str(len(data))
+            start_response(status, headers.to_wsgi_list(), exc_info)
+            return [data]
+
+        start_response(status, headers.to_wsgi_list(), exc_info)
+        return self.stream(body, encoder)
+
+    def stream(self, body, encoder):
+        """Compress a streamed body, flushing after every chunk."""
+
+        try:
+            for chunk in body:
+                data = encoder.compress(chunk) + encoder.flush()
+                if data:
+                    yield data
+            yield encoder.finish()
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+
+
+def init_app(app):
+    """Wrap the app's WSGI callable in the compression middleware."""
+
+    app.wsgi_app = Compressor(
+        app.wsgi_app,
+        level=app.config['COMPRESS_LEVEL'],
+        brotli_quality=app.config['COMPRESS_BROTLI_QUALITY'],
+        min_size=app.config['COMPRESS_MIN_SIZE'])
+    return app.wsgi_app
@@ -0,0 +1,48 @@
+"""Configuration profiles for create_app().
+
+Pick one by name (`create_app('production')`) or with the WARBLER_CONFIG
+environment variable; by default FLASK_ENV=production selects production
+and anything else development. Settings that depend on the environment or
+the instance folder are filled in by create_app().
+"""
+
+
+class Config:
+    """Settings shared by every profile."""
+
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ECHO = False
+
+    # install Flask-DebugToolbar (only imported when enabled)
+    DEBUG_TOOLBAR = False
+    DEBUG_TB_INTERCEPT_REDIRECTS = False
+
+    # keep compiled templates in the instance folder across restarts
+    JINJA_BYTECODE_CACHE = False
+
+    # gzip/Brotli compression of responses; see compression.py
+    COMPRESS = True
+    COMPRESS_LEVEL = 6
+    COMPRESS_BROTLI_QUALITY = 4
+    COMPRESS_MIN_SIZE = 500
+
+    # how new warbles reach push.py: 'postgres' (NOTIFY, any process) or
+    # 'memory' (this process only)
+    PUSH_BROKER = 'postgres'
+
+    # cache whole pages for logged-out visitors; see pagecache.py
+    PAGE_CACHE = True
+
+
+class DevelopmentConfig(Config):
+    DEBUG_TOOLBAR = True
+
+
+class ProductionConfig(Config):
+    JINJA_BYTECODE_CACHE = True
+
+
+PROFILES = {
+    'development': DevelopmentConfig,
+    'production': ProductionConfig,
+}
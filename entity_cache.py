@@ -0,0 +1,213 @@
+"""Read-through cache of User and Message rows.
+
+Lookups by primary key (and users by username) check an in-process LRU
+cache before the database. Entries hold a row's column values, not ORM
+instances; a hit builds an instance and attaches it to the current session
+with merge(load=False), so relationships still lazy-load normally.
+
+Entries expire after a TTL and are evicted least-recently-used once the
+cache passes its memory budget. Updates and deletes made through the ORM
+invalidate the row at flush and again at commit (so a concurrent read of
+the old row can't re-cache it); bulk query updates, and writes from other
+processes, are only seen once the TTL runs out.
+"""
+
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from flask import abort
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.orm.util import identity_key
+
+from models import db, User, Message
+
+TTL = 30
+MAX_BYTES = 32 * 1024 * 1024
+
+
+def snapshot(obj):
+    """Return a dict of `obj`'s column values."""
+
+    return {attr.key: getattr(obj, attr.key)
+            for attr in inspect(type(obj)).column_attrs}
+
+
+def estimate_size(values):
+    return sys.getsizeof(values) + sum(sys.getsizeof(value)
+                                       for value in values.values())
+
+
+class EntityCache:
+    """LRU + TTL cache of row snapshots, bounded by estimated bytes."""
+
+    def __init__(self, ttl=TTL, max_bytes=MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        # key -> (expires at, size, value)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, model, pk):
+        """Return the `model` row with primary key `pk`, or None."""
+
+        if pk is None:
+            return None
+
+        # already in this session: use it as is, local changes and all
+        obj = db.session.identity_map.get(identity_key(model, pk))
+        if obj is not None:
+            return obj
+
+        values = self._lookup((model.__name__, pk))
+        if values is not None:
+            return self._attach(model, values)
+
+        obj = model.query.get(pk)
+        if obj is not None:
+            self._store((model.__name__, pk), snapshot(obj))
+        return obj
+
+    def get_or_404(self, model, pk):
+        obj = self.get(model, pk)
+        if obj is None:
+            abort(404)
+        return obj
+
+    def get_user_by_username(self, username):
+        """Return the user with `username`, or None."""
+
+        user_id = self._lookup(('User.username', username))
+        if user_id is not None:
+            user = self.get(User, user_id)
+            # renamed since the mapping was cached
+            if user is not None and user.username == username:
+                return user
+            self.invalidate_key(('User.username', username))
+
+        user = User.get_by_username(username)
+        if user is not None:
+            self._store(('User', user.id), snapshot(user))
+            self._store(('User.username', username), user.id)
+        return user
+
+    def invalidate(self, model, pk):
+        self.invalidate_key((model.__name__, pk))
+
+    def invalidate_key(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry[1]
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Counters and sizes, for monitoring."""
+
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+        }
+
+    def _lookup(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._entries[key]
+                    self._bytes -= entry[1]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def _store(self, key, value):
+        size = (estimate_size(value) if isinstance(value, dict)
+                else sys.getsizeof(value))
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+
+            self._entries[key] = (time.monotonic() + self.ttl, size, value)
+            self._bytes += size
+
+            while self._bytes > self.max_bytes and self._entries:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def _attach(self, model, values):
+        obj = model(**values)
+        make_transient_to_detached(obj)
+        return db.session.merge(obj, load=False)
+
+
+cache = EntityCache()
+
+get = cache.get
+get_or_404 = cache.get_or_404
+get_user_by_username = cache.get_user_by_username
+stats = cache.stats
+
+
+def init_app(app):
+    """Apply ENTITY_CACHE_TTL / ENTITY_CACHE_MAX_BYTES from config."""
+
+    cache.ttl = app.config.get('ENTITY_CACHE_TTL', TTL)
+    cache.max_bytes = app.config.get('ENTITY_CACHE_MAX_BYTES', MAX_BYTES)
+
+
+##############################################################################
+# Invalidation
+
+PENDING_KEY = 'entity_cache_pending'
+
+
+def _row_changed(mapper, connection, target):
+    model = mapper.class_
+    pk = inspect(target).identity[0]
+    cache.invalidate(model, pk)
+
+    # again after commit, in case the old row was re-read in between
+    session = inspect(target).session
+    if session is not None:
+        session.info.setdefault(PENDING_KEY, set()).add((model, pk))
+
+
+for _model in (User, Message):
+    event.listen(_model, 'after_update', _row_changed)
+    event.listen(_model, 'after_delete', _row_changed)
+
+
+@event.listens_for(Session, 'after_commit')
+def _after_commit(session):
+    for model, pk in session.info.pop(PENDING_KEY, ()):
+        cache.invalidate(model, pk)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _after_rollback(session):
+    session.info.pop(PENDING_KEY, None)
@@ -0,0 +1,85 @@
+"""The follow graph as a sparse matrix, for batch jobs.
+
+The follows table is exported into a CSR matrix A with one row per
+followed user and one column per follower: A[j, i] = 1 when user i follows
+user j, so row j lists j's followers. Its transpose has a row per follower
+listing who they follow. Every user gets a row and a column, whether or
+not they follow anyone or have followers.
+
+Memory stays at about 8 bytes per follow however the table is read: edges
+are streamed from the database in primary key order, which is already the
+order of A's rows, straight into the matrix's arrays, and the matrix holds
+float32 ones.
+
+NumPy and SciPy are imported by the functions that use them, so web
+processes that only register the tasks don't load them.
+"""
+
+from sqlalchemy import func, select
+
+from models import db, User, Follows
+
+FETCH_SIZE = 100000
+
+users = User.__table__
+follows = Follows.__table__
+
+
+def load_follow_matrix():
+    """Return (user_ids, A) for every user and the follows table.
+
+    `user_ids[j]` is the id of the user at row and column j of the CSR
+    matrix A, whose row j lists j's followers. Users without follows get
+    empty rows and columns, so every user is included.
+    """
+
+    import numpy as np
+    from scipy import sparse
+
+    user_ids = np.fromiter(
+        (user_id for user_id, in db.session.execute(
+            select([users.c.id]).order_by(users.c.id))),
+        dtype=np.int64)
+    size = len(user_ids)
+
+    expected = db.session.execute(
+        select([func.count()]).select_from(follows)).scalar()
+    followers = np.empty(expected, dtype=np.int32)
+    counts = np.zeros(size, dtype=np.int64)
+    filled = 0
+
+    # sorted by (followed, follower), the primary key, so rows come in order
+    result = db.session.execute(
+        select([follows.c.user_being_followed_id,
+                follows.c.user_following_id])
+        .order_by(follows.c.user_being_followed_id,
+                  follows.c.user_following_id)
+        .execution_options(stream_results=True))
+    while True:
+        chunk = result.fetchmany(FETCH_SIZE)
+        if not chunk:
+            break
+
+        edges = np.array(chunk, dtype=np.int64)
+        rows = np.searchsorted(user_ids, edges[:, 0]).clip(max=size - 1)
+        columns = np.searchsorted(user_ids, edges[:, 1]).clip(max=size - 1)
+        # skip users who signed up after user_ids was read
+        known = ((user_ids[rows] == edges[:, 0])
+                 & (user_ids[columns] == edges[:, 1]))
+        rows, columns = rows[known], columns[known]
+
+        if filled + len(columns) > len(followers):
+            followers = np.resize(followers, 2 * (filled + len(columns)))
+        followers[filled:filled + len(columns)] = columns
+        filled += len(columns)
+        present, per_row = np.unique(rows, return_counts=True)
+        counts[present] += per_row
+
+    indptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+
+    adjacency = sparse.csr_matrix(
+        (np.ones(filled, dtype=np.float32), followers[:filled], indptr),
+        shape=(size, size))
+
+    return user_ids, adjacency
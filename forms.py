@@ -1,19 +1,19 @@
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, TextAreaField
 from wtforms.validators import DataRequired, Email, Length, ValidationError
-from models import User
+from availability import email_available, username_available
 
 
 def AvailableEmail(form, field):
     email = field.data
-    if User.get_by_email(email) != None:
+    if not email_available(email):
         raise ValidationError(
             f'The email address "{email}" is already associated with an account.')
 
 
 def AvailableUsername(form, field):
     username = field.data
-    if User.get_by_username(username) != None:
+    if not username_available(username):
         raise ValidationError(
             f'The username "{username}" is already associated with an account.')
 
@@ -0,0 +1,291 @@
+"""Durable background jobs for Warbler.
+
+Jobs are rows in the `jobs` table, so a job is committed in the same
+transaction as the request that enqueued it. A worker process started with
+`flask jobs work` claims due jobs with row locks and runs them on a pool of
+threads per queue; failed jobs are retried with exponential backoff.
+"""
+
+import json
+import logging
+import os
+import random
+import signal
+import socket
+import threading
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Job
+
+logger = logging.getLogger(__name__)
+
+# task name -> function; filled in by the @task decorator
+TASKS = {}
+
+# 'batch' runs the periodic and offline tasks: search stats, suggestions,
+# influence scores and archive rollovers
+DEFAULT_QUEUES = {'default': 4, 'batch': 1}
+POLL_INTERVAL = 1.0
+BACKOFF_BASE = 2
+BACKOFF_CAP = 60 * 60
+LOCK_TIMEOUT = timedelta(minutes=10)
+
+
+def task(name=None, queue='default', max_attempts=5):
+    """Register a function as a job task.
+
+    The function is called with the job's payload as keyword arguments and
+    runs inside an app context.
+    """
+
+    def decorator(func):
+        func.task_name = name or func.__name__
+        func.queue = queue
+        func.max_attempts = max_attempts
+        TASKS[func.task_name] = func
+        return func
+
+    return decorator
+
+
+def enqueue(task_name, payload=None, queue=None, idempotency_key=None,
+            delay=0):
+    """Add a job to the current DB session and return it.
+
+    The caller commits. If a job was already enqueued under
+    `idempotency_key`, that job is returned and nothing new is added.
+
+    With JOBS_EAGER set (useful for tests), the task runs right away and
+    None is returned.
+    """
+
+    func = TASKS[task_name]
+    payload = payload or {}
+
+    if db.get_app().config.get('JOBS_EAGER'):
+        func(**payload)
+        return None
+
+    if idempotency_key:
+        existing = Job.get_by_idempotency_key(idempotency_key)
+        if existing is not None:
+            return existing
+
+    job = Job(
+        queue=queue or func.queue,
+        task=task_name,
+        payload=json.dumps(payload),
+        max_attempts=func.max_attempts,
+        idempotency_key=idempotency_key,
+        run_at=datetime.utcnow() + timedelta(seconds=delay),
+    )
+
+    if not idempotency_key:
+        db.session.add(job)
+        return job
+
+    # a concurrent request may have won the race for the key; use a
+    # savepoint so losing it doesn't roll back the caller's transaction
+    try:
+        with db.session.begin_nested():
+            db.session.add(job)
+    except IntegrityError:
+        return Job.get_by_idempotency_key(idempotency_key)
+
+    return job
+
+
+def backoff(attempts):
+    """Seconds to wait before retry number `attempts` (with jitter)."""
+
+    delay = min(BACKOFF_CAP, BACKOFF_BASE ** attempts)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def claim(queue, worker_name):
+    """Lock, mark running and return the next due job on `queue`, or None.
+
+    Jobs left running by a worker that died are picked up again once their
+    lock is older than LOCK_TIMEOUT.
+    """
+
+    now = datetime.utcnow()
+    job = (Job
+           .query
+           .filter(Job.queue == queue,
+                   or_(and_(Job.status == 'queued', Job.run_at <= now),
+                       and_(Job.status == 'running',
+                            Job.locked_at < now - LOCK_TIMEOUT)))
+           .order_by(Job.run_at)
+           .with_for_update(skip_locked=True)
+           .first())
+
+    if job is None:
+        db.session.rollback()
+        return None
+
+    job.status = 'running'
+    job.attempts += 1
+    job.locked_at = now
+    job.locked_by = worker_name
+    db.session.commit()
+
+    return job
+
+
+def execute(job):
+    """Run a claimed job and record the outcome."""
+
+    func = TASKS.get(job.task)
+
+    try:
+        if func is None:
+            raise LookupError(f"No task registered as {job.task!r}")
+        func(**json.loads(job.payload))
+
+        job.status = 'done'
+        job.locked_at = None
+        job.locked_by = None
+        db.session.commit()
+
+    except Exception as exc:
+        db.session.rollback()
+        logger.exception("Job %s (%s) failed", job.id, job.task)
+
+        job.last_error = f"{type(exc).__name__}: {exc}"
+        job.locked_at = None
+        job.locked_by = None
+
+        if job.attempts >= job.max_attempts:
+            job.status = 'failed'
+        else:
+            job.status = 'queued'
+            job.run_at = datetime.utcnow() + timedelta(
+                seconds=backoff(job.attempts))
+
+        db.session.commit()
+        return False
+
+    return True
+
+
+def run_pending(queue='default', worker_name='inline'):
+    """Run every due job on `queue` in this thread; return how many ran."""
+
+    count = 0
+    job = claim(queue, worker_name)
+    while job is not None:
+        execute(job)
+        count += 1
+        job = claim(queue, worker_name)
+    return count
+
+
+class Worker:
+    """Pool of threads running jobs, with a concurrency limit per queue."""
+
+    def __init__(self, app, queues=None, poll_interval=POLL_INTERVAL):
+        self.app = app
+        self.queues = queues or app.config.get('JOBS_QUEUES', DEFAULT_QUEUES)
+        self.poll_interval = poll_interval
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self._stopping = threading.Event()
+        self._threads = []
+
+    def start(self):
+        """Start `concurrency` threads for each queue."""
+
+        for queue, concurrency in self.queues.items():
+            for i in range(concurrency):
+                thread = threading.Thread(
+                    target=self._loop,
+                    args=(queue,),
+                    name=f"jobs-{queue}-{i}",
+                    daemon=True,
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """Ask threads to stop after their current job and wait for them."""
+
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def run_forever(self):
+        """Run until interrupted or sent SIGTERM."""
+
+        signal.signal(signal.SIGTERM, lambda signum, frame: self._stopping.set())
+        self.start()
+        try:
+            while not self._stopping.wait(1):
+                pass
+        except KeyboardInterrupt:
+            pass
+        self.stop()
+
+    def _loop(self, queue):
+        with self.app.app_context():
+            while not self._stopping.is_set():
+                try:
+                    job = claim(queue, self.name)
+                    if job is not None:
+                        execute(job)
+                except Exception:
+                    logger.exception("Worker error on queue %s", queue)
+                    db.session.rollback()
+                    job = None
+                finally:
+                    # don't let the identity map grow for the worker's life
+                    db.session.remove()
+
+                if job is None:
+                    self._stopping.wait(self.poll_interval)
+
+
+def parse_queues(specs):
+    """Turn ('default=4', 'mail') into {'default': 4, 'mail': 1}."""
+
+    queues = {}
+    for spec in specs:
+        name, _, concurrency = spec.partition('=')
+        queues[name] = int(concurrency or 1)
+    return queues
+
+
+##############################################################################
+# CLI: `flask jobs ...`
+
+jobs_cli = AppGroup('jobs', help="Manage the background job queue.")
+
+
+@jobs_cli.command('work')
+@click.option('--queue', '-q', 'queues', multiple=True, metavar='NAME[=N]',
+              help="Queue to work and its thread count (repeatable).")
+def work_command(queues):
+    """Run a job worker until interrupted."""
+
+    worker = Worker(current_app._get_current_object(), parse_queues(queues))
+    click.echo(f"Worker {worker.name} working {worker.queues}")
+    worker.run_forever()
+
+
+@jobs_cli.command('prune')
+@click.option('--days', default=7, help="Delete finished jobs older than this.")
+def prune_command(days):
+    """Delete old finished jobs."""
+
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    count = (Job
+             .query
+             .filter(Job.status == 'done', Job.created_at < cutoff)
+             .delete(synchronize_session=False))
+    db.session.commit()
+    click.echo(f"Deleted {count} jobs.")
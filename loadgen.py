@@ -0,0 +1,506 @@
+"""Closed-loop load generator.
+
+Virtual users each log in as one account and then loop: pick an action
+from the traffic mix, run it, wait a think time, repeat. Because a user
+only sends its next request after the last one finished, offered load
+follows the server's speed the way real traffic does; raise --concurrency
+to push harder.
+
+The accounts come from generator/users.csv, prefixed so they don't clash
+with seeded users, and are created with a known password by `prepare`,
+which also copies the follow graph from follows.csv and the warbles from
+messages.csv onto them (the CSV's password hashes are of an unknown
+password). Profile views and follows favour users with many followers.
+
+    python loadgen.py prepare
+    python loadgen.py run --concurrency 50 --duration 60 --think exp:1
+    python loadgen.py run --target http://127.0.0.1:8000 --output results.json
+
+An action may take several requests (a login is logout, login form,
+login post) and its latency covers all of them. 429s are counted as
+throttled, not as errors; an in-process run gives each virtual user its
+own client address, so per-IP limits apply per user as they would in
+production.
+"""
+
+import csv
+import http.cookiejar
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter, defaultdict
+
+import click
+
+POPULATION_FILE = os.path.join('instance', 'loadgen-users.json')
+PREFIX = 'lg_'
+PASSWORD = 'loadgen-password'
+
+# action -> relative weight
+DEFAULT_MIX = {
+    'timeline': 40,
+    'profile': 25,
+    'like': 12,
+    'post': 8,
+    'follow': 8,
+    'login': 7,
+}
+
+PERCENTILES = (50, 90, 99)
+
+CSRF_RE = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+MESSAGE_LINK_RE = re.compile(r'href="/messages/(\d+)"')
+
+
+def read_csv(name):
+    with open(os.path.join('generator', name)) as f:
+        return list(csv.DictReader(f))
+
+
+##############################################################################
+# Population
+
+
+def prepare_population(prefix=PREFIX, password=PASSWORD):
+    """Create the load-test accounts, their follows and their warbles.
+
+    Row n of users.csv becomes user `prefix + username`; the other CSVs
+    refer to users by row number. Accounts that already exist are reused,
+    so this can be run again; follows and warbles are only added for
+    newly created accounts. Returns the population to save.
+    """
+
+    from models import db, bcrypt, User, Message, Follows
+
+    rows = read_csv('users.csv')
+    hashed = bcrypt.generate_password_hash(password).decode('UTF-8')
+    usernames = [prefix + row['username'] for row in rows]
+
+    existing = dict(db.session.query(User.username, User.id)
+                    .filter(User.username.in_(usernames)))
+    new_rows = [dict(row, username=prefix + row['username'],
+                     email=prefix + row['email'], password=hashed)
+                for row in rows if prefix + row['username'] not in existing]
+    db.session.bulk_insert_mappings(User, new_rows)
+    db.session.flush()
+
+    ids = dict(db.session.query(User.username, User.id)
+               .filter(User.username.in_(usernames)))
+    # CSV user numbers start at 1
+    by_number = {n: ids[name] for n, name in enumerate(usernames, 1)}
+    created = {ids[row['username']] for row in new_rows}
+
+    edges = [(by_number[int(row['user_following_id'])],
+              by_number[int(row['user_being_followed_id'])])
+             for row in read_csv('follows.csv')]
+    db.session.bulk_insert_mappings(Follows, [
+        dict(user_following_id=follower, user_being_followed_id=followed)
+        for follower, followed in edges if follower in created])
+    db.session.bulk_insert_mappings(Message, [
+        dict(text=row['text'], timestamp=row['timestamp'],
+             user_id=by_number[int(row['user_id'])])
+        for row in read_csv('messages.csv')
+        if by_number[int(row['user_id'])] in created])
+    db.session.commit()
+
+    following = defaultdict(list)
+    followers = Counter()
+    for follower, followed in edges:
+        following[follower].append(followed)
+        followers[followed] += 1
+
+    return {
+        'password': password,
+        'texts': [row['text'] for row in read_csv('messages.csv')],
+        'users': [{'id': ids[name], 'username': name,
+                   'followers': followers[ids[name]],
+                   'following': following[ids[name]]}
+                  for name in usernames],
+    }
+
+
+##############################################################################
+# Targets: each virtual user gets a client with its own cookies.
+
+
+class InProcessClient:
+    """Calls the WSGI app directly through Flask's test client."""
+
+    def __init__(self, app, remote_addr):
+        self.client = app.test_client()
+        self.environ = {'REMOTE_ADDR': remote_addr}
+
+    def request(self, method, path, data=None):
+        resp = self.client.open(path, method=method, data=data,
+                                environ_base=self.environ)
+        return resp.status_code, resp.get_data(as_text=True)
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HTTPClient:
+    """Talks HTTP to a running server."""
+
+    def __init__(self, base_url, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+            NoRedirect)
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data else None
+        req = urllib.request.Request(self.base_url + path, data=body,
+                                     method=method)
+        try:
+            with self.opener.open(req, timeout=self.timeout) as resp:
+                return resp.status, resp.read().decode('utf-8', 'replace')
+        except urllib.error.HTTPError as e:
+            # includes the redirects NoRedirect declined to follow
+            return e.code, e.read().decode('utf-8', 'replace')
+
+
+##############################################################################
+# Think time
+
+
+def think_time(spec):
+    """Parse a think-time model into a function of a Random.
+
+    'exp:MEAN' (exponential, the default shape), 'uniform:LOW,HIGH',
+    'const:SECONDS', or '0' for none.
+    """
+
+    kind, _, args = spec.partition(':')
+    if kind in ('0', 'none'):
+        return lambda rng: 0
+    values = [float(arg) for arg in args.split(',')] if args else []
+    if kind == 'exp' and len(values) == 1:
+        return lambda rng: rng.expovariate(1 / values[0]) if values[0] else 0
+    if kind == 'uniform' and len(values) == 2:
+        return lambda rng: rng.uniform(*values)
+    if kind == 'const' and len(values) == 1:
+        return lambda rng: values[0]
+    raise click.BadParameter(f"unknown think-time model {spec!r}")
+
+
+def parse_mix(spec):
+    """Parse 'timeline=40,post=10,...' into {action: weight}."""
+
+    if not spec:
+        return dict(DEFAULT_MIX)
+    mix = {}
+    for part in spec.split(','):
+        action, _, weight = part.partition('=')
+        if action not in DEFAULT_MIX:
+            raise click.BadParameter(f"unknown action {action!r}")
+        mix[action] = float(weight)
+    return mix
+
+
+##############################################################################
+# Virtual users
+
+
+class ActionFailed(Exception):
+    """An action got an unexpected response."""
+
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+
+class VirtualUser:
+    """One logged-in user running actions against a client."""
+
+    def __init__(self, client, account, population, rng):
+        self.client = client
+        self.account = account
+        self.population = population
+        self.rng = rng
+        self.following = set(account['following'])
+        self.seen_messages = []
+        self.csrf_token = None
+        self.logged_in = False
+
+    def get(self, path, expect=200):
+        status, body = self.client.request('GET', path)
+        if status != expect:
+            raise ActionFailed(status)
+        # remember warbles on the page, to like later
+        seen = MESSAGE_LINK_RE.findall(body)
+        if seen:
+            self.seen_messages = seen[:50]
+        return body
+
+    def post(self, path, data=None, expect=302):
+        status, _ = self.client.request('POST', path, data or {})
+        if status != expect:
+            raise ActionFailed(status)
+
+    def form_token(self, path):
+        match = CSRF_RE.search(self.get(path))
+        self.csrf_token = match.group(1) if match else ''
+
+    def login(self):
+        self.logged_in = False
+        self.get('/logout', expect=302)
+        self.form_token('/login')
+        self.post('/login', {'username': self.account['username'],
+                             'password': self.population['password'],
+                             'csrf_token': self.csrf_token})
+        self.logged_in = True
+
+    def timeline(self):
+        self.get('/')
+
+    def profile(self):
+        self.get(f"/users/{self.pick_user()['id']}")
+
+    def post_warble(self):
+        if self.csrf_token is None:
+            self.form_token('/messages/new')
+        self.post('/messages/new', {'text': self.rng.choice(
+            self.population['texts']), 'csrf_token': self.csrf_token})
+
+    def like(self):
+        if not self.seen_messages:
+            self.timeline()
+            if not self.seen_messages:
+                return
+        message_id = self.rng.choice(self.seen_messages)
+        self.post(f"/users/add_like/{message_id}")
+
+    def follow(self):
+        """Follow a popular user, or unfollow one already followed."""
+
+        target = self.pick_user()['id']
+        if target == self.account['id']:
+            return
+        if target in self.following:
+            self.post(f"/users/stop-following/{target}")
+            self.following.discard(target)
+        else:
+            self.post(f"/users/follow/{target}")
+            self.following.add(target)
+
+    def pick_user(self):
+        return self.rng.choices(self.population['users'],
+                                self.population['weights'])[0]
+
+    ACTIONS = {
+        'login': login,
+        'timeline': timeline,
+        'profile': profile,
+        'post': post_warble,
+        'like': like,
+        'follow': follow,
+    }
+
+
+class Results:
+    """Latencies and outcomes per action, shared by all virtual users."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self.throttled = Counter()
+        self.statuses = defaultdict(Counter)
+        self._lock = threading.Lock()
+
+    def record(self, action, seconds, status):
+        with self._lock:
+            if status == 'ok':
+                self.latencies[action].append(seconds)
+            elif status == 429:
+                self.throttled[action] += 1
+            else:
+                self.errors[action] += 1
+            self.statuses[action][str(status)] += 1
+
+    def summary(self, elapsed):
+        actions = {}
+        for action in sorted(self.statuses):
+            latencies = sorted(self.latencies[action])
+            total = sum(self.statuses[action].values())
+            stats = {
+                'count': total,
+                'ok': len(latencies),
+                'errors': self.errors[action],
+                'throttled': self.throttled[action],
+                'error_rate': self.errors[action] / total,
+                'throughput': total / elapsed,
+                'statuses': dict(self.statuses[action]),
+            }
+            for p in PERCENTILES:
+                stats[f'p{p}_ms'] = percentile(latencies, p) * 1000
+            stats['max_ms'] = latencies[-1] * 1000 if latencies else 0
+            actions[action] = stats
+
+        count = sum(stats['count'] for stats in actions.values())
+        errors = sum(stats['errors'] for stats in actions.values())
+        return {
+            'elapsed': elapsed,
+            'count': count,
+            'throughput': count / elapsed if elapsed else 0,
+            'error_rate': errors / count if count else 0,
+            'actions': actions,
+        }
+
+
+def percentile(ordered, p):
+    """Nearest-rank percentile of a sorted list (0 if empty)."""
+
+    if not ordered:
+        return 0
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def run_load(make_client, population, mix, think, concurrency, duration,
+             warmup=0, seed=None):
+    """Run `concurrency` virtual users for `duration` seconds.
+
+    `make_client(n)` builds virtual user n's client. Actions that finish
+    during the first `warmup` seconds are not recorded.
+    """
+
+    population = dict(population)
+    population['weights'] = [user['followers'] + 1
+                             for user in population['users']]
+    actions, weights = zip(*mix.items())
+    results = Results()
+    start = time.monotonic()
+    measure_from = start + warmup
+    stop_at = measure_from + duration
+
+    def virtual_user(n):
+        rng = random.Random(None if seed is None else seed + n)
+        account = population['users'][n % len(population['users'])]
+        user = VirtualUser(make_client(n), account, population, rng)
+        action = 'login'
+
+        while time.monotonic() < stop_at:
+            began = time.monotonic()
+            try:
+                user.ACTIONS[action](user)
+                status = 'ok'
+            except ActionFailed as e:
+                status = e.status
+            except Exception as e:
+                status = type(e).__name__
+            finished = time.monotonic()
+            if finished >= measure_from:
+                results.record(action, finished - began, status)
+
+            time.sleep(max(0, min(think(rng), stop_at - time.monotonic())))
+            # a user whose login failed (or was throttled) tries again
+            action = (rng.choices(actions, weights)[0] if user.logged_in
+                      else 'login')
+
+    threads = [threading.Thread(target=virtual_user, args=(n,), daemon=True)
+               for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return results.summary(min(duration, time.monotonic() - measure_from))
+
+
+##############################################################################
+# CLI
+
+
+@click.group()
+def cli():
+    """Generate realistic load against Warbler."""
+
+
+@cli.command()
+@click.option('--prefix', default=PREFIX, help="Username prefix.")
+@click.option('--password', default=PASSWORD, help="Accounts' password.")
+@click.option('--population', 'population_file', default=POPULATION_FILE,
+              help="Where to save the accounts for `run`.")
+def prepare(prefix, password, population_file):
+    """Create the load-test accounts in the app's database."""
+
+    from app import create_app
+
+    create_app()
+    population = prepare_population(prefix, password)
+    os.makedirs(os.path.dirname(population_file) or '.', exist_ok=True)
+    with open(population_file, 'w') as f:
+        json.dump(population, f)
+    click.echo(f"{len(population['users'])} accounts saved to "
+               f"{population_file}.")
+
+
+@cli.command()
+@click.option('--target', default='app',
+              help="'app' for in-process, or the server's base URL.")
+@click.option('--config', 'profile', default='production',
+              help="Config profile, for an in-process target.")
+@click.option('--concurrency', '-c', default=10, help="Virtual users.")
+@click.option('--duration', '-d', default=30.0, help="Seconds to measure.")
+@click.option('--warmup', default=5.0, help="Seconds before measuring.")
+@click.option('--think', default='exp:1',
+              help="Think time: exp:MEAN, uniform:LOW,HIGH, const:S or 0.")
+@click.option('--mix', default='',
+              help="Action weights, e.g. timeline=40,post=10 "
+                   "(actions: " + ', '.join(DEFAULT_MIX) + ").")
+@click.option('--seed', type=int, help="Seed for repeatable choices.")
+@click.option('--population', 'population_file', default=POPULATION_FILE,
+              help="Accounts saved by `prepare`.")
+@click.option('--output', '-o', help="Write JSON results to this file.")
+def run(target, profile, concurrency, duration, warmup, think, mix, seed,
+        population_file, output):
+    """Drive the app with virtual users and report per-action latency."""
+
+    with open(population_file) as f:
+        population = json.load(f)
+
+    if target == 'app':
+        from app import create_app
+        app = create_app(profile)
+
+        def make_client(n):
+            return InProcessClient(app, f"10.{n >> 16 & 255}.{n >> 8 & 255}"
+                                        f".{n & 255}")
+    else:
+        def make_client(n):
+            return HTTPClient(target)
+
+    summary = run_load(make_client, population, parse_mix(mix),
+                       think_time(think), concurrency, duration, warmup, seed)
+    summary['config'] = dict(target=target, concurrency=concurrency,
+                             duration=duration, warmup=warmup, think=think,
+                             mix=parse_mix(mix), seed=seed)
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+    click.echo(f"{summary['count']} actions in {summary['elapsed']:.1f}s: "
+               f"{summary['throughput']:.1f}/s, "
+               f"{summary['error_rate']:.2%} errors")
+    click.echo(f"{'action':<10}{'count':>8}{'/s':>8}{'p50':>8}{'p90':>8}"
+               f"{'p99':>8}{'max':>8}{'err%':>7}{'429':>6}")
+    for action, stats in summary['actions'].items():
+        click.echo(f"{action:<10}{stats['count']:>8}{stats['throughput']:>8.1f}"
+                   f"{stats['p50_ms']:>8.1f}{stats['p90_ms']:>8.1f}"
+                   f"{stats['p99_ms']:>8.1f}{stats['max_ms']:>8.1f}"
+                   f"{stats['error_rate']:>7.1%}{stats['throttled']:>6}")
+
+
+if __name__ == '__main__':
+    cli()
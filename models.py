@@ -4,6 +4,10 @@ from datetime import datetime
 
 from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+
+import snowflake
 
 bcrypt = Bcrypt()
 db = SQLAlchemy()
@@ -32,6 +36,12 @@ class Likes(db.Model):
 
     __tablename__ = 'likes'
 
+    # a message can have many likes, but only one from each user
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'message_id'),
+        db.Index('ix_likes_message_id', 'message_id'),
+    )
+
     id = db.Column(
         db.Integer,
         primary_key=True
@@ -43,9 +53,8 @@ class Likes(db.Model):
     )
 
     message_id = db.Column(
-        db.Integer,
+        db.BigInteger,
         db.ForeignKey('messages.id', ondelete='cascade'),
-        unique=True
     )
 
     @classmethod
@@ -99,25 +108,46 @@ class User(db.Model):
         nullable=False,
     )
 
-    messages = db.relationship('Message')
+    # PageRank over the follow graph, scaled so the average user scores 1,
+    # and followers as of the same run; set by `flask influence refresh`
+    influence = db.Column(
+        db.Float,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    follower_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # passive_deletes: deleting a user leaves these rows to the database's
+    # ON DELETE CASCADE instead of loading them first
+    messages = db.relationship('Message', passive_deletes=True)
 
     followers = db.relationship(
         "User",
         secondary="follows",
         primaryjoin=(Follows.user_being_followed_id == id),
-        secondaryjoin=(Follows.user_following_id == id)
+        secondaryjoin=(Follows.user_following_id == id),
+        passive_deletes=True,
     )
 
     following = db.relationship(
         "User",
         secondary="follows",
         primaryjoin=(Follows.user_following_id == id),
-        secondaryjoin=(Follows.user_being_followed_id == id)
+        secondaryjoin=(Follows.user_being_followed_id == id),
+        passive_deletes=True,
     )
 
     likes = db.relationship(
         'Message',
-        secondary="likes"
+        secondary="likes",
+        passive_deletes=True,
     )
 
     def __repr__(self):
@@ -137,14 +167,73 @@ class User(db.Model):
             user for user in self.following if user == other_user]
         return len(found_user_list) == 1
 
+    def following_ids(self):
+        """Returns set of user id's followed by user.
+
+        Reads only the follows table, without loading the users.
+        """
+
+        return frozenset(user_id for user_id, in (
+            db.session
+            .query(Follows.user_being_followed_id)
+            .filter(Follows.user_following_id == self.id)))
+
+    def liked_message_ids(self):
+        """Returns set of id's of messages liked by user."""
+
+        return frozenset(message_id for message_id, in (
+            db.session
+            .query(Likes.message_id)
+            .filter(Likes.user_id == self.id)))
+
     def following_ids_list(self):
         """Returns list of user id's followed by user."""
 
-        return [follow.id for follow in self.following]
+        return sorted(self.following_ids())
 
     def liked_message_ids_list(self):
-        return [message.id for message in self.likes]
-        # return self.likes
+        return sorted(self.liked_message_ids())
+
+    def follow(self, user_id):
+        """Follow user `user_id`; return whether they weren't already.
+
+        Writes the one follows row, without loading `following`.
+        """
+
+        result = db.session.execute(
+            insert(Follows.__table__)
+            .values(user_following_id=self.id, user_being_followed_id=user_id)
+            .on_conflict_do_nothing())
+        return result.rowcount == 1
+
+    def stop_following(self, user_id):
+        """Unfollow user `user_id`; return whether they were followed."""
+
+        deleted = (Follows
+                   .query
+                   .filter_by(user_following_id=self.id,
+                              user_being_followed_id=user_id)
+                   .delete(synchronize_session=False))
+        return deleted == 1
+
+    def suggested_users(self, limit=5):
+        """Returns stored "who to follow" suggestions, best first.
+
+        Users followed since the suggestions were computed are left out.
+        """
+
+        already_following = (db.session
+                             .query(Follows.user_being_followed_id)
+                             .filter(Follows.user_following_id == self.id))
+
+        return (User
+                .query
+                .join(Suggestion, Suggestion.suggested_user_id == User.id)
+                .filter(Suggestion.user_id == self.id,
+                        ~User.id.in_(already_following))
+                .order_by(Suggestion.rank)
+                .limit(limit)
+                .all())
 
     @classmethod
     def signup(cls, username, email, password, image_url):
@@ -162,12 +251,15 @@ class User(db.Model):
             image_url=image_url,
         )
         
+        # a taken username or email raises IntegrityError; the unique
+        # constraints are the final word, whatever availability.py said
         try:
             db.session.add(user)
             db.session.commit()
-        except:
+        except IntegrityError:
             db.session.rollback()
-        
+            raise
+
         return user
 
     @classmethod
@@ -201,14 +293,25 @@ class User(db.Model):
         return cls.query.filter_by(username=username).one_or_none()
 
 
+# user lists, most influential first
+db.Index('ix_users_influence_id', User.influence.desc(), User.id)
+
+
 class Message(db.Model):
     """An individual message ("warble")."""
 
     __tablename__ = 'messages'
 
+    __table_args__ = (
+        db.Index('ix_messages_user_id_id', 'user_id', 'id'),
+    )
+
+    # time-ordered, so newest first is just id descending
     id = db.Column(
-        db.Integer,
+        db.BigInteger,
         primary_key=True,
+        autoincrement=False,
+        default=snowflake.message_id,
     )
 
     text = db.Column(
@@ -219,7 +322,7 @@ class Message(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        default=snowflake.message_timestamp,
     )
 
     user_id = db.Column(
@@ -236,6 +339,413 @@ class Message(db.Model):
         return f"<Message #{self.id}: {self.user.username}, {self.text}>"
 
 
+class MessageTag(db.Model):
+    """Hashtag used in a message."""
+
+    __tablename__ = 'message_tags'
+
+    tag = db.Column(
+        db.Text,
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.BigInteger,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+        index=True,
+    )
+
+
+class Mention(db.Model):
+    """@mention of a user in a message."""
+
+    __tablename__ = 'mentions'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.BigInteger,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+        index=True,
+    )
+
+
+class SearchPosting(db.Model):
+    """Entry in the message search index: `term` appears in a message."""
+
+    __tablename__ = 'search_postings'
+
+    term = db.Column(
+        db.Text,
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.BigInteger,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+        index=True,
+    )
+
+    weight = db.Column(
+        db.SmallInteger,
+        nullable=False,
+        default=1,
+    )
+
+
+class SearchTerm(db.Model):
+    """How many messages contain `term`, for ranking search results.
+
+    Refreshed in batches, so counts may lag behind the postings.
+    """
+
+    __tablename__ = 'search_terms'
+
+    term = db.Column(
+        db.Text,
+        primary_key=True,
+    )
+
+    doc_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+
+class Suggestion(db.Model):
+    """Precomputed "who to follow" suggestion for a user."""
+
+    __tablename__ = 'suggestions'
+
+    __table_args__ = (
+        db.Index('ix_suggestions_user_id_rank', 'user_id', 'rank'),
+    )
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    suggested_user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    shared_count = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+    rank = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+
+class Activity(db.Model):
+    """An entry in a user's activity feed: new followers, or likes of one
+    of their messages.
+
+    Events of the same kind (and message) are folded into one entry while
+    it is unread, so five likes make "5 people liked your warble". Entries
+    are ordered by `position`, the snowflake id of their latest event.
+    """
+
+    __tablename__ = 'activity'
+
+    __table_args__ = (
+        db.Index('ix_activity_user_id_position', 'user_id', 'position'),
+    )
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        nullable=False,
+    )
+
+    kind = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    message_id = db.Column(
+        db.BigInteger,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+    )
+
+    # the latest few actors, newest first
+    actor_ids = db.Column(
+        db.ARRAY(db.Integer),
+        nullable=False,
+    )
+
+    actor_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=1,
+    )
+
+    position = db.Column(
+        db.BigInteger,
+        nullable=False,
+    )
+
+    read = db.Column(
+        db.Boolean,
+        nullable=False,
+        default=False,
+    )
+
+    @property
+    def timestamp(self):
+        return snowflake.timestamp_of(self.position)
+
+
+# the unread entry that new events of a kind are folded into
+db.Index('uq_activity_unread', Activity.user_id, Activity.kind,
+         db.func.coalesce(Activity.message_id, 0),
+         unique=True, postgresql_where=~Activity.read)
+
+
+class ActivityActor(db.Model):
+    """Someone folded into an unread activity entry, so they count once."""
+
+    __tablename__ = 'activity_actors'
+
+    activity_id = db.Column(
+        db.Integer,
+        db.ForeignKey('activity.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    actor_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+
+class ActivityCounter(db.Model):
+    """How many unread activity entries a user has."""
+
+    __tablename__ = 'activity_counters'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    unread = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+
+class Job(db.Model):
+    """A unit of deferred work waiting in (or taken from) a job queue."""
+
+    __tablename__ = 'jobs'
+
+    __table_args__ = (
+        db.Index('ix_jobs_queue_status_run_at', 'queue', 'status', 'run_at'),
+    )
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    queue = db.Column(
+        db.Text,
+        nullable=False,
+        default='default',
+    )
+
+    task = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    payload = db.Column(
+        db.Text,
+        nullable=False,
+        default='{}',
+    )
+
+    status = db.Column(
+        db.Text,
+        nullable=False,
+        default='queued',
+    )
+
+    attempts = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    max_attempts = db.Column(
+        db.Integer,
+        nullable=False,
+        default=5,
+    )
+
+    idempotency_key = db.Column(
+        db.Text,
+        unique=True,
+    )
+
+    run_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    locked_at = db.Column(
+        db.DateTime,
+    )
+
+    locked_by = db.Column(
+        db.Text,
+    )
+
+    last_error = db.Column(
+        db.Text,
+    )
+
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    def __repr__(self):
+        return f"<Job #{self.id}: {self.queue}/{self.task}, {self.status}>"
+
+    @classmethod
+    def get_by_idempotency_key(cls, key):
+        """Return job enqueued under `key`, if any."""
+        return cls.query.filter_by(idempotency_key=key).one_or_none()
+
+
+##############################################################################
+# Archive store: messages older than the hot partition, moved out of
+# `messages` by `flask archive rollover`. Lives in the 'archive' bind,
+# possibly another database, so there are no foreign keys to users.
+
+
+class ArchivedMessage(db.Model):
+    """A message moved out of the hot `messages` table."""
+
+    __bind_key__ = 'archive'
+    __tablename__ = 'archived_messages'
+
+    __table_args__ = (
+        db.Index('ix_archived_messages_user_id_id', 'user_id', 'id'),
+    )
+
+    id = db.Column(
+        db.BigInteger,
+        primary_key=True,
+        autoincrement=False,
+    )
+
+    text = db.Column(
+        db.String(140),
+        nullable=False,
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    user_id = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+    partition = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    @property
+    def user(self):
+        return User.query.get(self.user_id)
+
+    def __repr__(self):
+        return f"<ArchivedMessage #{self.id}: {self.partition}, {self.text}>"
+
+
+class ArchivedLike(db.Model):
+    """A like of an archived message."""
+
+    __bind_key__ = 'archive'
+    __tablename__ = 'archived_likes'
+
+    message_id = db.Column(
+        db.BigInteger,
+        primary_key=True,
+    )
+
+    user_id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+
+class MessagePartition(db.Model):
+    """A month of messages that has been rolled into the archive."""
+
+    __bind_key__ = 'archive'
+    __tablename__ = 'message_partitions'
+
+    name = db.Column(
+        db.Text,
+        primary_key=True,
+    )
+
+    starts_at = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    ends_at = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    message_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    archived_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+
 def connect_db(app):
     """Connect this database to provided Flask app.
 
@@ -0,0 +1,309 @@
+"""Full-page cache for logged-out visitors.
+
+The anonymous home page, /login, /signup, profiles and single warbles look
+the same to everyone who isn't logged in, so views decorated with
+`cached()` keep their rendered page per path (query string included) and
+serve it to later anonymous requests without rendering or touching the
+database. A request counts as anonymous when its session holds nothing but
+a CSRF token: no logged-in user and no flashed messages. Anything else
+bypasses the cache.
+
+Each page names the data it shows as topics, such as ('user', 7), and is
+stored with the topics' current version numbers; writes bump the versions
+of the topics they touch, so a page rendered before a write is never
+served after it. Versions are bumped by ORM changes to users, messages and
+likes at flush and again at commit (as entity_cache does with its rows),
+and by `touch()` for writes made with Core statements. Versions live in
+this process, so writes made by other processes are only seen once the
+entry expires.
+
+Entries are fresh for TTL seconds. For STALE_TTL seconds after that the
+old page is still served, and the first request to find it stale renders
+a new one after its own response has gone out (stale-while-revalidate),
+so a popular page never makes a burst of visitors wait on the database.
+
+Forms carry a per-session CSRF token, so cached pages hold a placeholder
+that is replaced with the visitor's own token on the way out.
+"""
+
+import sys
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from functools import wraps
+
+from flask import current_app, g, request, session
+from flask_wtf.csrf import generate_csrf
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from models import User, Message, Likes
+
+TTL = 30
+STALE_TTL = 300
+MAX_BYTES = 64 * 1024 * 1024
+
+CSRF_PLACEHOLDER = b'__pagecache_csrf_token__'
+
+# anything else in the session means the visitor isn't anonymous
+ANONYMOUS_SESSION_KEYS = frozenset(['csrf_token'])
+
+Entry = namedtuple('Entry', 'fresh_until stale_until versions size status '
+                            'headers body')
+
+HIT = 'hit'
+STALE = 'stale'
+MISS = 'miss'
+
+
+class PageCache:
+    """LRU of rendered pages with per-topic versions; see the docstring."""
+
+    def __init__(self, ttl=TTL, stale_ttl=STALE_TTL, max_bytes=MAX_BYTES):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_bytes = max_bytes
+        # path -> Entry
+        self._entries = OrderedDict()
+        self._bytes = 0
+        # topic -> version; topics never written to are at 0
+        self._versions = {}
+        # paths being re-rendered after serving them stale
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.evictions = 0
+
+    def versions(self, topics):
+        with self._lock:
+            return tuple(self._versions.get(topic, 0) for topic in topics)
+
+    def touch(self, *topics):
+        """Mark `topics` changed, so pages showing them are re-rendered."""
+
+        with self._lock:
+            for topic in topics:
+                self._versions[topic] = self._versions.get(topic, 0) + 1
+
+    def lookup(self, path, versions):
+        """Return (entry, HIT or STALE or MISS, whether to refresh it).
+
+        Only the first request to find an entry stale is asked to refresh
+        it; the others are served the stale page meanwhile.
+        """
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None or entry.versions != versions \
+                    or entry.stale_until < now:
+                self.misses += 1
+                return None, MISS, False
+
+            self._entries.move_to_end(path)
+            if entry.fresh_until >= now:
+                self.hits += 1
+                return entry, HIT, False
+
+            self.stale_hits += 1
+            if path in self._refreshing:
+                return entry, STALE, False
+            self._refreshing.add(path)
+            return entry, STALE, True
+
+    def store(self, path, versions, response, csrf_token=None):
+        body = response.get_data()
+        if csrf_token:
+            body = body.replace(csrf_token.encode(), CSRF_PLACEHOLDER)
+        headers = [(name, value) for name, value in response.headers
+                   if name.lower() not in ('set-cookie', 'content-length')]
+        size = sys.getsizeof(body) + sys.getsizeof(path)
+        now = time.monotonic()
+        entry = Entry(now + self.ttl, now + self.ttl + self.stale_ttl,
+                      versions, size, response.status_code, headers, body)
+
+        with self._lock:
+            self._refreshing.discard(path)
+            old = self._entries.pop(path, None)
+            if old is not None:
+                self._bytes -= old.size
+
+            self._entries[path] = entry
+            self._bytes += size
+
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+                self.evictions += 1
+
+    def refresh_failed(self, path):
+        with self._lock:
+            self._refreshing.discard(path)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._refreshing.clear()
+
+    def stats(self):
+        """Counters and sizes, for monitoring."""
+
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'bypasses': self.bypasses,
+            'hit_rate': ((self.hits + self.stale_hits) / lookups
+                         if lookups else 0.0),
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+        }
+
+
+cache = PageCache()
+
+touch = cache.touch
+stats = cache.stats
+
+
+def init_app(app):
+    """Apply PAGE_CACHE_TTL / _STALE_TTL / _MAX_BYTES from config."""
+
+    cache.ttl = app.config.get('PAGE_CACHE_TTL', TTL)
+    cache.stale_ttl = app.config.get('PAGE_CACHE_STALE_TTL', STALE_TTL)
+    cache.max_bytes = app.config.get('PAGE_CACHE_MAX_BYTES', MAX_BYTES)
+
+
+##############################################################################
+# Views
+
+
+def anonymous():
+    return (request.method in ('GET', 'HEAD')
+            and session.keys() <= ANONYMOUS_SESSION_KEYS)
+
+
+def cached(topics=None):
+    """Decorate a view to cache its page for anonymous visitors.
+
+    `topics`, if given, is called with the view's arguments and returns the
+    topics the page shows.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**view_args):
+            if not (current_app.config['PAGE_CACHE'] and anonymous()):
+                cache.bypasses += 1
+                return view(**view_args)
+
+            path = request.full_path.rstrip('?')
+            page_topics = topics(**view_args) if topics else ()
+            versions = cache.versions(page_topics)
+
+            entry, state, refresh_needed = cache.lookup(path, versions)
+            if entry is None:
+                response = render(view, view_args)
+                if cacheable(response):
+                    cache.store(path, versions, response,
+                                g.get('csrf_token'))
+                response.headers['X-Page-Cache'] = MISS
+                return response
+
+            response = current_app.response_class(
+                fill_csrf(entry.body), status=entry.status,
+                headers=entry.headers)
+            response.headers['X-Page-Cache'] = state
+            if refresh_needed:
+                app = current_app._get_current_object()
+                response.call_on_close(
+                    lambda: refresh(app, path, view, view_args, page_topics))
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def render(view, view_args):
+    return current_app.make_response(view(**view_args))
+
+
+def cacheable(response):
+    # only pages that didn't put anything of the visitor's in the session
+    return (response.status_code == 200
+            and response.mimetype == 'text/html'
+            and not response.is_streamed
+            and anonymous())
+
+
+def fill_csrf(body):
+    if CSRF_PLACEHOLDER not in body:
+        return body
+    return body.replace(CSRF_PLACEHOLDER, generate_csrf().encode())
+
+
+def refresh(app, path, view, view_args, topics):
+    """Re-render a page served stale, after its response has been sent."""
+
+    try:
+        with app.test_request_context(path):
+            g.user = None
+            versions = cache.versions(topics)
+            response = render(view, view_args)
+            if cacheable(response):
+                cache.store(path, versions, response, g.get('csrf_token'))
+                return
+    except Exception:
+        app.logger.exception("page cache refresh of %s failed", path)
+    cache.refresh_failed(path)
+
+
+##############################################################################
+# Versions bumped by ORM writes
+
+PENDING_KEY = 'pagecache_pending'
+
+
+def topics_for(target):
+    if isinstance(target, User):
+        # other users' pages show their username and picture on warbles
+        return [('user', target.id), ('users',)]
+    if isinstance(target, Message):
+        return [('user', target.user_id), ('message', target.id)]
+    if isinstance(target, Likes):
+        return [('user', target.user_id)]
+    return []
+
+
+def _row_changed(mapper, connection, target):
+    topics = topics_for(target)
+    cache.touch(*topics)
+
+    # again after commit, in case the old data was re-rendered in between
+    session = inspect(target).session
+    if session is not None:
+        session.info.setdefault(PENDING_KEY, set()).update(topics)
+
+
+for _model in (User, Message, Likes):
+    event.listen(_model, 'after_update', _row_changed)
+    event.listen(_model, 'after_delete', _row_changed)
+for _model in (Message, Likes):
+    event.listen(_model, 'after_insert', _row_changed)
+
+
+@event.listens_for(Session, 'after_commit')
+def _after_commit(session):
+    cache.touch(*session.info.pop(PENDING_KEY, ()))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _after_rollback(session):
+    session.info.pop(PENDING_KEY, None)
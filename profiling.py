@@ -0,0 +1,292 @@
+"""On-demand profiling of individual requests.
+
+A request is profiled when it carries a valid X-Warbler-Profile header (a
+signed, expiring token from `flask profile token`), or when profiling has
+been switched on with `flask profile on --rate R`, in which case a random
+fraction R of requests (optionally only some endpoints) is profiled. The
+switch is a small JSON file in the instance folder, so it reaches every
+worker process without a restart.
+
+While a request runs, a sampler thread records the request thread's stack
+every PROFILE_INTERVAL seconds. Each sample is counted as SQL time if
+SQLAlchemy or the database driver is on the stack, template time if Jinja
+is, and Python time otherwise. The stacks are written to PROFILE_DIR in
+the folded format read by flamegraph.pl, speedscope and similar tools
+("frame;frame;frame count" per line), with the time split in a .json file
+alongside; only the newest PROFILE_RETENTION profiles are kept.
+"""
+
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+import click
+from flask import current_app, g, request
+from flask.cli import AppGroup
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+HEADER = 'X-Warbler-Profile'
+TOKEN_SALT = 'warbler-profile'
+TOKEN_MAX_AGE = 24 * 60 * 60
+
+INTERVAL = 0.002
+RETENTION = 100
+
+# how often each process re-reads the on/off switch
+SWITCH_CHECK_INTERVAL = 2
+
+SQL_MODULES = ('/sqlalchemy/', '/psycopg2/')
+TEMPLATE_MODULES = ('/jinja2/',)
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return (f"{code.co_name} ({os.path.basename(code.co_filename)}"
+            f":{code.co_firstlineno})")
+
+
+def classify(filenames):
+    """'sql', 'template' or 'python', for a stack's file names."""
+
+    if any(part in name for name in filenames for part in SQL_MODULES):
+        return 'sql'
+    if any(part in name for name in filenames for part in TEMPLATE_MODULES):
+        return 'template'
+    # compiled templates run under the template's own file name
+    if any(name.endswith('.html') for name in filenames):
+        return 'template'
+    return 'python'
+
+
+class StackSampler:
+    """Samples one thread's stack from a background thread."""
+
+    def __init__(self, thread_id, interval=INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.split = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self.started
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+
+            labels = []
+            filenames = []
+            while frame is not None:
+                labels.append(frame_label(frame))
+                filenames.append(frame.f_code.co_filename)
+                frame = frame.f_back
+
+            self.stacks[';'.join(reversed(labels))] += 1
+            self.split[classify(filenames)] += 1
+
+    def summary(self):
+        """Wall time in ms: total, and split by sql/template/python."""
+
+        samples = sum(self.split.values())
+        total = self.elapsed * 1000
+        result = {'total_ms': round(total, 1), 'samples': samples}
+        for kind in ('sql', 'template', 'python'):
+            share = self.split[kind] / samples if samples else 0
+            result[f'{kind}_ms'] = round(total * share, 1)
+        return result
+
+
+class Profiler:
+    """Decides which requests to profile and writes their profiles."""
+
+    def __init__(self, app):
+        self.directory = app.config['PROFILE_DIR']
+        self.switch_path = app.config['PROFILE_SWITCH']
+        self.interval = app.config.get('PROFILE_INTERVAL', INTERVAL)
+        self.retention = app.config.get('PROFILE_RETENTION', RETENTION)
+        self.serializer = URLSafeTimedSerializer(app.secret_key,
+                                                 salt=TOKEN_SALT)
+        self._switch = {}
+        self._switch_checked = 0
+        self._switch_mtime = None
+
+    def token(self):
+        return self.serializer.dumps('profile')
+
+    def valid_token(self, token):
+        try:
+            self.serializer.loads(token, max_age=TOKEN_MAX_AGE)
+            return True
+        except BadSignature:
+            return False
+
+    def switch(self):
+        """The on/off switch's settings, re-read every few seconds."""
+
+        now = time.monotonic()
+        if now - self._switch_checked < SWITCH_CHECK_INTERVAL:
+            return self._switch
+        self._switch_checked = now
+
+        try:
+            mtime = os.stat(self.switch_path).st_mtime
+            if mtime != self._switch_mtime:
+                with open(self.switch_path) as f:
+                    switch = json.load(f)
+                if not isinstance(switch, dict):
+                    raise ValueError("Profiling switch is not an object")
+                self._switch, self._switch_mtime = switch, mtime
+        except (OSError, ValueError):
+            # missing or unreadable: off, until it can be read
+            self._switch = {}
+            self._switch_mtime = None
+
+        return self._switch
+
+    def wanted(self):
+        """Should the current request be profiled?"""
+
+        token = request.headers.get(HEADER)
+        if token:
+            return self.valid_token(token)
+
+        switch = self.switch()
+        rate = switch.get('rate', 0)
+        endpoints = switch.get('endpoints')
+        # endpoints are named by view, without the blueprint
+        view = (request.endpoint or '').rpartition('.')[2]
+        if endpoints and view not in endpoints:
+            return False
+        return rate > 0 and random.random() < rate
+
+    def start(self):
+        if self.wanted():
+            g.profile_sampler = StackSampler(threading.get_ident(),
+                                             self.interval)
+            g.profile_sampler.start()
+
+    def finish(self, response):
+        sampler = g.pop('profile_sampler', None)
+        if sampler is not None:
+            name = self.write(sampler)
+            if request.headers.get(HEADER):
+                response.headers['X-Profile'] = name
+        return response
+
+    def abandon(self, exc):
+        # the request failed before after_request; keep what was sampled
+        sampler = g.pop('profile_sampler', None)
+        if sampler is not None:
+            self.write(sampler)
+
+    def write(self, sampler):
+        """Write the folded stacks file; return its name."""
+
+        sampler.stop()
+        summary = sampler.summary()
+        summary.update(endpoint=request.endpoint, path=request.full_path,
+                       method=request.method)
+
+        os.makedirs(self.directory, exist_ok=True)
+        endpoint = (request.endpoint or 'none').rpartition('.')[2]
+        millis = int(time.time() * 1000) % 1000
+        base = (f"{time.strftime('%Y%m%d-%H%M%S')}.{millis:03d}-{endpoint}"
+                f"-{os.getpid()}-{threading.get_ident() % 100000}")
+
+        with open(os.path.join(self.directory, base + '.folded'), 'w') as f:
+            for stack, count in sampler.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        with open(os.path.join(self.directory, base + '.json'), 'w') as f:
+            json.dump(summary, f)
+
+        self.prune()
+        return base + '.folded'
+
+    def prune(self):
+        """Delete all but the newest `retention` profiles."""
+
+        paths = [os.path.join(self.directory, name)
+                 for name in os.listdir(self.directory)
+                 if name.endswith('.folded')]
+        if len(paths) <= self.retention:
+            return
+
+        paths.sort(key=os.path.getmtime)
+        for path in paths[:-self.retention]:
+            for stale in (path, path[:-len('.folded')] + '.json'):
+                try:
+                    os.remove(stale)
+                except FileNotFoundError:
+                    pass
+
+
+def init_app(app):
+    """Install the profiling hooks; call before the views' hooks."""
+
+    app.config.setdefault('PROFILE_DIR',
+                          os.path.join(app.instance_path, 'profiles'))
+    app.config.setdefault('PROFILE_SWITCH',
+                          os.path.join(app.instance_path, 'profiling.json'))
+
+    profiler = Profiler(app)
+    app.before_request(profiler.start)
+    app.after_request(profiler.finish)
+    app.teardown_request(profiler.abandon)
+    app.cli.add_command(profile_cli)
+    return profiler
+
+
+##############################################################################
+# CLI: `flask profile ...`
+
+profile_cli = AppGroup('profile', help="Profile requests on demand.")
+
+
+@profile_cli.command('token')
+def token_command():
+    """Print a token for the X-Warbler-Profile header."""
+
+    click.echo(current_app.extensions['profiler'].token())
+
+
+@profile_cli.command('on')
+@click.option('--rate', default=0.01, help="Fraction of requests to profile.")
+@click.option('--endpoint', 'endpoints', multiple=True,
+              help="Only profile this view (repeatable).")
+def on_command(rate, endpoints):
+    """Profile a sample of requests in every worker."""
+
+    path = current_app.extensions['profiler'].switch_path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # workers must never read a half-written file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({'rate': rate, 'endpoints': list(endpoints)}, f)
+    os.replace(tmp_path, path)
+    click.echo(f"Profiling {rate:.1%} of requests.")
+
+
+@profile_cli.command('off')
+def off_command():
+    """Stop sampled profiling."""
+
+    try:
+        os.remove(current_app.extensions['profiler'].switch_path)
+    except FileNotFoundError:
+        pass
+    click.echo("Profiling off.")
@@ -0,0 +1,416 @@
+"""Live notifications of new warbles on home timelines.
+
+Browsers on the home page hold open a server-sent events stream, GET
+/events, and are told the ids of new warbles by authors they follow; the
+page then fetches just those warbles (/timeline/new) instead of being
+reloaded. Open streams are cheap on an asyncio event loop and expensive in
+a one-request-at-a-time WSGI worker, so /events is served by its own
+process, `python push.py`, with the front proxy sending /events there and
+everything else to server.py. The page only connects when PUSH_URL is set.
+
+The pieces:
+
+- `Hub`: in-process pub/sub on the push server's event loop. Each stream
+  subscribes with the set of authors its user follows (read once, when the
+  stream opens), so publishing a warble is a dict lookup of its author.
+- Brokers carry events from messages_add to the hub, and deliver them only
+  if the posting transaction commits. `PostgresBroker` is the multi-process
+  one: publishing is a NOTIFY in the posting transaction, and the push
+  server LISTENs, so any number of app workers reach any number of push
+  servers without a separate message bus. `MemoryBroker` hands events to a
+  hub in the same process, for tests and single-process setups.
+
+Streams are closed after STREAM_TTL seconds; the browser reconnects on its
+own, which picks up follows made in the meantime. Nothing is announced to
+a browser while it is disconnected, so a stream first replays, from the
+database, up to QUEUE_SIZE warbles newer than the reconnecting browser's
+Last-Event-ID (or, on the first connection, the page's newest warble,
+passed as ?after=).
+"""
+
+import asyncio
+import json
+import logging
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs, urlsplit
+
+import click
+from flask import current_app
+from itsdangerous import BadSignature
+from sqlalchemy import event, func, select
+
+from models import db, Follows, Message
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'warbler_messages'
+
+# seconds between keep-alive comments on an idle stream
+HEARTBEAT = 15
+STREAM_TTL = 600
+# events a slow stream may fall behind by before later ones are dropped
+QUEUE_SIZE = 100
+
+PENDING_KEY = 'push_pending'
+
+
+##############################################################################
+# Hub
+
+
+class Subscription:
+    """One open stream: its user, the authors they follow, its queue."""
+
+    def __init__(self, user_id, author_ids):
+        self.user_id = user_id
+        self.author_ids = frozenset(author_ids)
+        self.queue = asyncio.Queue(QUEUE_SIZE)
+        self.dropped = 0
+
+    def put(self, payload):
+        try:
+            self.queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            # the page only needs to know there is something newer
+            self.dropped += 1
+
+
+class Hub:
+    """Subscriptions indexed by followed author, on one event loop.
+
+    subscribe() and unsubscribe() run on the loop; publish() may be called
+    from any thread.
+    """
+
+    def __init__(self):
+        self.loop = None
+        # author id -> set of Subscriptions following them
+        self._by_author = {}
+        self.subscriptions = 0
+        self.published = 0
+        self.delivered = 0
+
+    def attach(self, loop):
+        self.loop = loop
+
+    def subscribe(self, user_id, author_ids):
+        subscription = Subscription(user_id, author_ids)
+        for author_id in subscription.author_ids:
+            self._by_author.setdefault(author_id, set()).add(subscription)
+        self.subscriptions += 1
+        return subscription
+
+    def unsubscribe(self, subscription):
+        for author_id in subscription.author_ids:
+            subscribers = self._by_author.get(author_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._by_author[author_id]
+        self.subscriptions -= 1
+
+    def publish(self, payload):
+        """Pass `payload`, a dict with the author's 'user_id', to followers."""
+
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._dispatch, payload)
+
+    def _dispatch(self, payload):
+        self.published += 1
+        for subscription in self._by_author.get(payload['user_id'], ()):
+            subscription.put(payload)
+            self.delivered += 1
+
+
+##############################################################################
+# Brokers
+
+
+class MemoryBroker:
+    """Hands committed events to a hub in this process."""
+
+    def __init__(self, hub):
+        self.hub = hub
+
+    def publish(self, payload):
+        db.session.info.setdefault(PENDING_KEY, []).append((self, payload))
+
+    def deliver(self, payload):
+        self.hub.publish(payload)
+
+    def listen(self, loop):
+        """Nothing to do: publishers already share the hub."""
+
+    def close(self, loop):
+        pass
+
+
+class PostgresBroker:
+    """Events travel as NOTIFY on CHANNEL; see the module docstring."""
+
+    def __init__(self, hub):
+        self.hub = hub
+        self._connection = None
+
+    def publish(self, payload):
+        # queued by Postgres and sent to listeners when this commits
+        db.session.execute(select([func.pg_notify(CHANNEL,
+                                                  json.dumps(payload))]))
+
+    def listen(self, loop):
+        """LISTEN on a dedicated connection, read by the event loop."""
+
+        fairy = db.engine.raw_connection()
+        fairy.detach()
+        connection = fairy.connection
+        connection.autocommit = True
+        connection.cursor().execute(f"LISTEN {CHANNEL}")
+        self._connection = connection
+        loop.add_reader(connection.fileno(), self._read)
+
+    def close(self, loop):
+        if self._connection is not None:
+            loop.remove_reader(self._connection.fileno())
+            self._connection.close()
+            self._connection = None
+
+    def _read(self):
+        self._connection.poll()
+        while self._connection.notifies:
+            notify = self._connection.notifies.pop(0)
+            try:
+                self.hub.publish(json.loads(notify.payload))
+            except ValueError:
+                logger.warning("bad payload on %s: %r", CHANNEL,
+                               notify.payload)
+
+
+BROKERS = {
+    'memory': MemoryBroker,
+    'postgres': PostgresBroker,
+}
+
+
+@event.listens_for(db.session, 'after_commit')
+def _deliver_pending(session):
+    for broker, payload in session.info.pop(PENDING_KEY, ()):
+        broker.deliver(payload)
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _drop_pending(session, previous_transaction):
+    session.info.pop(PENDING_KEY, None)
+
+
+def publish(message):
+    """Announce a new message to its author's followers, on commit."""
+
+    current_app.extensions['push'].publish(
+        # as strings: snowflake ids are too big for JavaScript numbers
+        {'id': str(message.id), 'user_id': message.user_id})
+
+
+def init_app(app):
+    """Create the broker named by PUSH_BROKER, with a hub for it."""
+
+    return BROKERS[app.config['PUSH_BROKER']](Hub())
+
+
+##############################################################################
+# Event stream server
+
+
+class PushServer:
+    """Serves GET /events on an asyncio loop; see the module docstring."""
+
+    def __init__(self, app, session_key, heartbeat=HEARTBEAT,
+                 stream_ttl=STREAM_TTL):
+        self.app = app
+        self.session_key = session_key
+        self.heartbeat = heartbeat
+        self.stream_ttl = stream_ttl
+        self.broker = app.extensions['push']
+        self.hub = self.broker.hub
+
+    async def start(self, host, port):
+        loop = asyncio.get_running_loop()
+        self.hub.attach(loop)
+        with self.app.app_context():
+            self.broker.listen(loop)
+        return await asyncio.start_server(self.handle, host, port)
+
+    def user_id(self, cookie_header):
+        """The logged-in user's id from the Flask session cookie, or None."""
+
+        morsel = SimpleCookie(cookie_header).get(self.app.session_cookie_name)
+        if morsel is None:
+            return None
+        serializer = self.app.session_interface.get_signing_serializer(
+            self.app)
+        max_age = self.app.permanent_session_lifetime.total_seconds()
+        try:
+            return serializer.loads(morsel.value, max_age=max_age).get(
+                self.session_key)
+        except BadSignature:
+            return None
+
+    def following_ids(self, user_id):
+        with self.app.app_context():
+            return frozenset(author_id for author_id, in (
+                db.session
+                .query(Follows.user_being_followed_id)
+                .filter(Follows.user_following_id == user_id)))
+
+    def missed(self, author_ids, after):
+        """Payloads for messages by `author_ids` newer than id `after`."""
+
+        if not author_ids:
+            return []
+        with self.app.app_context():
+            return [{'id': str(message_id), 'user_id': user_id}
+                    for message_id, user_id in (
+                        db.session
+                        .query(Message.id, Message.user_id)
+                        .filter(Message.user_id.in_(author_ids),
+                                Message.id > after)
+                        .order_by(Message.id)
+                        .limit(QUEUE_SIZE))]
+
+    async def handle(self, reader, writer):
+        try:
+            method, target, headers = await read_request(reader)
+        except (ValueError, ConnectionError, asyncio.IncompleteReadError):
+            writer.close()
+            return
+
+        try:
+            if method != 'GET' or urlsplit(target).path != '/events':
+                await respond(writer, '404 Not Found')
+                return
+
+            user_id = self.user_id(headers.get('cookie', ''))
+            if user_id is None:
+                # EventSource gives up on anything but a 200
+                await respond(writer, '401 Unauthorized')
+                return
+
+            author_ids = await asyncio.get_running_loop().run_in_executor(
+                None, self.following_ids, user_id)
+            await self.stream(writer, user_id, author_ids,
+                              last_seen(target, headers))
+        except (ConnectionError, asyncio.CancelledError):
+            # the browser went away, or the server is shutting down
+            pass
+        finally:
+            writer.close()
+
+    async def stream(self, writer, user_id, author_ids, after=None):
+        # subscribed before the replay, so nothing falls between the two
+        subscription = self.hub.subscribe(user_id, author_ids)
+        try:
+            writer.write(b"HTTP/1.1 200 OK\r\n"
+                         b"Content-Type: text/event-stream\r\n"
+                         b"Cache-Control: no-cache, no-transform\r\n"
+                         b"X-Accel-Buffering: no\r\n"
+                         b"Connection: close\r\n\r\n"
+                         b"retry: 5000\n\n")
+
+            loop = asyncio.get_running_loop()
+            replayed = set()
+            if after is not None:
+                for payload in await loop.run_in_executor(
+                        None, self.missed, author_ids, after):
+                    writer.write(event_bytes(payload))
+                    replayed.add(payload['id'])
+            await writer.drain()
+
+            closes_at = loop.time() + self.stream_ttl
+            while loop.time() < closes_at:
+                try:
+                    payload = await asyncio.wait_for(
+                        subscription.queue.get(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    writer.write(b": ping\n\n")
+                else:
+                    if payload['id'] in replayed:
+                        continue
+                    writer.write(event_bytes(payload))
+                await writer.drain()
+        finally:
+            self.hub.unsubscribe(subscription)
+
+
+def event_bytes(payload):
+    """A message event; its id comes back as Last-Event-ID on reconnect."""
+
+    return (f"id: {payload['id']}\nevent: message\n"
+            f"data: {json.dumps(payload)}\n\n").encode()
+
+
+def last_seen(target, headers):
+    """The newest message id the browser was told about, or None."""
+
+    value = headers.get('last-event-id')
+    if value is None:
+        value = parse_qs(urlsplit(target).query).get('after', [None])[0]
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+async def read_request(reader):
+    """Return (method, target, headers) of an HTTP/1.x request."""
+
+    request_line = (await reader.readuntil(b"\r\n")).decode('latin-1')
+    method, target, _ = request_line.split(' ', 2)
+
+    headers = {}
+    while True:
+        line = (await reader.readuntil(b"\r\n")).decode('latin-1')
+        if line == '\r\n':
+            return method, target, headers
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+        if len(headers) > 100:
+            raise ValueError("too many headers")
+
+
+async def respond(writer, status):
+    writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\n"
+                 f"Connection: close\r\n\r\n".encode())
+    await writer.drain()
+
+
+##############################################################################
+# `python push.py`
+
+
+@click.command()
+@click.option('--bind', '-b', default='127.0.0.1:8001', help="HOST:PORT.")
+@click.option('--config', 'profile', default='production',
+              help="Config profile to build the app with.")
+def main(bind, profile):
+    """Serve /events; needs PUSH_BROKER=postgres to hear other processes."""
+
+    from app import create_app, CURR_USER_KEY
+
+    logging.basicConfig(level=logging.INFO)
+    app = create_app(profile)
+    host, _, port = bind.rpartition(':')
+
+    async def serve():
+        server = await PushServer(app, CURR_USER_KEY).start(host or '0.0.0.0',
+                                                            int(port))
+        logger.info("push server listening on %s", bind)
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
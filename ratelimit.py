@@ -0,0 +1,202 @@
+"""Token-bucket rate limiting for expensive endpoints.
+
+Each policy gives an endpoint a bucket per client IP and/or per logged-in
+user. Buckets refill continuously at `limit / period` tokens per second up
+to `limit`, and every write request takes one token. The check runs as the
+first before_request hook and reads only the remote address and the signed
+session cookie, so a throttled request gets its 429 before any database
+query or bcrypt hash.
+
+Buckets live in a memory-mapped file shared by every worker process on the
+host (RATELIMIT_STORAGE), or in process memory when no file is configured.
+"""
+
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+
+from flask import request, session
+
+# endpoint -> {scope: (limit, period in seconds)}; scope is 'ip' or 'user'
+DEFAULT_POLICIES = {
+    'login': {'ip': (10, 60)},
+    'signup': {'ip': (5, 300)},
+    'messages_add': {'user': (30, 60), 'ip': (120, 60)},
+    'add_like': {'user': (60, 60), 'ip': (300, 60)},
+    'add_follow': {'user': (30, 60), 'ip': (120, 60)},
+}
+
+# reads don't hash passwords or write rows
+EXEMPT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS'])
+
+
+def refill(tokens, updated, now, rate, burst):
+    """Return a bucket's token count at `now`."""
+
+    return min(burst, tokens + (now - updated) * rate)
+
+
+class LocalBuckets:
+    """Token buckets in this process's memory."""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now):
+        """Take a token; return 0 if allowed, else seconds until one is."""
+
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = refill(tokens, updated, now, rate, burst)
+
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return (1 - tokens) / rate
+
+            self._buckets[key] = (tokens - 1, now)
+            return 0
+
+
+class SharedBuckets:
+    """Token buckets in a memory-mapped file shared between processes.
+
+    The file is a hash table of fixed-size slots (key hash, tokens, last
+    update), split into groups of GROUP slots. A key lives in one group,
+    which is locked with an fcntl byte-range lock while it is updated. When
+    a group is full, the least recently used bucket is recycled; a recycled
+    bucket starts full, which errs on the side of letting requests through.
+    """
+
+    SLOT = struct.Struct('=Qdd')
+    GROUP = 8
+
+    def __init__(self, path, slots=1 << 16):
+        self.groups = slots // self.GROUP
+        self.size = self.groups * self.GROUP * self.SLOT.size
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < self.size:
+            os.ftruncate(self._fd, self.size)
+        self._map = mmap.mmap(self._fd, self.size)
+
+        # fcntl locks belong to the process, so threads need their own lock
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now):
+        """Take a token; return 0 if allowed, else seconds until one is."""
+
+        digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+        # 0 marks an empty slot
+        key_hash = int.from_bytes(digest, 'little') | 1
+
+        group_size = self.GROUP * self.SLOT.size
+        start = (key_hash % self.groups) * group_size
+
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, group_size, start)
+            try:
+                offset = self._find_slot(key_hash, start)
+                slot_hash, tokens, updated = self.SLOT.unpack_from(
+                    self._map, offset)
+                if slot_hash != key_hash:
+                    tokens, updated = burst, now
+
+                tokens = refill(tokens, updated, now, rate, burst)
+                wait = 0 if tokens >= 1 else (1 - tokens) / rate
+                if not wait:
+                    tokens -= 1
+
+                self.SLOT.pack_into(self._map, offset, key_hash, tokens, now)
+                return wait
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, group_size, start)
+
+    def _find_slot(self, key_hash, start):
+        """Offset of the key's slot, else an empty one, else the stalest."""
+
+        empty = None
+        stalest, stalest_time = None, None
+
+        for i in range(self.GROUP):
+            offset = start + i * self.SLOT.size
+            slot_hash, _, updated = self.SLOT.unpack_from(self._map, offset)
+
+            if slot_hash == key_hash:
+                return offset
+            if slot_hash == 0:
+                if empty is None:
+                    empty = offset
+            elif stalest_time is None or updated < stalest_time:
+                stalest, stalest_time = offset, updated
+
+        return empty if empty is not None else stalest
+
+
+class RateLimiter:
+    """Applies per-endpoint policies to incoming requests."""
+
+    def __init__(self, buckets, policies, session_key):
+        self.buckets = buckets
+        self.policies = policies
+        self.session_key = session_key
+
+    def check(self):
+        """before_request hook: a 429 response if over a limit, else None."""
+
+        if request.method in EXEMPT_METHODS:
+            return None
+
+        # policies name the view, without its blueprint
+        view = (request.endpoint or '').rpartition('.')[2]
+        rules = self.policies.get(view)
+        if not rules:
+            return None
+
+        now = time.time()
+        wait = 0
+        for scope, (limit, period) in rules.items():
+            if scope == 'user':
+                ident = session.get(self.session_key)
+            else:
+                ident = request.remote_addr
+
+            if ident is None:
+                continue
+
+            key = f"{view}:{scope}:{ident}"
+            wait = max(wait, self.buckets.take(key, limit / period, limit, now))
+
+        if wait:
+            return ("Too many requests. Please slow down.", 429,
+                    {'Retry-After': str(int(wait) + 1)})
+
+        return None
+
+
+def init_app(app, session_key):
+    """Register the rate limit check; call before other before_request hooks.
+
+    `session_key` is the session entry holding the logged-in user's id.
+    """
+
+    if not app.config.get('RATELIMIT_ENABLED', True):
+        return None
+
+    path = app.config.get('RATELIMIT_STORAGE')
+    if path:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        buckets = SharedBuckets(path)
+    else:
+        buckets = LocalBuckets()
+
+    policies = dict(DEFAULT_POLICIES)
+    policies.update(app.config.get('RATELIMIT_POLICIES', {}))
+
+    limiter = RateLimiter(buckets, policies, session_key)
+    app.before_request(limiter.check)
+    return limiter
@@ -0,0 +1,160 @@
+"""Read-only projections of users and messages for list pages.
+
+The user lists (/users, followers, following) and message lists (profile,
+likes, mentions, tags, search, trending, home) only display their rows.
+Loaded as ORM instances, every row gets instance state, a place in the
+session's identity map and every column, password hashes included, all to
+be thrown away after rendering. Here those pages select just the columns
+they show with Core queries and get back namedtuples, which the session
+never sees. A page's messages share one Author tuple per author, looked
+up in a single query.
+
+Profile headers show counts, so they are counted in the database rather
+than by loading every message, follower and like.
+
+Anything that changes rows still goes through the models.
+"""
+
+from collections import namedtuple
+
+from sqlalchemy import func, select
+
+from models import db, User, Message, Follows, Likes
+
+UserCard = namedtuple('UserCard', 'id username image_url header_image_url bio')
+Author = namedtuple('Author', 'id username image_url')
+MessageItem = namedtuple('MessageItem', 'id text timestamp user_id user')
+UserStats = namedtuple('UserStats', 'messages following followers likes')
+
+users = User.__table__
+follows = Follows.__table__
+likes = Likes.__table__
+
+USER_CARD_COLUMNS = [users.c[name] for name in UserCard._fields]
+
+
+def execute(stmt, model=None):
+    """Run a Core statement in the session's transaction.
+
+    `model` picks the database for models on another bind (the archive).
+    """
+
+    mapper = model.__mapper__ if model is not None else None
+    return db.session.execute(stmt, mapper=mapper)
+
+
+##############################################################################
+# Users
+
+
+def user_cards(stmt):
+    return [UserCard._make(row) for row in execute(stmt)]
+
+
+def list_users(search=None):
+    """UserCards for all users, or those whose username contains `search`.
+
+    Most influential first (see influence.py), then oldest.
+    """
+
+    stmt = select(USER_CARD_COLUMNS).order_by(users.c.influence.desc(),
+                                              users.c.id)
+    if search:
+        stmt = stmt.where(users.c.username.like(f"%{search}%"))
+    return user_cards(stmt)
+
+
+def following(user_id):
+    """UserCards for the users `user_id` follows."""
+
+    return user_cards(
+        select(USER_CARD_COLUMNS)
+        .select_from(users.join(
+            follows, follows.c.user_being_followed_id == users.c.id))
+        .where(follows.c.user_following_id == user_id)
+        .order_by(users.c.id))
+
+
+def followers(user_id):
+    """UserCards for the users following `user_id`."""
+
+    return user_cards(
+        select(USER_CARD_COLUMNS)
+        .select_from(users.join(
+            follows, follows.c.user_following_id == users.c.id))
+        .where(follows.c.user_being_followed_id == user_id)
+        .order_by(users.c.id))
+
+
+def user_stats(user_id):
+    """A user's message, following, follower and like counts, in one query."""
+
+    def count(table, column):
+        return (select([func.count()])
+                .select_from(table)
+                .where(column == user_id)
+                .as_scalar())
+
+    messages = Message.__table__
+    row = execute(select([
+        count(messages, messages.c.user_id),
+        count(follows, follows.c.user_following_id),
+        count(follows, follows.c.user_being_followed_id),
+        count(likes, likes.c.user_id),
+    ])).first()
+    return UserStats._make(row)
+
+
+def authors(user_ids):
+    """{user id: Author} for `user_ids`."""
+
+    if not user_ids:
+        return {}
+    stmt = (select([users.c.id, users.c.username, users.c.image_url])
+            .where(users.c.id.in_(user_ids)))
+    return {row.id: Author._make(row) for row in execute(stmt)}
+
+
+##############################################################################
+# Messages
+
+
+def select_messages(model=Message):
+    """A select of the columns a MessageItem needs from `model`'s table."""
+
+    table = model.__table__
+    return select([table.c.id, table.c.text, table.c.timestamp,
+                   table.c.user_id])
+
+
+def message_items(stmt, model=Message):
+    """MessageItems, with authors, for the rows of a select_messages()."""
+
+    rows = execute(stmt, model).fetchall()
+    found = authors({row.user_id for row in rows})
+    return [MessageItem(row.id, row.text, row.timestamp, row.user_id,
+                        found.get(row.user_id))
+            for row in rows]
+
+
+def messages_by_ids(ids):
+    """MessageItems for message `ids`, in that order; missing ids are skipped."""
+
+    if not ids:
+        return []
+    messages = Message.__table__
+    found = {item.id: item for item in message_items(
+        select_messages().where(messages.c.id.in_(ids)))}
+    return [found[message_id] for message_id in ids if message_id in found]
+
+
+def liked_messages(user_id, limit=100):
+    """MessageItems a user has liked, newest first."""
+
+    messages = Message.__table__
+    return message_items(
+        select_messages()
+        .select_from(messages.join(likes, likes.c.message_id == messages.c.id))
+        .where(likes.c.user_id == user_id)
+        .order_by(messages.c.id.desc())
+        .limit(limit))
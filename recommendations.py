@@ -0,0 +1,122 @@
+"""Batch "who to follow" recommendations.
+
+The follow graph is loaded into a sparse adjacency matrix A, the transpose
+of followgraph.py's, where A[i, j] = 1 when user i follows user j. Row i of
+A @ A then counts, for every other user j, how many of the people i follows
+also follow j: the friends-of-friends candidates and their
+shared-connection counts. The top
+candidates per user are stored in the suggestions table, which the home
+page reads without doing any graph work.
+
+NumPy and SciPy are imported by the functions that use them, so web
+processes that only register the task and CLI don't load them.
+"""
+
+import click
+from flask.cli import AppGroup
+
+from followgraph import load_follow_matrix
+from jobs import task, enqueue
+from models import db, Suggestion
+
+TOP_N = 10
+BLOCK_SIZE = 2048
+# suggestion rows per bulk insert
+INSERT_BATCH = 100000
+
+
+def top_candidates(adjacency, top_n=TOP_N, block_size=BLOCK_SIZE):
+    """Yield (row, candidate_rows, shared_counts) for each user with any.
+
+    Candidates exclude the user and anyone they already follow, and are
+    ordered by shared count (ties broken by row). Rows are multiplied in
+    blocks so the friends-of-friends matrix never exists all at once.
+    """
+
+    import numpy as np
+    from scipy import sparse
+
+    size = adjacency.shape[0]
+
+    for start in range(0, size, block_size):
+        stop = min(start + block_size, size)
+        block = adjacency[start:stop]
+
+        counts = block @ adjacency
+        # drop existing follows and self-follows
+        counts = counts - counts.multiply(block)
+        counts = counts - counts.multiply(
+            sparse.eye(stop - start, size, k=start, format='csr'))
+        counts = sparse.csr_matrix(counts)
+        counts.eliminate_zeros()
+
+        for offset in range(stop - start):
+            lo, hi = counts.indptr[offset], counts.indptr[offset + 1]
+            if lo == hi:
+                continue
+
+            columns = counts.indices[lo:hi]
+            shared = counts.data[lo:hi]
+
+            if len(shared) > top_n:
+                keep = np.argpartition(-shared, top_n - 1)[:top_n]
+                columns, shared = columns[keep], shared[keep]
+
+            order = np.lexsort((columns, -shared))
+            yield start + offset, columns[order], shared[order]
+
+
+@task(queue='batch', max_attempts=3)
+def refresh_suggestions(top_n=TOP_N):
+    """Recompute and store suggestions for every user; return row count."""
+
+    user_ids, followers = load_follow_matrix()
+    adjacency = followers.T.tocsr()
+
+    Suggestion.query.delete(synchronize_session=False)
+
+    batch = []
+    total = 0
+    for row, columns, shared in top_candidates(adjacency, top_n):
+        user_id = int(user_ids[row])
+        for rank, (column, count) in enumerate(zip(columns, shared)):
+            batch.append(dict(user_id=user_id,
+                              suggested_user_id=int(user_ids[column]),
+                              shared_count=int(count),
+                              rank=rank))
+
+        if len(batch) >= INSERT_BATCH:
+            db.session.bulk_insert_mappings(Suggestion, batch)
+            total += len(batch)
+            batch = []
+
+    db.session.bulk_insert_mappings(Suggestion, batch)
+    total += len(batch)
+
+    # one transaction, so readers keep the old suggestions until it commits
+    db.session.commit()
+    return total
+
+
+##############################################################################
+# CLI: `flask suggestions ...`
+
+suggestions_cli = AppGroup(
+    'suggestions', help="Manage \"who to follow\" suggestions.")
+
+
+@suggestions_cli.command('refresh')
+@click.option('--top', 'top_n', default=TOP_N, help="Suggestions per user.")
+@click.option('--enqueue', 'defer', is_flag=True,
+              help="Queue a job for the worker instead of running now.")
+def refresh_command(top_n, defer):
+    """Recompute suggestions from the follow graph."""
+
+    if defer:
+        enqueue('refresh_suggestions', {'top_n': top_n})
+        db.session.commit()
+        click.echo("Queued suggestion refresh.")
+        return
+
+    total = refresh_suggestions(top_n)
+    click.echo(f"Stored {total} suggestions.")
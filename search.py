@@ -0,0 +1,289 @@
+"""Full-text message search backed by an inverted index.
+
+Every message is tokenized once when it is posted, and one row per distinct
+term is written to `search_postings` (term, message_id). The primary key
+keeps each term's posting list ordered by message id, so a query is driven
+by its rarest term, whose posting list is read newest first in windows of
+CANDIDATES postings. Each window's postings are checked against the other
+terms by primary-key lookups and ranked by tf-idf, and pages run through
+one window's matches before moving on to the next, older window. Every
+match is reachable by paging, and the work per page depends on
+CANDIDATES, not on how many messages exist.
+
+Per-term document counts for idf live in `search_terms` and are refreshed
+in batches by the `refresh_search_stats` job rather than on every post.
+"""
+
+import math
+import re
+import time
+from collections import Counter
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import and_, case, func, or_
+
+import readmodels
+from jobs import task, enqueue
+from models import db, Message, SearchPosting, SearchTerm
+
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+STOPWORDS = frozenset("""
+    a an and are as at be but by for from has have i if in into is it its
+    me my no not of on or our so that the their them then there these they
+    this to was we were what when which who will with you your
+""".split())
+
+# search_terms row holding the total number of indexed messages
+TOTAL_KEY = ''
+
+PER_PAGE = 20
+CANDIDATES = 5000
+WINDOWS_PER_PAGE = 20
+FETCH_SIZE = 10000
+STATS_INTERVAL = 60 * 60
+
+
+def tokenize(text):
+    """Return a Counter of the indexable terms in `text`."""
+
+    return Counter(term for term in TOKEN_RE.findall(text.lower())
+                   if len(term) > 1 and term not in STOPWORDS)
+
+
+def postings_for(message):
+    """Return posting mappings for a message that already has an id."""
+
+    return [dict(term=term, message_id=message.id, weight=count)
+            for term, count in tokenize(message.text).items()]
+
+
+def index_message(message):
+    """Add `message` to the index in the current transaction."""
+
+    if message.id is None:
+        db.session.flush()
+    db.session.bulk_insert_mappings(SearchPosting, postings_for(message))
+    schedule_stats_refresh()
+
+
+def schedule_stats_refresh():
+    """Queue a stats refresh in the current transaction."""
+
+    # at most one stats refresh per interval, however many messages arrive
+    bucket = int(time.time() // STATS_INTERVAL)
+    enqueue('refresh_search_stats',
+            idempotency_key=f"refresh_search_stats:{bucket}",
+            delay=STATS_INTERVAL)
+
+
+def unindex_message(message_id):
+    """Remove a message's postings in the current transaction."""
+
+    (SearchPosting
+     .query
+     .filter_by(message_id=message_id)
+     .delete(synchronize_session=False))
+
+
+def parse_cursor(cursor):
+    """Turn a "window:score:id" cursor into (window, (score, id)).
+
+    `window` is the message id that bounds the current window from above,
+    or None for the newest; the (score, id) of the last result shown is
+    None when the page ended at a window's end. Malformed cursors give
+    (None, None), the first page.
+    """
+
+    try:
+        window, score, message_id = cursor.split(':')
+        window = int(window) if window else None
+        if not score:
+            return window, None
+        return window, (float(score), int(message_id))
+    except (AttributeError, ValueError):
+        return None, None
+
+
+def format_cursor(window, last):
+    window = '' if window is None else window
+    if last is None:
+        return f"{window}::"
+    score, message_id = last
+    return f"{window}:{score!r}:{message_id}"
+
+
+def window_floor(term, window):
+    """The oldest message id in `term`'s window below `window`.
+
+    None when fewer than CANDIDATES postings are left, so this window runs
+    to the end of the posting list.
+    """
+
+    query = (db.session
+             .query(SearchPosting.message_id)
+             .filter(SearchPosting.term == term))
+    if window is not None:
+        query = query.filter(SearchPosting.message_id < window)
+    return (query
+            .order_by(SearchPosting.message_id.desc())
+            .offset(CANDIDATES - 1)
+            .limit(1)
+            .scalar())
+
+
+def ranked_window(terms, idf, rarest, window, floor, last, limit):
+    """Up to `limit` (message_id, score) matches from one window, best first."""
+
+    candidates = (db.session
+                  .query(SearchPosting.message_id)
+                  .filter(SearchPosting.term == rarest))
+    if window is not None:
+        candidates = candidates.filter(SearchPosting.message_id < window)
+    if floor is not None:
+        candidates = candidates.filter(SearchPosting.message_id >= floor)
+
+    score = func.sum(SearchPosting.weight
+                     * case(idf, value=SearchPosting.term)).label('score')
+
+    having = func.count() == len(terms)
+    if last is not None:
+        last_score, last_id = last
+        having = and_(having, or_(
+            score < last_score,
+            and_(score == last_score, SearchPosting.message_id < last_id)))
+
+    return (db.session
+            .query(SearchPosting.message_id, score)
+            .filter(SearchPosting.term.in_(terms),
+                    SearchPosting.message_id.in_(candidates.subquery()))
+            .group_by(SearchPosting.message_id)
+            .having(having)
+            .order_by(score.desc(), SearchPosting.message_id.desc())
+            .limit(limit)
+            .all())
+
+
+def search(query, limit=PER_PAGE, after=None):
+    """Return (messages, next_cursor) for messages matching every term.
+
+    Results are ordered newest window first, then by tf-idf score, then
+    newest first. Pass the returned cursor as `after` to get the next page.
+    A page may come up short, with a cursor, when its first
+    WINDOWS_PER_PAGE windows hold too few matches.
+    """
+
+    terms = list(tokenize(query))
+    if not terms:
+        return [], None
+
+    counts = dict(db.session
+                  .query(SearchTerm.term, SearchTerm.doc_count)
+                  .filter(SearchTerm.term.in_(terms + [TOTAL_KEY])))
+    total = counts.pop(TOTAL_KEY, 0)
+
+    # terms too new to have stats yet are treated as rare
+    idf = {term: math.log(1 + max(total, 1) / max(counts.get(term, 1), 1))
+           for term in terms}
+    rarest = min(terms, key=lambda term: counts.get(term, 0))
+
+    window, last = parse_cursor(after)
+    # (window, message_id, score) of this page's results, plus one more
+    results = []
+    for _ in range(WINDOWS_PER_PAGE):
+        floor = window_floor(rarest, window)
+        rows = ranked_window(terms, idf, rarest, window, floor, last,
+                             limit + 1 - len(results))
+        results.extend((window, row.message_id, row.score) for row in rows)
+
+        if len(results) > limit or floor is None:
+            break
+        window, last = floor, None
+    else:
+        # too many sparse windows; carry on from the next one next time
+        messages = readmodels.messages_by_ids(
+            [message_id for _, message_id, _ in results])
+        return messages, format_cursor(window, None)
+
+    next_cursor = None
+    if len(results) > limit:
+        results = results[:limit]
+        last_window, last_id, last_score = results[-1]
+        next_cursor = format_cursor(last_window, (last_score, last_id))
+
+    messages = readmodels.messages_by_ids(
+        [message_id for _, message_id, _ in results])
+    return messages, next_cursor
+
+
+@task(queue='batch', max_attempts=3)
+def refresh_search_stats():
+    """Recount how many messages contain each term."""
+
+    SearchTerm.query.delete(synchronize_session=False)
+
+    term_counts = (db.session
+                   .query(SearchPosting.term, func.count())
+                   .group_by(SearchPosting.term))
+    db.session.bulk_insert_mappings(
+        SearchTerm, [dict(term=term, doc_count=count)
+                     for term, count in term_counts])
+
+    db.session.add(SearchTerm(term=TOTAL_KEY,
+                              doc_count=Message.query.count()))
+    db.session.commit()
+
+
+def rebuild_index():
+    """Re-index every message from scratch; return how many were indexed."""
+
+    SearchPosting.query.delete(synchronize_session=False)
+
+    batch = []
+    indexed = 0
+    messages = (db.session
+                .query(Message.id, Message.text)
+                .yield_per(FETCH_SIZE))
+    for message in messages:
+        batch.extend(postings_for(message))
+        indexed += 1
+
+        if len(batch) >= FETCH_SIZE:
+            db.session.bulk_insert_mappings(SearchPosting, batch)
+            batch = []
+
+    db.session.bulk_insert_mappings(SearchPosting, batch)
+    db.session.commit()
+
+    refresh_search_stats()
+    return indexed
+
+
+##############################################################################
+# CLI: `flask search ...`
+
+search_cli = AppGroup('search', help="Manage the message search index.")
+
+
+@search_cli.command('rebuild')
+def rebuild_command():
+    """Index all existing messages."""
+
+    click.echo(f"Indexed {rebuild_index()} messages.")
+
+
+@search_cli.command('stats')
+@click.option('--enqueue', 'defer', is_flag=True,
+              help="Queue a job for the worker instead of running now.")
+def stats_command(defer):
+    """Refresh per-term document counts used for ranking."""
+
+    if defer:
+        enqueue('refresh_search_stats')
+        db.session.commit()
+        click.echo("Queued search stats refresh.")
+        return
+
+    refresh_search_stats()
+    click.echo("Refreshed search stats.")
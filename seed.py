@@ -1,9 +1,12 @@
 """Seed database with sample data from CSV Files."""
 
 from csv import DictReader
-from app import db
-from models import User, Message, Follows
+from app import create_app
+from models import db, User, Message, Follows
+from search import rebuild_index
+from tags import backfill
 
+create_app()
 
 db.drop_all()
 db.create_all()
@@ -18,3 +21,6 @@ with open('generator/follows.csv') as follows:
     db.session.bulk_insert_mappings(Follows, DictReader(follows))
 
 db.session.commit()
+
+rebuild_index()
+backfill()
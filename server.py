@@ -0,0 +1,199 @@
+"""Prefork production server.
+
+The master process builds the app once with the production profile, warms
+what every worker would otherwise build for itself (compiled templates,
+the username/email filters), binds the listening socket and forks the
+workers. Workers inherit the warm structures copy-on-write; gc.freeze()
+moves them out of the collector's reach, so collections in a worker don't
+touch (and copy) the shared pages.
+
+Each worker serves one request at a time from the shared socket and exits
+after --max-requests (plus a little jitter, so workers don't all recycle
+together); the master forks a replacement. On SIGTERM or SIGINT the master
+asks every worker to stop, and a worker finishes the request it is serving
+before exiting. Workers still busy after --graceful-timeout are killed.
+
+    python server.py --bind 0.0.0.0:8000 --workers 4 --max-requests 1000
+"""
+
+import gc
+import logging
+import os
+import random
+import signal
+import socket
+import time
+
+import click
+from werkzeug.serving import BaseWSGIServer
+
+import availability
+import trending
+from app import create_app
+from models import db
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 0.5
+
+
+def warm(app):
+    """Build read-only structures before forking, so workers share them."""
+
+    with app.app_context():
+        for name in app.jinja_env.list_templates():
+            app.jinja_env.get_template(name)
+        availability.registry.rebuild()
+
+        # connections must not be shared between processes
+        db.session.remove()
+        db.engine.dispose()
+
+
+def listen(address, backlog=2048):
+    host, _, port = address.rpartition(':')
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host or '0.0.0.0', int(port)))
+    sock.listen(backlog)
+
+    # workers race to accept; the losers get EAGAIN instead of blocking
+    sock.setblocking(False)
+    return sock
+
+
+class Arbiter:
+    """Forks workers on a shared socket and keeps their number up."""
+
+    def __init__(self, app, sock, workers=2, max_requests=1000,
+                 max_requests_jitter=50, graceful_timeout=30):
+        self.app = app
+        self.sock = sock
+        self.workers = workers
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.graceful_timeout = graceful_timeout
+        self.pids = set()
+        self.spawned = 0
+        self._stopping = False
+
+    def run(self):
+        """Fork workers and replace them as they exit, until signalled."""
+
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        gc.collect()
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+
+        while not self._stopping:
+            self._reap()
+            while len(self.pids) < self.workers and not self._stopping:
+                self._spawn()
+            time.sleep(POLL_INTERVAL)
+
+        self._shutdown()
+
+    def _stop(self, signum, frame):
+        self._stopping = True
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid:
+            self.pids.add(pid)
+            self.spawned += 1
+            return
+
+        try:
+            self._serve()
+        except Exception:
+            logger.exception("Worker %s crashed", os.getpid())
+            os._exit(1)
+        os._exit(0)
+
+    def _reap(self):
+        while self.pids:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if not pid:
+                return
+            self.pids.discard(pid)
+            if status:
+                logger.warning("Worker %s exited with status %s", pid, status)
+
+    def _shutdown(self):
+        for pid in self.pids:
+            os.kill(pid, signal.SIGTERM)
+
+        deadline = time.monotonic() + self.graceful_timeout
+        while self.pids and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(POLL_INTERVAL / 5)
+
+        for pid in self.pids:
+            logger.warning("Killing worker %s after graceful timeout", pid)
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        self.pids.clear()
+
+        self.sock.close()
+
+    def _serve(self):
+        """Worker: serve requests until recycled or told to stop."""
+
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(1))
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        random.seed()
+
+        limit = self.max_requests + random.randint(0, self.max_requests_jitter)
+        served = 0
+        app = self.app
+
+        def counted(environ, start_response):
+            nonlocal served
+            served += 1
+            return app(environ, start_response)
+
+        host, port = self.sock.getsockname()[:2]
+        # the fd stays non-blocking (set in listen()); leaving the socket
+        # object's timeout unset keeps handle_request() waiting in select()
+        server = BaseWSGIServer(host, port, counted, fd=self.sock.fileno())
+        # wake up now and then to notice a stop signal
+        server.timeout = POLL_INTERVAL
+
+        while not stopping and (not self.max_requests or served < limit):
+            server.handle_request()
+
+        server.socket.close()
+        # os._exit() skips the snapshot thread's next save
+        trending.flush()
+
+
+@click.command()
+@click.option('--bind', '-b', default='127.0.0.1:8000', help="HOST:PORT.")
+@click.option('--workers', '-w', default=os.cpu_count() or 1,
+              help="Worker processes.")
+@click.option('--max-requests', default=1000,
+              help="Recycle a worker after this many requests (0: never).")
+@click.option('--max-requests-jitter', default=50,
+              help="Random extra requests per worker.")
+@click.option('--graceful-timeout', default=30,
+              help="Seconds workers get to finish on shutdown.")
+@click.option('--config', 'profile', default='production',
+              help="Config profile.")
+def main(bind, workers, max_requests, max_requests_jitter, graceful_timeout,
+         profile):
+    logging.basicConfig(level=logging.INFO)
+
+    app = create_app(profile)
+    warm(app)
+    sock = listen(bind)
+
+    logger.info("Listening on %s with %s workers", bind, workers)
+    Arbiter(app, sock, workers, max_requests, max_requests_jitter,
+            graceful_timeout).run()
+
+
+if __name__ == '__main__':
+    main()
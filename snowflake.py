@@ -0,0 +1,193 @@
+"""Time-ordered 63-bit ids for messages.
+
+An id packs, from the high bits down:
+
+    41 bits  milliseconds since EPOCH (good until 2069)
+    10 bits  worker id, unique among processes writing at the same time
+    12 bits  sequence within the millisecond
+
+so sorting by id sorts by creation time, and a time range is an id range.
+
+Each process claims a worker id the first time it makes one, by taking a
+Postgres advisory lock in WORKER_LOCK_SPACE on a connection it keeps open;
+the lock is released when the process exits. A fixed id can be set with
+SNOWFLAKE_WORKER_ID instead.
+
+As column defaults, message_id() and message_timestamp() make a message's
+id and timestamp agree: a new message gets the current time in both, and a
+message inserted with an explicit (e.g. historical) timestamp gets an id at
+that time. Such backfilled ids count their own sequence per millisecond;
+past 4096 in one millisecond they carry into the next, so the id's time
+can be a little after the given timestamp, but ids never repeat within the
+BACKFILL_MILLIS milliseconds most recently backfilled.
+"""
+
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+
+EPOCH = datetime(2000, 1, 1)
+
+TIME_BITS = 41
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+
+MAX_WORKER_ID = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+WORKER_SHIFT = SEQUENCE_BITS
+TIME_SHIFT = WORKER_BITS + SEQUENCE_BITS
+
+WORKER_LOCK_SPACE = 0x77617262
+
+# milliseconds whose backfill sequence is remembered
+BACKFILL_MILLIS = 65536
+
+
+def to_millis(when):
+    return (when - EPOCH) // timedelta(milliseconds=1)
+
+
+def timestamp_of(snowflake_id):
+    """Return the (millisecond precision) time `snowflake_id` was made at."""
+
+    return EPOCH + timedelta(milliseconds=snowflake_id >> TIME_SHIFT)
+
+
+def first_id_at(when):
+    """Smallest id made at or after `when`, for id range queries."""
+
+    return max(0, to_millis(when)) << TIME_SHIFT
+
+
+class Snowflake:
+    """Generates unique, increasing ids for one process."""
+
+    def __init__(self, worker_id=None):
+        self.worker_id = worker_id
+        self._lock = threading.Lock()
+        self._last = -1
+        self._sequence = 0
+        # backfilled millisecond -> last sequence used in it
+        self._backfill = OrderedDict()
+        self._pid = os.getpid()
+        self._lock_conn = None
+        # connections inherited across fork(); kept so they're never closed
+        self._inherited = []
+
+    def next_id(self, engine=None, at=None):
+        """Return a new id, at `at` (a datetime) if given, else now."""
+
+        with self._lock:
+            worker_id = self._worker_id(engine)
+
+            if at is not None:
+                # backfilled rows don't advance the clock
+                return self._backfill_id(to_millis(at), worker_id)
+
+            now = to_millis(datetime.utcnow())
+            if now < self._last:
+                # clock went backwards; keep counting from where we were
+                now = self._last
+
+            if now == self._last:
+                self._sequence = (self._sequence + 1) & MAX_SEQUENCE
+                if self._sequence == 0:
+                    # used up this millisecond
+                    while now <= self._last:
+                        time.sleep(0.0001)
+                        now = to_millis(datetime.utcnow())
+            else:
+                self._sequence = 0
+
+            self._last = now
+            return self._pack(now, worker_id, self._sequence)
+
+    def _backfill_id(self, millis, worker_id):
+        sequence = self._backfill.get(millis, -1) + 1
+        while sequence > MAX_SEQUENCE:
+            # used up this millisecond; carry into the next
+            millis += 1
+            sequence = self._backfill.get(millis, -1) + 1
+
+        self._backfill[millis] = sequence
+        self._backfill.move_to_end(millis)
+        if len(self._backfill) > BACKFILL_MILLIS:
+            self._backfill.popitem(last=False)
+
+        return self._pack(millis, worker_id, sequence)
+
+    def _pack(self, millis, worker_id, sequence):
+        if not 0 <= millis < 1 << TIME_BITS:
+            raise ValueError(f"Time out of range for an id: {millis} ms")
+        return (millis << TIME_SHIFT) | (worker_id << WORKER_SHIFT) | sequence
+
+    def _worker_id(self, engine):
+        if os.getpid() != self._pid:
+            # forked: the parent's worker id and lock are the parent's
+            self._pid = os.getpid()
+            if self._lock_conn is not None:
+                self._inherited.append(self._lock_conn)
+                self._lock_conn = None
+                self.worker_id = None
+            self._last = -1
+
+        if self.worker_id is None:
+            if engine is None:
+                raise RuntimeError("No worker id, and no engine to claim one")
+            self.worker_id, self._lock_conn = claim_worker_id(engine)
+
+        return self.worker_id
+
+
+def claim_worker_id(engine):
+    """Lock a free worker id; return (worker id, connection holding it)."""
+
+    conn = engine.connect()
+    candidates = list(range(MAX_WORKER_ID + 1))
+    random.shuffle(candidates)
+
+    for worker_id in candidates:
+        if conn.execute(select([func.pg_try_advisory_lock(
+                WORKER_LOCK_SPACE, worker_id)])).scalar():
+            return worker_id, conn
+
+    conn.close()
+    raise RuntimeError("All snowflake worker ids are in use")
+
+
+generator = Snowflake()
+
+
+def init_app(app):
+    """Use SNOWFLAKE_WORKER_ID from config, if set."""
+
+    worker_id = app.config.get('SNOWFLAKE_WORKER_ID')
+    if worker_id is not None:
+        if not 0 <= int(worker_id) <= MAX_WORKER_ID:
+            raise ValueError(f"SNOWFLAKE_WORKER_ID must be 0-{MAX_WORKER_ID}")
+        generator.worker_id = int(worker_id)
+
+
+##############################################################################
+# Column defaults
+
+
+def _given_timestamp(context):
+    value = context.current_parameters.get('timestamp')
+    if isinstance(value, str):
+        # rows loaded from CSV
+        value = datetime.fromisoformat(value)
+    return value
+
+
+def message_id(context):
+    return generator.next_id(context.engine, at=_given_timestamp(context))
+
+
+def message_timestamp(context):
+    return timestamp_of(context.current_parameters['id'])
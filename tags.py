@@ -0,0 +1,159 @@
+"""Hashtags and @mentions, extracted once when a message is written.
+
+Each #tag and each mentioned user gets a row in `message_tags` or
+`mentions`, keyed so that one tag's (or user's) messages are a primary-key
+range ordered by message id. Tag and mention pages are then index range
+scans with keyset pagination instead of LIKE scans over message text.
+"""
+
+import re
+
+import click
+from flask.cli import AppGroup
+
+import readmodels
+from models import db, Message, MessageTag, Mention, User
+
+HASHTAG_RE = re.compile(r"(?<![\w#])#(\w{1,64})")
+MENTION_RE = re.compile(r"(?<![\w@])@(\w+)")
+
+PER_PAGE = 20
+FETCH_SIZE = 10000
+
+
+def extract(text):
+    """Return (hashtags, usernames) found in `text`.
+
+    Hashtags are lowercased; usernames are kept as written, since they are
+    matched exactly.
+    """
+
+    hashtags = {tag.lower() for tag in HASHTAG_RE.findall(text)}
+    usernames = set(MENTION_RE.findall(text))
+    return hashtags, usernames
+
+
+def rows_for(messages):
+    """Return (tag rows, mention rows) for messages that already have ids."""
+
+    tag_rows = []
+    mentioned = []
+    for message in messages:
+        hashtags, usernames = extract(message.text)
+        tag_rows.extend(dict(tag=tag, message_id=message.id)
+                        for tag in hashtags)
+        mentioned.extend((username, message.id) for username in usernames)
+
+    if mentioned:
+        user_ids = dict(db.session
+                        .query(User.username, User.id)
+                        .filter(User.username.in_({username for username, _
+                                                   in mentioned})))
+        mention_rows = [dict(user_id=user_ids[username], message_id=message_id)
+                        for username, message_id in mentioned
+                        if username in user_ids]
+    else:
+        mention_rows = []
+
+    return tag_rows, mention_rows
+
+
+def record_messages(messages):
+    """Write tag and mention rows for messages that already have ids."""
+
+    tag_rows, mention_rows = rows_for(messages)
+    db.session.bulk_insert_mappings(Mention, mention_rows)
+    db.session.bulk_insert_mappings(MessageTag, tag_rows)
+
+
+def record_message(message):
+    """Write a new message's tag and mention rows in this transaction."""
+
+    if message.id is None:
+        db.session.flush()
+    record_messages([message])
+
+
+def page(stmt, key_column, before=None, limit=PER_PAGE):
+    """Return (messages, next_before) for a keyset page, newest first.
+
+    `stmt` is a readmodels.select_messages() joined to the index table
+    whose message id column is `key_column`; messages are MessageItems.
+    """
+
+    if before is not None:
+        stmt = stmt.where(key_column < before)
+
+    messages = readmodels.message_items(
+        stmt.order_by(key_column.desc()).limit(limit + 1))
+
+    next_before = None
+    if len(messages) > limit:
+        messages = messages[:limit]
+        next_before = messages[-1].id
+
+    return messages, next_before
+
+
+def tagged_messages(tag, before=None, limit=PER_PAGE):
+    """Return a page of messages using #`tag`."""
+
+    messages = Message.__table__
+    message_tags = MessageTag.__table__
+    stmt = (readmodels.select_messages()
+            .select_from(messages.join(
+                message_tags, message_tags.c.message_id == messages.c.id))
+            .where(message_tags.c.tag == tag.lower()))
+    return page(stmt, message_tags.c.message_id, before, limit)
+
+
+def mentioning_messages(user_id, before=None, limit=PER_PAGE):
+    """Return a page of messages that @mention user `user_id`."""
+
+    messages = Message.__table__
+    mentions = Mention.__table__
+    stmt = (readmodels.select_messages()
+            .select_from(messages.join(
+                mentions, mentions.c.message_id == messages.c.id))
+            .where(mentions.c.user_id == user_id))
+    return page(stmt, mentions.c.message_id, before, limit)
+
+
+def backfill():
+    """Rebuild tag and mention rows for every message; return the count.
+
+    Reads the messages table, which seed.py fills from
+    generator/messages.csv, in batches.
+    """
+
+    MessageTag.query.delete(synchronize_session=False)
+    Mention.query.delete(synchronize_session=False)
+
+    batch = []
+    count = 0
+    for message in (db.session
+                    .query(Message.id, Message.text)
+                    .yield_per(FETCH_SIZE)):
+        batch.append(message)
+        count += 1
+
+        if len(batch) >= FETCH_SIZE:
+            record_messages(batch)
+            batch = []
+
+    record_messages(batch)
+    db.session.commit()
+    return count
+
+
+##############################################################################
+# CLI: `flask tags ...`
+
+tags_cli = AppGroup('tags', help="Manage hashtag and mention indexes.")
+
+
+@tags_cli.command('backfill')
+def backfill_command():
+    """Extract hashtags and mentions from all existing messages."""
+
+    click.echo(f"Processed {backfill()} messages.")
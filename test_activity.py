@@ -0,0 +1,164 @@
+"""Activity feed tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_activity.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Likes, Activity
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import activity
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class ActivityTestCase(TestCase):
+    """Test feed entries written by follows and likes."""
+
+    def setUp(self):
+        Likes.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        self.client = app.test_client()
+
+        users = [User(email=f"{name}@test.com", username=name,
+                      password="HASHED_PASSWORD")
+                 for name in ('alice', 'fan1', 'fan2', 'fan3', 'fan4',
+                              'fan5')]
+        db.session.add_all(users)
+        db.session.commit()
+        self.alice_id = users[0].id
+        self.fan_ids = [u.id for u in users[1:]]
+
+        messages = [Message(text=f"warble {n}", user_id=self.alice_id)
+                    for n in range(3)]
+        db.session.add_all(messages)
+        db.session.commit()
+        self.message_ids = [m.id for m in messages]
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def like(self, user_id, message_id):
+        with self.client as c:
+            self.login(c, user_id)
+            return c.post(f"/users/add_like/{message_id}")
+
+    def test_likes_collapse(self):
+        """Do likes of one warble fold into one entry, newest actors first?"""
+
+        for fan_id in self.fan_ids:
+            self.like(fan_id, self.message_ids[0])
+
+        entries, _ = activity.feed(self.alice_id)
+
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0].actor_count, 5)
+        self.assertEqual([u.id for u in entries[0].actors],
+                         self.fan_ids[::-1][:activity.ACTORS_SHOWN])
+        self.assertEqual(entries[0].message.id, self.message_ids[0])
+        self.assertEqual(activity.unread_count(self.alice_id), 1)
+        self.assertEqual(Likes.query.count(), 5)
+
+    def test_repeats_count_once(self):
+        """Does liking or following again count the same person once?"""
+
+        fan_id, other_id = self.fan_ids[:2]
+        self.like(fan_id, self.message_ids[0])
+        with self.client as c:
+            self.login(c, fan_id)
+            c.post(f"/users/remove_like/{self.message_ids[0]}")
+            c.post(f"/users/add_like/{self.message_ids[0]}")
+            for _ in range(2):
+                c.post(f"/users/follow/{self.alice_id}")
+                c.post(f"/users/stop-following/{self.alice_id}")
+        self.like(other_id, self.message_ids[0])
+
+        entries, _ = activity.feed(self.alice_id)
+        counts = {entry.kind: entry.actor_count for entry in entries}
+        actors = {entry.kind: [u.id for u in entry.actors]
+                  for entry in entries}
+
+        self.assertEqual(counts, {activity.LIKE: 2, activity.FOLLOW: 1})
+        self.assertEqual(actors[activity.LIKE], [other_id, fan_id])
+        self.assertEqual(actors[activity.FOLLOW], [fan_id])
+
+    def test_kinds_and_messages_kept_apart(self):
+        """Are follows, and likes of different warbles, separate entries?"""
+
+        self.like(self.fan_ids[0], self.message_ids[0])
+        self.like(self.fan_ids[0], self.message_ids[1])
+        with self.client as c:
+            self.login(c, self.fan_ids[1])
+            c.post(f"/users/follow/{self.alice_id}")
+
+        entries, _ = activity.feed(self.alice_id)
+
+        self.assertEqual([e.kind for e in entries], ['follow', 'like', 'like'])
+        self.assertEqual(activity.unread_count(self.alice_id), 3)
+
+    def test_reading_starts_new_entries(self):
+        """Does viewing the feed mark it read, so new events start anew?"""
+
+        self.like(self.fan_ids[0], self.message_ids[0])
+
+        with self.client as c:
+            self.login(c, self.alice_id)
+            html = c.get("/activity").get_data(as_text=True)
+            self.assertIn("@fan1", html)
+            self.assertIn("liked your warble", html)
+            self.assertNotIn('id="unread-activity"', html)
+
+        self.assertEqual(activity.unread_count(self.alice_id), 0)
+
+        self.like(self.fan_ids[1], self.message_ids[0])
+
+        self.assertEqual(Activity.query.count(), 2)
+        self.assertEqual(activity.unread_count(self.alice_id), 1)
+
+        with self.client as c:
+            self.login(c, self.alice_id)
+            html = c.get("/").get_data(as_text=True)
+            self.assertIn('id="unread-activity"', html)
+
+    def test_own_actions_not_recorded(self):
+        self.like(self.alice_id, self.message_ids[0])
+        with self.client as c:
+            self.login(c, self.alice_id)
+            c.post(f"/users/follow/{self.alice_id}")
+
+        self.assertEqual(Activity.query.count(), 0)
+
+    def test_pages(self):
+        """Is the feed paged newest first without repeats?"""
+
+        for fan_id in self.fan_ids:
+            for message_id in self.message_ids:
+                activity.record(self.alice_id, activity.LIKE, fan_id,
+                                message_id)
+            activity.mark_read(self.alice_id)
+        db.session.commit()
+
+        first, before = activity.feed(self.alice_id, limit=10)
+        second, after = activity.feed(self.alice_id, before=before, limit=10)
+
+        self.assertEqual(len(first), 10)
+        self.assertEqual(len(second), 5)
+        self.assertIsNone(after)
+        positions = [e.position for e in first + second]
+        self.assertEqual(positions, sorted(set(positions), reverse=True))
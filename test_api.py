@@ -0,0 +1,138 @@
+"""Batch JSON API tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_api.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from sqlalchemy import event
+
+from models import (db, User, Message, Follows, Likes, ArchivedMessage,
+                    ArchivedLike, MessagePartition)
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+import api
+import archive
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class ApiTestCase(TestCase):
+    """Test /api/users and /api/messages."""
+
+    def setUp(self):
+        ArchivedLike.query.delete()
+        ArchivedMessage.query.delete()
+        MessagePartition.query.delete()
+        Likes.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+        db.session.commit()
+        archive._boundary = (None, 0)
+
+        self.client = app.test_client()
+
+        users = [User(email=f"{name}@test.com", username=name,
+                      password="HASHED_PASSWORD", bio=f"I am {name}")
+                 for name in ('alice', 'bob', 'carol')]
+        db.session.add_all(users)
+        db.session.commit()
+        self.alice_id, self.bob_id, self.carol_id = [u.id for u in users]
+
+        messages = [Message(text=f"warble {n}", user_id=self.bob_id)
+                    for n in range(3)]
+        db.session.add_all(messages)
+        db.session.commit()
+        self.message_ids = [m.id for m in messages]
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def count_queries(self):
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        self.addCleanup(event.remove, db.engine, 'before_cursor_execute',
+                        record)
+        return statements
+
+    def test_users_in_requested_order(self):
+        """Are users returned as asked for, with missing ids reported?"""
+
+        statements = self.count_queries()
+        resp = self.client.get(
+            f"/api/users?ids={self.carol_id},0,{self.alice_id},{self.carol_id}")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(statements), 1)
+        self.assertEqual([u['username'] for u in resp.json['users']],
+                         ['carol', 'alice'])
+        self.assertEqual(resp.json['missing'], [0])
+        self.assertNotIn('email', resp.json['users'][0])
+        self.assertNotIn('password', resp.json['users'][0])
+
+    def test_field_mask(self):
+        resp = self.client.get(
+            f"/api/users?ids={self.bob_id}&fields=bio,username")
+
+        self.assertEqual(resp.json['users'],
+                         [{'id': self.bob_id, 'bio': "I am bob",
+                           'username': 'bob'}])
+
+    def test_bad_requests(self):
+        for query in ("", "ids=", "ids=1,x", "ids=1&fields=email",
+                      "ids=" + ",".join(map(str, range(api.MAX_IDS + 1)))):
+            resp = self.client.get(f"/api/users?{query}")
+            self.assertEqual(resp.status_code, 400, query)
+            self.assertIn('error', resp.json)
+
+    def test_messages_with_authors(self):
+        """Do messages and their authors come from one query?"""
+
+        first, second, third = self.message_ids
+        statements = self.count_queries()
+        resp = self.client.get(
+            f"/api/messages?ids={third},{first},12345&fields=text,user")
+
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(resp.json['missing'], ['12345'])
+        self.assertEqual(resp.json['messages'], [
+            {'id': str(third), 'text': "warble 2",
+             'user': {'id': self.bob_id, 'username': 'bob',
+                      'image_url': "/static/images/default-pic.png"}},
+            {'id': str(first), 'text': "warble 0",
+             'user': {'id': self.bob_id, 'username': 'bob',
+                      'image_url': "/static/images/default-pic.png"}},
+        ])
+
+    def test_archived_messages(self):
+        """Are archived messages found once the hot table misses them?"""
+
+        old = Message(text="old warble", user_id=self.alice_id,
+                      timestamp=datetime.utcnow() - timedelta(days=365))
+        db.session.add(old)
+        db.session.commit()
+        old_id = old.id
+        archive.rollover()
+
+        resp = self.client.get(
+            f"/api/messages?ids={old_id},{self.message_ids[0]}")
+
+        self.assertEqual(resp.json['missing'], [])
+        self.assertEqual([m['text'] for m in resp.json['messages']],
+                         ["old warble", "warble 0"])
+        self.assertEqual(resp.json['messages'][0]['user']['username'],
+                         'alice')
+        self.assertEqual(resp.json['messages'][0]['user_id'], self.alice_id)
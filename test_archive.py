@@ -0,0 +1,148 @@
+"""Message archive tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_archive.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import (db, User, Message, Likes, ArchivedMessage, ArchivedLike,
+                    MessagePartition)
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import archive
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+NOW = datetime(2021, 6, 15)
+
+
+class ArchiveTestCase(TestCase):
+    """Test rolling old messages into the archive and reading them back."""
+
+    def clear(self):
+        ArchivedLike.query.delete()
+        ArchivedMessage.query.delete()
+        MessagePartition.query.delete()
+        Message.query.delete()
+        User.query.delete()
+        db.session.commit()
+        archive._boundary = (None, 0)
+
+    def setUp(self):
+        self.clear()
+        self.client = app.test_client()
+
+        user = User(email="test@test.com", username="testuser",
+                    password="HASHED_PASSWORD")
+        fan = User(email="fan@test.com", username="fan",
+                   password="HASHED_PASSWORD")
+        db.session.add_all([user, fan])
+        db.session.commit()
+        self.user_id, self.fan_id = user.id, fan.id
+
+        # one message a week for about half a year
+        for week in range(26):
+            db.session.add(Message(text=f"week {week}", user_id=user.id,
+                                   timestamp=NOW - timedelta(weeks=week)))
+        db.session.commit()
+
+        self.old_id = Message.query.filter_by(text="week 25").one().id
+        db.session.add(Likes(message_id=self.old_id, user_id=fan.id))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+        self.clear()
+
+    def test_rollover(self):
+        """Are whole months past the hot window moved, likes and all?"""
+
+        moved = archive.rollover(hot_days=90, now=NOW)
+
+        # the hot partition starts on the first of the month
+        cutoff = datetime(2021, 3, 1)
+        self.assertEqual(Message.query.filter(Message.timestamp < cutoff)
+                         .count(), 0)
+        self.assertEqual(ArchivedMessage.query.count(), moved)
+        self.assertEqual(Message.query.count() + moved, 26)
+        self.assertEqual(ArchivedLike.query.one().user_id, self.fan_id)
+
+        self.assertEqual(archive.hot_boundary(), cutoff)
+        self.assertEqual(
+            sum(p.message_count for p in MessagePartition.query), moved)
+
+        # nothing left to move
+        self.assertEqual(archive.rollover(hot_days=90, now=NOW), 0)
+
+    def test_pages_reach_into_archive(self):
+        """Does paging through a profile continue into archived messages?"""
+
+        archive.rollover(hot_days=90, now=NOW)
+
+        texts = []
+        before = None
+        while True:
+            messages, before = archive.user_messages(self.user_id, before,
+                                                     limit=4)
+            texts.extend(message.text for message in messages)
+            if before is None:
+                break
+
+        self.assertEqual(texts, [f"week {week}" for week in range(26)])
+
+    def test_show_archived_message(self):
+        """Is an archived message still viewable?"""
+
+        archive.rollover(hot_days=90, now=NOW)
+
+        resp = self.client.get(f"/messages/{self.old_id}")
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("week 25", resp.get_data(as_text=True))
+
+    def test_profile_more_link(self):
+        """Does a profile that fits on one page have no More link?"""
+
+        archive.rollover(hot_days=90, now=NOW)
+
+        resp = self.client.get(f"/users/{self.user_id}")
+        html = resp.get_data(as_text=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("week 0", html)
+        self.assertNotIn('id="more-results"', html)
+
+    def test_forget_user(self):
+        """Are a user's archived messages removed with their account?"""
+
+        archive.rollover(hot_days=90, now=NOW)
+        archive.forget_user(self.user_id)
+        db.session.commit()
+
+        self.assertEqual(ArchivedMessage.query.count(), 0)
+        self.assertEqual(ArchivedLike.query.count(), 0)
+
+    def test_delete_archived_message(self):
+        """Can only the author delete an archived message?"""
+
+        archive.rollover(hot_days=90, now=NOW)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.fan_id
+            resp = c.post(f"/messages/{self.old_id}/delete")
+            self.assertEqual(resp.location, "http://localhost/")
+            self.assertIsNotNone(ArchivedMessage.query.get(self.old_id))
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+            c.post(f"/messages/{self.old_id}/delete")
+            self.assertIsNone(ArchivedMessage.query.get(self.old_id))
+            self.assertEqual(ArchivedLike.query.count(), 0)
@@ -0,0 +1,177 @@
+"""Username and email availability tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_availability.py
+
+
+import os
+from unittest import TestCase
+
+from flask import session
+
+from models import db, User
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from availability import CountingBloomFilter, registry
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class CountingBloomFilterTestCase(TestCase):
+    """Test the filter itself."""
+
+    def test_add_and_remove(self):
+        """Are added items present, and gone once removed?"""
+
+        bloom = CountingBloomFilter(100)
+        bloom.add('warbler')
+
+        self.assertIn('warbler', bloom)
+        self.assertNotIn('sparrow', bloom)
+
+        bloom.remove('warbler')
+        self.assertNotIn('warbler', bloom)
+
+    def test_false_positive_rate(self):
+        """Are false positives near the configured rate?"""
+
+        bloom = CountingBloomFilter(1000, error_rate=0.01)
+        for n in range(1000):
+            bloom.add(f'user{n}')
+
+        false_positives = sum(f'other{n}' in bloom for n in range(10000))
+        self.assertLess(false_positives, 300)
+
+
+class AvailabilityTestCase(TestCase):
+    """Test availability checks against the users table."""
+
+    def setUp(self):
+        User.query.delete()
+        db.session.commit()
+        registry.invalidate()
+
+        self.client = app.test_client()
+
+        self.testuser = User.signup(username="testuser",
+                                    email="test@test.com",
+                                    password="testuser",
+                                    image_url=None)
+        db.session.commit()
+        self.testuser_id = self.testuser.id
+
+    def test_taken_and_free(self):
+        """Are existing names taken and unseen names free?"""
+
+        self.assertFalse(registry.username_available('testuser'))
+        self.assertFalse(registry.email_available('test@test.com'))
+        self.assertTrue(registry.username_available('nobody'))
+        self.assertTrue(registry.email_available('nobody@test.com'))
+
+    def test_signup_updates_filter(self):
+        """Is a user signed up after the build seen as taken?"""
+
+        registry.username_available('warm up')
+        User.signup(username="newbie", email="new@test.com",
+                    password="newbie1", image_url=None)
+
+        self.assertIn('newbie', registry.usernames)
+        self.assertFalse(registry.username_available('newbie'))
+
+    def test_profile_change_updates_filter(self):
+        """Does changing a username free the old one?"""
+
+        registry.username_available('warm up')
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            c.post('/users/profile', data={'username': 'renamed',
+                                           'email': 'test@test.com',
+                                           'password': 'testuser'})
+
+        self.assertTrue(registry.username_available('testuser'))
+        self.assertFalse(registry.username_available('renamed'))
+
+    def test_delete_updates_filter(self):
+        """Does deleting a user free their username and email?"""
+
+        registry.username_available('warm up')
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+            c.post('/users/delete')
+
+        self.assertNotIn('testuser', registry.usernames)
+        self.assertNotIn('test@test.com', registry.emails)
+
+    def test_unseen_names_skip_db(self):
+        """Do names the filter hasn't seen avoid a database check?"""
+
+        registry.username_available('warm up')
+        checks = registry.db_checks
+
+        for n in range(20):
+            registry.username_available(f'free{n}')
+
+        self.assertLess(registry.db_checks - checks, 3)
+
+    def test_available_endpoint(self):
+        """Does the live check endpoint report availability as JSON?"""
+
+        resp = self.client.get('/users/available?username=testuser')
+        self.assertEqual(resp.get_json(),
+                         {'username': 'testuser', 'available': False})
+
+        resp = self.client.get('/users/available?email=free@test.com')
+        self.assertEqual(resp.get_json(),
+                         {'email': 'free@test.com', 'available': True})
+
+        resp = self.client.get('/users/available')
+        self.assertEqual(resp.status_code, 400)
+
+    def add_elsewhere(self, username, email):
+        """Insert a user the way another process would: unseen by the filter."""
+
+        registry.username_available('warm up')
+        db.session.execute(User.__table__.insert().values(
+            username=username, email=email, password="HASHED_PASSWORD"))
+        db.session.commit()
+        self.assertTrue(registry.username_available(username))
+
+    def test_signup_taken_elsewhere(self):
+        """Is a name the stale filter calls free refused at commit?"""
+
+        self.add_elsewhere('elsewhere', 'elsewhere@test.com')
+
+        with self.client as c:
+            resp = c.post('/signup', data={'username': 'elsewhere',
+                                           'email': 'mine@test.com',
+                                           'password': 'password'})
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn(b'The username &#34;elsewhere&#34; is already',
+                          resp.data)
+            self.assertNotIn(CURR_USER_KEY, session)
+
+    def test_profile_taken_elsewhere(self):
+        self.add_elsewhere('elsewhere', 'elsewhere@test.com')
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+            resp = c.post('/users/profile', data={
+                'username': 'testuser', 'email': 'elsewhere@test.com',
+                'password': 'testuser'})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(b'The email address &#34;elsewhere@test.com&#34; is',
+                      resp.data)
+        self.assertEqual(User.query.get(self.testuser_id).email,
+                         'test@test.com')
@@ -0,0 +1,140 @@
+"""Response compression tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_compression.py
+
+
+import gzip
+import os
+from unittest import TestCase, skipUnless
+
+from flask import Flask, Response
+from werkzeug.wsgi import DispatcherMiddleware
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+import compression
+
+PAGE = "<li>A warble about birds, and then another one.</li>\n" * 100
+
+
+def make_app(**options):
+    """A bare app behind the middleware, with a few kinds of response."""
+
+    # an explicit instance path, so Flask needn't ask pytest's import hook
+    test_app = Flask(__name__, instance_path=app.instance_path)
+
+    @test_app.route('/page')
+    def page():
+        return PAGE
+
+    @test_app.route('/small')
+    def small():
+        return "<p>Short</p>"
+
+    @test_app.route('/image')
+    def image():
+        return Response(b"\x89PNG" + b"\0" * 2000, mimetype='image/png')
+
+    @test_app.route('/encoded')
+    def encoded():
+        return Response(gzip.compress(PAGE.encode()), mimetype='text/html',
+                        headers={'Content-Encoding': 'gzip'})
+
+    @test_app.route('/stream')
+    def stream():
+        lines = (f'{{"n": {n}}}\n' for n in range(1000))
+        return Response(lines, mimetype='application/x-ndjson')
+
+    def legacy(environ, start_response):
+        write = start_response('200 OK', [('Content-Type', 'text/html')])
+        write(PAGE[:1000].encode())
+        return [PAGE[1000:].encode()]
+
+    test_app.wsgi_app = DispatcherMiddleware(test_app.wsgi_app,
+                                             {'/legacy': legacy})
+    test_app.wsgi_app = compression.Compressor(test_app.wsgi_app, **options)
+    return test_app
+
+
+class CompressionTestCase(TestCase):
+    """Test negotiation and which responses are compressed."""
+
+    def setUp(self):
+        self.client = make_app().test_client()
+
+    def get(self, path, accept='gzip, deflate'):
+        return self.client.get(path, headers={'Accept-Encoding': accept})
+
+    def test_gzip(self):
+        resp = self.get('/page')
+
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', resp.headers['Vary'])
+        self.assertEqual(int(resp.headers['Content-Length']),
+                         len(resp.data))
+        self.assertLess(len(resp.data), len(PAGE) / 5)
+        self.assertEqual(gzip.decompress(resp.data).decode(), PAGE)
+
+    def test_not_accepted(self):
+        for accept in ('', 'identity', 'gzip;q=0'):
+            resp = self.get('/page', accept=accept)
+            self.assertNotIn('Content-Encoding', resp.headers)
+            self.assertEqual(resp.get_data(as_text=True), PAGE)
+
+    def test_skipped(self):
+        """Are small, binary and already-encoded bodies passed through?"""
+
+        resp = self.get('/small')
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertEqual(resp.get_data(as_text=True), "<p>Short</p>")
+
+        resp = self.get('/image')
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertNotIn('Vary', resp.headers)
+
+        resp = self.get('/encoded')
+        self.assertEqual(gzip.decompress(resp.data).decode(), PAGE)
+
+    def test_stream(self):
+        """Is a streamed body compressed without a Content-Length?"""
+
+        resp = self.get('/stream')
+
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Length', resp.headers)
+        lines = gzip.decompress(resp.data).decode().splitlines()
+        self.assertEqual(len(lines), 1000)
+        self.assertEqual(lines[-1], '{"n": 999}')
+
+    def test_write(self):
+        """Is data passed to write() sent, compressed, before the body?"""
+
+        resp = self.get('/legacy')
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(resp.data).decode(), PAGE)
+
+    def test_level(self):
+        fast = make_app(level=1).test_client().get(
+            '/page', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(gzip.decompress(fast.data).decode(), PAGE)
+
+    @skipUnless(compression.brotli, "brotli is not installed")
+    def test_brotli(self):
+        resp = self.get('/page', accept='gzip, deflate, br')
+        self.assertEqual(resp.headers['Content-Encoding'], 'br')
+        self.assertEqual(compression.brotli.decompress(resp.data).decode(),
+                         PAGE)
+
+        resp = self.get('/page', accept='br;q=0.5, gzip')
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+
+    def test_installed(self):
+        """Is the app's login page compressed?"""
+
+        resp = app.test_client().get('/login',
+                                     headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertIn(b'<form', gzip.decompress(resp.data))
@@ -0,0 +1,122 @@
+"""Entity cache tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_entity_cache.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+from entity_cache import EntityCache, cache
+
+db.create_all()
+
+
+class EntityCacheTestCase(TestCase):
+    """Test read-through caching of users and messages."""
+
+    def setUp(self):
+        Message.query.delete()
+        User.query.delete()
+        db.session.commit()
+        cache.clear()
+
+        user = User(email="test@test.com", username="testuser",
+                    password="HASHED_PASSWORD")
+        db.session.add(user)
+        db.session.commit()
+        db.session.add(Message(text="Hello", user_id=user.id))
+        db.session.commit()
+
+        self.user_id = user.id
+        db.session.remove()
+
+    def tearDown(self):
+        db.session.remove()
+
+    def test_second_get_is_a_hit(self):
+        """Is a row read in a later session served from the cache?"""
+
+        hits = cache.hits
+        self.assertEqual(cache.get(User, self.user_id).username, 'testuser')
+        db.session.remove()
+
+        user = cache.get(User, self.user_id)
+        self.assertEqual(cache.hits, hits + 1)
+        self.assertEqual(user.username, 'testuser')
+
+        # attached to the session, so relationships still load
+        self.assertEqual([m.text for m in user.messages], ['Hello'])
+
+    def test_update_invalidates(self):
+        """Is a cached row dropped when it is updated through the ORM?"""
+
+        user = cache.get(User, self.user_id)
+        user.bio = "New bio"
+        db.session.commit()
+        db.session.remove()
+
+        self.assertEqual(cache.get(User, self.user_id).bio, "New bio")
+
+    def test_delete_invalidates(self):
+        """Is a cached row dropped when it is deleted?"""
+
+        message = Message.query.one()
+        message_id = message.id
+        cache.get(Message, message_id)
+
+        db.session.delete(message)
+        db.session.commit()
+        db.session.remove()
+
+        self.assertIsNone(cache.get(Message, message_id))
+
+    def test_get_by_username_follows_renames(self):
+        """Is a renamed user not found under the old username?"""
+
+        self.assertEqual(cache.get_user_by_username('testuser').id,
+                         self.user_id)
+
+        user = cache.get(User, self.user_id)
+        user.username = 'renamed'
+        db.session.commit()
+        db.session.remove()
+
+        self.assertIsNone(cache.get_user_by_username('testuser'))
+        self.assertEqual(cache.get_user_by_username('renamed').id,
+                         self.user_id)
+
+    def test_ttl_expiry(self):
+        """Are entries re-read from the database once expired?"""
+
+        small = EntityCache(ttl=-1)
+        small.get(User, self.user_id)
+        db.session.remove()
+
+        small.get(User, self.user_id)
+        self.assertEqual(small.hits, 0)
+        self.assertEqual(small.misses, 2)
+
+    def test_memory_cap_evicts_lru(self):
+        """Does the cache stay under its byte budget?"""
+
+        small = EntityCache(max_bytes=1)
+        small.get(User, self.user_id)
+
+        self.assertEqual(small.stats()['entries'], 0)
+        self.assertEqual(small.evictions, 1)
+
+    def test_stats_endpoint(self):
+        """Does the stats endpoint report hits and misses?"""
+
+        resp = app.test_client().get('/stats/cache')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('hits', resp.get_json())
+        self.assertIn('misses', resp.get_json())
@@ -0,0 +1,132 @@
+"""Influence score tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_influence.py
+
+
+import os
+from unittest import TestCase
+from unittest.mock import patch
+
+import numpy as np
+
+from models import db, User, Follows
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+import readmodels
+from followgraph import load_follow_matrix
+import influence
+from influence import pagerank, refresh_influence
+
+db.create_all()
+
+
+class InfluenceTestCase(TestCase):
+    """Test PageRank over follows and the ordering of user lists."""
+
+    def setUp(self):
+        """Create users a..e: b, c and d follow a; a follows b."""
+
+        Follows.query.delete()
+        User.query.delete()
+
+        self.users = {}
+        for name in 'abcde':
+            user = User(username=name, email=f"{name}@test.com",
+                        password="HASHED_PASSWORD")
+            db.session.add(user)
+            self.users[name] = user
+        db.session.commit()
+
+        for follower, followed in ['ba', 'ca', 'da', 'ab']:
+            db.session.add(Follows(
+                user_following_id=self.users[follower].id,
+                user_being_followed_id=self.users[followed].id))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_follow_matrix(self):
+        user_ids, adjacency = load_follow_matrix()
+
+        self.assertEqual(list(user_ids),
+                         sorted(u.id for u in self.users.values()))
+        row = list(user_ids).index(self.users['a'].id)
+        self.assertEqual(
+            sorted(user_ids[adjacency[row].indices]),
+            sorted(self.users[name].id for name in 'bcd'))
+        self.assertEqual(list(np.diff(adjacency.indptr)), [3, 1, 0, 0, 0])
+
+    def test_matches_dense_pagerank(self):
+        """Does the sparse iteration agree with the textbook definition?"""
+
+        size = 30
+        rng = np.random.RandomState(0)
+        dense = (rng.rand(size, size) < 0.1).astype(float)
+        np.fill_diagonal(dense, 0)
+        dense[:, :3] = 0    # a few users who follow no one
+
+        from scipy import sparse
+        scores = pagerank(sparse.csr_matrix(dense, dtype=np.float32),
+                          tolerance=1e-10)
+
+        # column i of the transition matrix: i's score spread over the
+        # users they follow, or over everybody when that's no one
+        out = dense.sum(axis=0)
+        transition = np.where(out > 0, dense / np.maximum(out, 1), 1 / size)
+        expected = np.full(size, 1 / size)
+        for _ in range(200):
+            expected = 0.15 / size + 0.85 * transition @ expected
+
+        self.assertAlmostEqual(scores.sum(), 1)
+        np.testing.assert_allclose(scores, expected, rtol=1e-4)
+
+    def test_converges_on_large_graph(self):
+        """Does a few-thousand-user graph converge before MAX_ITERATIONS?"""
+
+        # everyone follows 50 users, mostly the same few popular ones
+        size = 3000
+        rng = np.random.RandomState(0)
+        followers = np.repeat(np.arange(size), 50)
+        followed = np.minimum(rng.zipf(1.3, size=len(followers)), size) - 1
+
+        from scipy import sparse
+        adjacency = sparse.csr_matrix(
+            (np.ones(len(followers), dtype=np.float32),
+             (followed, followers)), shape=(size, size))
+        adjacency.data[:] = 1
+
+        # float32 rounding leaves a change of ~3e-7 a round, so the tighter
+        # tolerance is only met when scores are summed in float64
+        for tolerance in (influence.TOLERANCE, 1e-9):
+            with patch.object(influence.logger, 'warning') as warning:
+                scores = pagerank(adjacency, tolerance=tolerance)
+            warning.assert_not_called()
+            self.assertAlmostEqual(scores.sum(), 1)
+
+        with patch.object(influence.logger, 'warning') as warning:
+            pagerank(adjacency, max_iterations=2)
+        warning.assert_called_once()
+
+    def test_refresh_orders_user_lists(self):
+        """Is a, then b (followed by a), listed first after a refresh?"""
+
+        self.assertEqual(refresh_influence(), 5)
+
+        a = User.query.get(self.users['a'].id)
+        self.assertEqual(a.follower_count, 3)
+        self.assertGreater(a.influence, 1)
+
+        late = User(username="late", email="late@test.com",
+                    password="HASHED_PASSWORD")
+        db.session.add(late)
+        db.session.commit()
+
+        names = [u.username for u in readmodels.list_users()]
+        self.assertEqual(names[:2], ['a', 'b'])
+        self.assertEqual(names[-1], 'late')
+        self.assertEqual(sorted(names[2:5]), ['c', 'd', 'e'])
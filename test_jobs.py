@@ -0,0 +1,105 @@
+"""Background job queue tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_jobs.py
+
+
+import os
+from datetime import datetime
+from unittest import TestCase
+
+from models import db, Job
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+import jobs
+
+db.create_all()
+
+calls = []
+
+
+@jobs.task(name='test_record', max_attempts=2)
+def record(value):
+    calls.append(value)
+
+
+@jobs.task(name='test_explode', max_attempts=2)
+def explode():
+    raise RuntimeError("boom")
+
+
+class JobsTestCase(TestCase):
+    """Test enqueueing and running jobs."""
+
+    def setUp(self):
+        """Clear out old jobs."""
+
+        Job.query.delete()
+        db.session.commit()
+        calls.clear()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_enqueue_and_run(self):
+        """Does a queued job run once and get marked done?"""
+
+        job = jobs.enqueue('test_record', {'value': 42})
+        db.session.commit()
+
+        self.assertEqual(job.status, 'queued')
+        self.assertEqual(jobs.run_pending(), 1)
+        self.assertEqual(calls, [42])
+        self.assertEqual(Job.query.get(job.id).status, 'done')
+        self.assertEqual(jobs.run_pending(), 0)
+
+    def test_idempotency_key(self):
+        """Does enqueueing twice under one key create a single job?"""
+
+        first = jobs.enqueue('test_record', {'value': 1}, idempotency_key='k1')
+        db.session.commit()
+        second = jobs.enqueue('test_record', {'value': 1}, idempotency_key='k1')
+        db.session.commit()
+
+        self.assertEqual(first.id, second.id)
+        self.assertEqual(Job.query.count(), 1)
+
+    def test_retry_with_backoff(self):
+        """Is a failing job rescheduled, then failed after max attempts?"""
+
+        job = jobs.enqueue('test_explode')
+        db.session.commit()
+
+        self.assertEqual(jobs.run_pending(), 1)
+        job = Job.query.get(job.id)
+        self.assertEqual(job.status, 'queued')
+        self.assertEqual(job.attempts, 1)
+        self.assertGreater(job.run_at, datetime.utcnow())
+        self.assertIn('boom', job.last_error)
+
+        # not due yet
+        self.assertEqual(jobs.run_pending(), 0)
+
+        job.run_at = datetime.utcnow()
+        db.session.commit()
+        self.assertEqual(jobs.run_pending(), 1)
+        self.assertEqual(Job.query.get(job.id).status, 'failed')
+
+    def test_queues_are_separate(self):
+        """Does a worker only take jobs from its own queue?"""
+
+        jobs.enqueue('test_record', {'value': 7}, queue='other')
+        db.session.commit()
+
+        self.assertEqual(jobs.run_pending('default'), 0)
+        self.assertEqual(jobs.run_pending('other'), 1)
+        self.assertEqual(calls, [7])
+
+    def test_parse_queues(self):
+        """Are CLI queue specs parsed into concurrency limits?"""
+
+        self.assertEqual(jobs.parse_queues(['default=4', 'mail']),
+                         {'default': 4, 'mail': 1})
@@ -0,0 +1,84 @@
+"""Load generator tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_loadgen.py
+
+
+import os
+import random
+from unittest import TestCase
+
+from models import db, User, Message, Follows
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+import loadgen
+
+db.create_all()
+
+
+class LoadgenTestCase(TestCase):
+    """Test population setup and a short in-process run."""
+
+    def setUp(self):
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_prepare_is_repeatable(self):
+        """Are the CSV users created once, with their follows and warbles?"""
+
+        population = loadgen.prepare_population()
+        again = loadgen.prepare_population()
+
+        self.assertEqual(population['users'], again['users'])
+        self.assertEqual(User.query.count(), len(population['users']))
+        self.assertEqual(Follows.query.count(),
+                         sum(len(u['following']) for u in population['users']))
+        self.assertEqual(Message.query.count(), len(population['texts']))
+
+        first = population['users'][0]
+        self.assertTrue(first['username'].startswith(loadgen.PREFIX))
+        self.assertTrue(User.authenticate(first['username'],
+                                          loadgen.PASSWORD))
+
+    def test_run(self):
+        """Do virtual users log in and run the mix without errors?"""
+
+        population = loadgen.prepare_population()
+
+        def make_client(n):
+            return loadgen.InProcessClient(app, f"10.0.0.{n}")
+
+        summary = loadgen.run_load(make_client, population,
+                                   loadgen.parse_mix(''),
+                                   loadgen.think_time('0'),
+                                   concurrency=2, duration=3, seed=1)
+
+        self.assertGreater(summary['count'], 0)
+        self.assertEqual(summary['actions']['login']['errors'], 0)
+        self.assertEqual(summary['actions']['timeline']['errors'], 0)
+        self.assertGreater(summary['actions']['timeline']['p50_ms'], 0)
+
+    def test_think_time(self):
+        """Are the think-time models parsed?"""
+
+        rng = random.Random(1)
+        self.assertEqual(loadgen.think_time('0')(rng), 0)
+        self.assertEqual(loadgen.think_time('const:0.5')(rng), 0.5)
+        self.assertTrue(1 <= loadgen.think_time('uniform:1,2')(rng) <= 2)
+        self.assertGreater(loadgen.think_time('exp:1')(rng), 0)
+
+    def test_percentile(self):
+        """Is the nearest-rank percentile used?"""
+
+        ordered = list(range(1, 101))
+        self.assertEqual(loadgen.percentile(ordered, 50), 50)
+        self.assertEqual(loadgen.percentile(ordered, 99), 99)
+        self.assertEqual(loadgen.percentile([], 99), 0)
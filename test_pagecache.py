@@ -0,0 +1,124 @@
+"""Anonymous page cache tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_pagecache.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Likes
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import entity_cache
+import pagecache
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class PageCacheTestCase(TestCase):
+    """Test caching, invalidation and bypassing of anonymous pages."""
+
+    def setUp(self):
+        Likes.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        pagecache.cache.clear()
+        self.ttl = pagecache.cache.ttl
+        self.client = app.test_client()
+
+        user = User(email="test@test.com", username="testuser",
+                    password="HASHED_PASSWORD", bio="Old bio")
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+
+    def tearDown(self):
+        pagecache.cache.ttl = self.ttl
+        app.config['WTF_CSRF_ENABLED'] = False
+        db.session.rollback()
+
+    def get(self, path):
+        return self.client.get(path, buffered=True)
+
+    def test_hit(self):
+        first = self.get(f"/users/{self.user_id}")
+        second = self.get(f"/users/{self.user_id}")
+
+        self.assertEqual(first.headers['X-Page-Cache'], 'miss')
+        self.assertEqual(second.headers['X-Page-Cache'], 'hit')
+        self.assertEqual(first.data, second.data)
+        self.assertIn(b"@testuser", second.data)
+
+    def test_write_invalidates(self):
+        """Is a profile re-rendered after the user posts a warble?"""
+
+        self.get(f"/users/{self.user_id}")
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+            c.post("/messages/new", data={"text": "Fresh warble"})
+        self.client.cookie_jar.clear()
+
+        resp = self.get(f"/users/{self.user_id}")
+        self.assertEqual(resp.headers['X-Page-Cache'], 'miss')
+        self.assertIn(b"Fresh warble", resp.data)
+
+    def test_logged_in_and_flashes_bypass(self):
+        self.get(f"/users/{self.user_id}")
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+            resp = c.get(f"/users/{self.user_id}")
+            self.assertNotIn('X-Page-Cache', resp.headers)
+            self.assertIn(b"Edit Profile", resp.data)
+
+        self.client.cookie_jar.clear()
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess['_flashes'] = [('success', "Logged out!")]
+            resp = c.get("/login")
+            self.assertNotIn('X-Page-Cache', resp.headers)
+            self.assertIn(b"Logged out!", resp.data)
+
+    def test_stale_while_revalidate(self):
+        """Is an expired page served once more, then replaced?"""
+
+        pagecache.cache.ttl = 0
+        self.get(f"/users/{self.user_id}")
+
+        # a bulk update, which bumps no page versions
+        User.query.filter_by(id=self.user_id).update({'bio': "New bio"})
+        db.session.commit()
+        entity_cache.cache.invalidate(User, self.user_id)
+
+        pagecache.cache.ttl = 30
+        stale = self.get(f"/users/{self.user_id}")
+        self.assertEqual(stale.headers['X-Page-Cache'], 'stale')
+        self.assertIn(b"Old bio", stale.data)
+
+        fresh = self.get(f"/users/{self.user_id}")
+        self.assertEqual(fresh.headers['X-Page-Cache'], 'hit')
+        self.assertIn(b"New bio", fresh.data)
+
+    def test_csrf_token_per_visitor(self):
+        """Does each visitor get a working token of their own?"""
+
+        app.config['WTF_CSRF_ENABLED'] = True
+        first = self.get("/login")
+        other = app.test_client().get("/login", buffered=True)
+
+        self.assertEqual(other.headers['X-Page-Cache'], 'hit')
+        self.assertNotIn(pagecache.CSRF_PLACEHOLDER, other.data)
+        self.assertIn(b'name="csrf_token"', other.data)
+        self.assertNotEqual(first.data, other.data)
@@ -0,0 +1,118 @@
+"""Request profiling tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_profiling.py
+
+
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from models import db
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+from profiling import HEADER, classify
+
+db.create_all()
+
+profiler = app.extensions['profiler']
+
+
+class ProfilingTestCase(TestCase):
+    """Test which requests are profiled, and what is written."""
+
+    def setUp(self):
+        self.client = app.test_client()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.real = (profiler.directory, profiler.switch_path)
+        profiler.directory = os.path.join(self.tmp.name, 'profiles')
+        profiler.switch_path = os.path.join(self.tmp.name, 'profiling.json')
+        profiler._switch_checked = 0
+
+    def tearDown(self):
+        profiler.directory, profiler.switch_path = self.real
+        profiler._switch_checked = 0
+        self.tmp.cleanup()
+
+    def profiles(self):
+        if not os.path.isdir(profiler.directory):
+            return []
+        return sorted(name for name in os.listdir(profiler.directory)
+                      if name.endswith('.folded'))
+
+    def test_signed_header(self):
+        """Does a valid token profile the request?"""
+
+        resp = self.client.get('/users', headers={HEADER: profiler.token()})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(self.profiles(), [resp.headers['X-Profile']])
+
+        summary_path = os.path.join(
+            profiler.directory,
+            resp.headers['X-Profile'].replace('.folded', '.json'))
+        with open(summary_path) as f:
+            summary = json.load(f)
+        self.assertEqual(summary['endpoint'], 'warbler.list_users')
+        for key in ('total_ms', 'sql_ms', 'template_ms', 'python_ms'):
+            self.assertIn(key, summary)
+
+    def test_bad_token_ignored(self):
+        """Is a forged token ignored?"""
+
+        resp = self.client.get('/users', headers={HEADER: 'forged'})
+
+        self.assertNotIn('X-Profile', resp.headers)
+        self.assertEqual(self.profiles(), [])
+
+    def test_switch(self):
+        """Does the on/off switch profile sampled requests?"""
+
+        self.client.get('/login')
+        self.assertEqual(self.profiles(), [])
+
+        with open(profiler.switch_path, 'w') as f:
+            json.dump({'rate': 1.0, 'endpoints': ['login']}, f)
+        profiler._switch_checked = 0
+
+        self.client.get('/login')
+        self.client.get('/signup')
+        self.assertEqual(len(self.profiles()), 1)
+        self.assertIn('-login-', self.profiles()[0])
+
+    def test_unreadable_switch(self):
+        """Is a half-written switch file read as off?"""
+
+        with open(profiler.switch_path, 'w') as f:
+            f.write('{"rate": 1.0, "endpo')
+        profiler._switch_checked = 0
+
+        resp = self.client.get('/login')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(self.profiles(), [])
+
+    def test_retention(self):
+        """Are only the newest profiles kept?"""
+
+        retention, profiler.retention = profiler.retention, 2
+        try:
+            for _ in range(4):
+                self.client.get('/login', headers={HEADER: profiler.token()})
+        finally:
+            profiler.retention = retention
+
+        self.assertEqual(len(self.profiles()), 2)
+        self.assertEqual(len(os.listdir(profiler.directory)), 4)
+
+    def test_classify(self):
+        """Are samples split into SQL, template and Python time?"""
+
+        self.assertEqual(classify(['/x/app.py', '/y/sqlalchemy/orm/query.py',
+                                   '/y/jinja2/environment.py']), 'sql')
+        self.assertEqual(classify(['/x/app.py', 'templates/home.html']),
+                         'template')
+        self.assertEqual(classify(['/x/app.py']), 'python')
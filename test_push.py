@@ -0,0 +1,201 @@
+"""Push notification tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_push.py
+
+
+import asyncio
+import json
+import os
+import socket
+import threading
+from unittest import TestCase
+
+from models import db, User, Message, Follows
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import push
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class HubTestCase(TestCase):
+    """Test routing of events to subscribers, and commit-time delivery."""
+
+    def test_routes_by_author(self):
+        async def run():
+            hub = push.Hub()
+            hub.attach(asyncio.get_running_loop())
+            fan = hub.subscribe(1, {10, 11})
+            other = hub.subscribe(2, {12})
+
+            hub.publish({'id': '5', 'user_id': 11})
+            self.assertEqual(await asyncio.wait_for(fan.queue.get(), 1),
+                             {'id': '5', 'user_id': 11})
+            self.assertTrue(other.queue.empty())
+
+            hub.unsubscribe(fan)
+            hub.publish({'id': '6', 'user_id': 11})
+            await asyncio.sleep(0)
+            self.assertTrue(fan.queue.empty())
+            self.assertEqual(hub.delivered, 1)
+
+        asyncio.run(run())
+
+    def test_memory_broker_waits_for_commit(self):
+        published = []
+        hub = push.Hub()
+        hub.publish = published.append
+        broker = push.MemoryBroker(hub)
+
+        with app.app_context():
+            broker.publish({'id': '1', 'user_id': 1})
+            db.session.rollback()
+            broker.publish({'id': '2', 'user_id': 1})
+            self.assertEqual(published, [])
+            db.session.commit()
+
+        self.assertEqual(published, [{'id': '2', 'user_id': 1}])
+
+
+class PushServerTestCase(TestCase):
+    """Run the event stream server in a thread and post through the app."""
+
+    def setUp(self):
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        self.client = app.test_client()
+
+        users = [User(email=f"{name}@test.com", username=name,
+                      password="HASHED_PASSWORD")
+                 for name in ('author', 'fan', 'stranger')]
+        db.session.add_all(users)
+        db.session.commit()
+        self.author_id, self.fan_id, self.stranger_id = [u.id for u in users]
+        db.session.add(Follows(user_following_id=self.fan_id,
+                               user_being_followed_id=self.author_id))
+        db.session.commit()
+
+        self.loop = asyncio.new_event_loop()
+        self.server = push.PushServer(app, CURR_USER_KEY, heartbeat=0.2)
+        self.listener = self.loop.run_until_complete(
+            self.server.start('127.0.0.1', 0))
+        self.port = self.listener.sockets[0].getsockname()[1]
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        asyncio.run_coroutine_threadsafe(self.shutdown(),
+                                         self.loop).result(5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.server.hub.attach(None)
+        db.session.rollback()
+
+    async def shutdown(self):
+        self.listener.close()
+        self.server.broker.close(self.loop)
+        streams = [task for task in asyncio.all_tasks()
+                   if task is not asyncio.current_task()]
+        for task in streams:
+            task.cancel()
+        await asyncio.gather(*streams, return_exceptions=True)
+
+    def connect(self, user_id=None, last_event_id=None):
+        """Open /events; return the socket's file and the status line."""
+
+        sock = socket.create_connection(('127.0.0.1', self.port), timeout=5)
+        headers = "GET /events HTTP/1.1\r\nHost: test\r\n"
+        if last_event_id is not None:
+            headers += f"Last-Event-ID: {last_event_id}\r\n"
+        if user_id is not None:
+            value = app.session_interface.get_signing_serializer(app).dumps(
+                {CURR_USER_KEY: user_id})
+            headers += f"Cookie: {app.session_cookie_name}={value}\r\n"
+        sock.sendall((headers + "\r\n").encode())
+
+        stream = sock.makefile('rb')
+        status = stream.readline().decode()
+        while stream.readline() != b"\r\n":
+            pass
+        return stream, status
+
+    def next_event(self, stream):
+        """The data of the next event, skipping retry and ping lines."""
+
+        while True:
+            line = stream.readline().decode()
+            if line.startswith('data: '):
+                return json.loads(line[len('data: '):])
+
+    def next_comment(self, stream):
+        while True:
+            line = stream.readline().decode()
+            if line.startswith(':'):
+                return line
+            self.assertFalse(line.startswith(('id:', 'event:', 'data:')))
+
+    def wait_for_subscribers(self, count):
+        deadline = self.loop.time() + 5
+        while self.server.hub.subscriptions < count:
+            self.assertLess(self.loop.time(), deadline)
+            threading.Event().wait(0.01)
+
+    def post(self, user_id, text):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+            c.post("/messages/new", data={"text": text})
+
+    def test_needs_login(self):
+        stream, status = self.connect()
+        self.assertIn("401", status)
+
+    def test_new_message_reaches_followers(self):
+        """Is a committed post announced to a follower's stream only?"""
+
+        fan, status = self.connect(self.fan_id)
+        self.assertIn("200", status)
+        stranger, _ = self.connect(self.stranger_id)
+        self.wait_for_subscribers(2)
+
+        self.post(self.author_id, "Hello followers")
+        msg = Message.query.filter_by(text="Hello followers").one()
+
+        event = self.next_event(fan)
+        self.assertEqual(event, {'id': str(msg.id),
+                                 'user_id': self.author_id})
+
+        # the stranger's stream only has keep-alives
+        self.assertEqual(self.next_comment(stranger), ": ping\n")
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.fan_id
+            html = c.get("/timeline/new?after=0").get_data(as_text=True)
+            self.assertIn("Hello followers", html)
+            html = c.get(f"/timeline/new?after={msg.id}").get_data(
+                as_text=True)
+            self.assertNotIn("Hello followers", html)
+
+    def test_reconnect_replays_missed(self):
+        """Are posts made while a browser was away sent when it's back?"""
+
+        self.post(self.author_id, "Seen")
+        self.post(self.author_id, "Missed")
+        seen, missed = Message.query.order_by(Message.id).all()
+        missed_id = missed.id
+
+        fan, _ = self.connect(self.fan_id, last_event_id=seen.id)
+        self.assertEqual(self.next_event(fan), {'id': str(missed_id),
+                                                'user_id': self.author_id})
+        self.assertEqual(self.next_comment(fan), ": ping\n")
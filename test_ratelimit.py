@@ -0,0 +1,98 @@
+"""Rate limiting tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_ratelimit.py
+
+
+import os
+import tempfile
+from unittest import TestCase
+
+from models import db
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+from ratelimit import LocalBuckets, SharedBuckets
+
+db.create_all()
+
+limiter = app.extensions['ratelimit']
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class BucketsTestCase(TestCase):
+    """Test token bucket arithmetic for both stores."""
+
+    def check_buckets(self, buckets):
+        # 2 tokens, refilling at 1 per second
+        self.assertEqual(buckets.take('k', 1, 2, now=100), 0)
+        self.assertEqual(buckets.take('k', 1, 2, now=100), 0)
+        self.assertAlmostEqual(buckets.take('k', 1, 2, now=100), 1)
+
+        # other keys have their own bucket
+        self.assertEqual(buckets.take('other', 1, 2, now=100), 0)
+
+        # half a second later, half a token is back
+        self.assertAlmostEqual(buckets.take('k', 1, 2, now=100.5), 0.5)
+        self.assertEqual(buckets.take('k', 1, 2, now=101), 0)
+
+    def test_local_buckets(self):
+        """Do in-process buckets allow bursts and refill over time?"""
+
+        self.check_buckets(LocalBuckets())
+
+    def test_shared_buckets(self):
+        """Do file-backed buckets behave the same, and share state?"""
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'buckets')
+            self.check_buckets(SharedBuckets(path, slots=64))
+
+            # a second mapping (as in another process) sees the same bucket
+            other = SharedBuckets(path, slots=64)
+            self.assertAlmostEqual(other.take('k', 1, 2, now=101), 1)
+
+    def test_shared_buckets_recycle_when_full(self):
+        """Does a full group recycle its stalest bucket?"""
+
+        with tempfile.TemporaryDirectory() as tmp:
+            buckets = SharedBuckets(os.path.join(tmp, 'buckets'), slots=8)
+            for n in range(20):
+                self.assertEqual(buckets.take(f'key{n}', 1, 1, now=n), 0)
+
+
+class RateLimitViewTestCase(TestCase):
+    """Test throttling of real endpoints."""
+
+    def setUp(self):
+        self.client = app.test_client()
+        self.real_buckets = limiter.buckets
+        limiter.buckets = LocalBuckets()
+
+    def tearDown(self):
+        limiter.buckets = self.real_buckets
+
+    def test_login_throttled(self):
+        """Are login attempts past the limit rejected with a 429?"""
+
+        limit, _ = limiter.policies['login']['ip']
+        data = {'username': 'nobody', 'password': 'wrongpass'}
+
+        for _ in range(limit):
+            resp = self.client.post('/login', data=data)
+            self.assertEqual(resp.status_code, 200)
+
+        resp = self.client.post('/login', data=data)
+        self.assertEqual(resp.status_code, 429)
+        self.assertIn('Retry-After', resp.headers)
+
+    def test_reads_not_throttled(self):
+        """Is showing the login form never throttled?"""
+
+        limit, _ = limiter.policies['login']['ip']
+
+        for _ in range(limit + 1):
+            self.assertEqual(self.client.get('/login').status_code, 200)
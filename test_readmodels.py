@@ -0,0 +1,113 @@
+"""Read model tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_readmodels.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Likes
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import readmodels
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class ReadModelsTestCase(TestCase):
+    """Test column-only projections for list pages."""
+
+    def setUp(self):
+        Likes.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        self.client = app.test_client()
+
+        users = [User(email=f"{name}@test.com", username=name,
+                      password="HASHED_PASSWORD", bio=f"I am {name}")
+                 for name in ('alice', 'bob', 'carol')]
+        db.session.add_all(users)
+        db.session.commit()
+        self.alice_id, self.bob_id, self.carol_id = [u.id for u in users]
+
+        db.session.add_all([
+            Follows(user_following_id=self.bob_id,
+                    user_being_followed_id=self.alice_id),
+            Follows(user_following_id=self.carol_id,
+                    user_being_followed_id=self.alice_id),
+            Follows(user_following_id=self.alice_id,
+                    user_being_followed_id=self.bob_id),
+        ])
+        messages = [Message(text=f"warble {n}", user_id=self.alice_id)
+                    for n in range(3)]
+        db.session.add_all(messages)
+        db.session.commit()
+        self.message_ids = [m.id for m in messages]
+
+        db.session.add(Likes(user_id=self.bob_id,
+                             message_id=self.message_ids[0]))
+        db.session.commit()
+        db.session.expunge_all()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_users_are_not_tracked(self):
+        """Do user lists skip the session and leave out passwords?"""
+
+        users = readmodels.list_users()
+
+        self.assertEqual([u.username for u in users],
+                         ['alice', 'bob', 'carol'])
+        self.assertIsInstance(users[0], readmodels.UserCard)
+        self.assertFalse(hasattr(users[0], 'password'))
+        self.assertEqual(len(db.session.identity_map), 0)
+
+        self.assertEqual([u.username for u in readmodels.list_users('ca')],
+                         ['carol'])
+
+    def test_follows_and_stats(self):
+        self.assertEqual([u.id for u in readmodels.followers(self.alice_id)],
+                         [self.bob_id, self.carol_id])
+        self.assertEqual([u.id for u in readmodels.following(self.alice_id)],
+                         [self.bob_id])
+        self.assertEqual(readmodels.user_stats(self.alice_id),
+                         (3, 1, 2, 0))
+        self.assertEqual(readmodels.user_stats(self.bob_id),
+                         (0, 1, 1, 1))
+
+    def test_messages_by_ids(self):
+        """Are messages returned in the given order, sharing authors?"""
+
+        ids = [self.message_ids[2], 12345, self.message_ids[0]]
+        messages = readmodels.messages_by_ids(ids)
+
+        self.assertEqual([m.id for m in messages],
+                         [self.message_ids[2], self.message_ids[0]])
+        self.assertEqual(messages[0].user.username, 'alice')
+        self.assertIs(messages[0].user, messages[1].user)
+        self.assertEqual(len(db.session.identity_map), 0)
+
+    def test_followers_page(self):
+        """Does the followers page show each follower's own bio?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.alice_id
+
+            html = c.get(f"/users/{self.alice_id}/followers").get_data(
+                as_text=True)
+
+        self.assertIn("I am bob", html)
+        self.assertIn("I am carol", html)
+        self.assertIn(f'action="/users/stop-following/{self.bob_id}"', html)
+        self.assertIn(f'action="/users/follow/{self.carol_id}"', html)
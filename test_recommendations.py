@@ -0,0 +1,86 @@
+"""Who-to-follow recommendation tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_recommendations.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Follows, Suggestion
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+from recommendations import refresh_suggestions
+
+db.create_all()
+
+
+class RecommendationsTestCase(TestCase):
+    """Test friends-of-friends suggestions."""
+
+    def setUp(self):
+        """Create users a..e where a follows b and c, who follow d and e."""
+
+        Suggestion.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+
+        self.users = {}
+        for name in 'abcde':
+            user = User(username=name, email=f"{name}@test.com",
+                        password="HASHED_PASSWORD")
+            db.session.add(user)
+            self.users[name] = user
+        db.session.commit()
+
+        for follower, followed in ['ab', 'ac', 'bd', 'cd', 'ce', 'ba']:
+            db.session.add(Follows(
+                user_following_id=self.users[follower].id,
+                user_being_followed_id=self.users[followed].id))
+        db.session.commit()
+
+    def test_ranked_by_shared_connections(self):
+        """Is d (followed by b and c) ranked above e (followed by c)?"""
+
+        refresh_suggestions()
+        a = self.users['a']
+
+        suggestions = (Suggestion
+                       .query
+                       .filter_by(user_id=a.id)
+                       .order_by(Suggestion.rank)
+                       .all())
+
+        self.assertEqual([s.suggested_user_id for s in suggestions],
+                         [self.users['d'].id, self.users['e'].id])
+        self.assertEqual([s.shared_count for s in suggestions], [2, 1])
+
+    def test_excludes_self_and_followed(self):
+        """Are the user and people they follow never suggested?"""
+
+        refresh_suggestions()
+        b = self.users['b']
+
+        suggested = {s.suggested_user_id
+                     for s in Suggestion.query.filter_by(user_id=b.id)}
+
+        # b follows a and d; a follows b and c
+        self.assertEqual(suggested, {self.users['c'].id})
+
+    def test_suggested_users_skips_new_follows(self):
+        """Are users followed after the batch run left out of the sidebar?"""
+
+        refresh_suggestions()
+        a = self.users['a']
+        d = self.users['d']
+
+        self.assertEqual(a.suggested_users()[0], d)
+
+        db.session.add(Follows(user_following_id=a.id,
+                               user_being_followed_id=d.id))
+        db.session.commit()
+
+        self.assertEqual(a.suggested_users(), [self.users['e']])
@@ -0,0 +1,136 @@
+"""Message search tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_search.py
+
+
+import os
+from unittest import TestCase
+from unittest.mock import patch
+
+from models import db, User, Message, SearchPosting, SearchTerm
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import search
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class SearchTestCase(TestCase):
+    """Test indexing and querying messages."""
+
+    def setUp(self):
+        """Create test client and a user."""
+
+        SearchPosting.query.delete()
+        SearchTerm.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        self.client = app.test_client()
+
+        self.testuser = User.signup(username="testuser",
+                                    email="test@test.com",
+                                    password="testuser",
+                                    image_url=None)
+        db.session.commit()
+
+    def post(self, text):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+            c.post("/messages/new", data={"text": text})
+
+        return Message.query.filter_by(text=text).one()
+
+    def test_tokenize(self):
+        """Are terms lowercased, counted and stopwords dropped?"""
+
+        self.assertEqual(search.tokenize("The Warbler sings; warbler, SINGS!"),
+                         {'warbler': 2, 'sings': 2})
+
+    def test_new_message_is_searchable(self):
+        """Does posting a message index it?"""
+
+        m = self.post("Spotted a blue warbler today")
+
+        messages, cursor = search.search("warbler")
+        self.assertEqual([msg.id for msg in messages], [m.id])
+        self.assertIsNone(cursor)
+
+    def test_all_terms_must_match(self):
+        """Does a multi-term query only return messages with every term?"""
+
+        both = self.post("blue warbler")
+        self.post("yellow warbler")
+
+        messages, _ = search.search("Blue Warbler")
+        self.assertEqual([msg.id for msg in messages], [both.id])
+
+    def test_ranking(self):
+        """Does a message mentioning a term more often rank higher?"""
+
+        once = self.post("warbler")
+        twice = self.post("warbler warbler")
+
+        messages, _ = search.search("warbler")
+        self.assertEqual([msg.id for msg in messages], [twice.id, once.id])
+
+    def test_keyset_pagination(self):
+        """Do pages follow each other without repeats or gaps?"""
+
+        posted = [self.post(f"warbler number {n}") for n in range(5)]
+
+        first, cursor = search.search("warbler", limit=3)
+        second, last_cursor = search.search("warbler", limit=3, after=cursor)
+
+        self.assertEqual(len(first), 3)
+        self.assertEqual(len(second), 2)
+        self.assertIsNone(last_cursor)
+        self.assertEqual({msg.id for msg in first + second},
+                         {msg.id for msg in posted})
+
+    def test_old_matches_are_reachable(self):
+        """Are matches older than one window of candidates paged to?"""
+
+        posted = [self.post(f"warbler number {n}") for n in range(5)]
+
+        with patch.object(search, 'CANDIDATES', 2):
+            found = []
+            messages, cursor = search.search("warbler", limit=2)
+            found += messages
+            while cursor:
+                messages, cursor = search.search("warbler", limit=2,
+                                                 after=cursor)
+                found += messages
+
+        self.assertEqual([msg.id for msg in found],
+                         [msg.id for msg in reversed(posted)])
+
+    def test_deleted_message_is_unindexed(self):
+        """Does deleting a message remove it from results?"""
+
+        m = self.post("a doomed warbler")
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+            c.post(f"/messages/{m.id}/delete")
+
+        self.assertEqual(search.search("doomed"), ([], None))
+        self.assertEqual(SearchPosting.query.count(), 0)
+
+    def test_search_page(self):
+        """Does the search page show matching messages?"""
+
+        self.post("Spotted a blue warbler today")
+
+        resp = self.client.get('/search?q=blue')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(b'<p>Spotted a blue warbler today</p>', resp.data)
@@ -0,0 +1,74 @@
+"""Prefork server tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_server.py
+
+
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from unittest import TestCase
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from models import db
+from app import app
+
+db.create_all()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class ServerTestCase(TestCase):
+    """Run server.py in a subprocess and talk HTTP to it."""
+
+    def setUp(self):
+        self.address = f"127.0.0.1:{free_port()}"
+        self.server = subprocess.Popen(
+            [sys.executable, 'server.py', '--bind', self.address,
+             '--workers', '2', '--max-requests', '2',
+             '--max-requests-jitter', '0'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                socket.create_connection(self.address.split(':')).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+
+    def tearDown(self):
+        if self.server.poll() is None:
+            self.server.kill()
+            self.server.wait()
+
+    def get(self, path):
+        with urllib.request.urlopen(f"http://{self.address}{path}") as resp:
+            return resp.status
+
+    def test_workers_recycled(self):
+        """Are requests past every worker's limit served by new workers?"""
+
+        for _ in range(10):
+            self.assertEqual(self.get('/login'), 200)
+
+    def test_graceful_shutdown(self):
+        """Does the server exit cleanly on SIGTERM?"""
+
+        self.assertEqual(self.get('/login'), 200)
+
+        self.server.send_signal(signal.SIGTERM)
+        self.assertEqual(self.server.wait(timeout=15), 0)
@@ -0,0 +1,120 @@
+"""Snowflake id tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_snowflake.py
+
+
+import os
+import time
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, User, Message
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+import snowflake
+from snowflake import Snowflake
+
+db.create_all()
+
+
+class SnowflakeTestCase(TestCase):
+    """Test id layout and generation."""
+
+    def test_ids_increase(self):
+        """Are ids unique and increasing, even within a millisecond?"""
+
+        generator = Snowflake(worker_id=7)
+        ids = [generator.next_id() for _ in range(10000)]
+
+        self.assertEqual(ids, sorted(set(ids)))
+        self.assertEqual((ids[0] >> snowflake.WORKER_SHIFT)
+                         & snowflake.MAX_WORKER_ID, 7)
+
+    def test_backfill_carries_over(self):
+        """Do more than 4096 backfilled ids in a millisecond stay unique?"""
+
+        generator = Snowflake(worker_id=7)
+        when = datetime(2019, 5, 1, 12, 0)
+        ids = [generator.next_id(at=when)
+               for _ in range(snowflake.MAX_SEQUENCE + 3)]
+
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertEqual(snowflake.timestamp_of(ids[0]), when)
+        self.assertEqual(snowflake.timestamp_of(ids[-1]),
+                         when + timedelta(milliseconds=1))
+
+        # the next millisecond continues after the carried ids
+        later = generator.next_id(at=when + timedelta(milliseconds=1))
+        self.assertNotIn(later, ids)
+
+    def test_timestamp_round_trip(self):
+        """Does an id carry the time it was made at?"""
+
+        when = datetime(2021, 3, 4, 5, 6, 7, 8000)
+        message_id = Snowflake(worker_id=1).next_id(at=when)
+
+        self.assertEqual(snowflake.timestamp_of(message_id), when)
+        self.assertGreaterEqual(message_id, snowflake.first_id_at(when))
+        self.assertLess(message_id,
+                        snowflake.first_id_at(when + timedelta(milliseconds=1)))
+
+    def test_worker_ids_claimed(self):
+        """Do two generators on one database get different worker ids?"""
+
+        engine = db.get_engine()
+        first, second = Snowflake(), Snowflake()
+        first.next_id(engine)
+        second.next_id(engine)
+
+        self.assertNotEqual(first.worker_id, second.worker_id)
+        first._lock_conn.close()
+        second._lock_conn.close()
+
+
+class MessageIdTestCase(TestCase):
+    """Test ids and timestamps of inserted messages."""
+
+    def setUp(self):
+        Message.query.delete()
+        User.query.delete()
+
+        user = User(email="test@test.com", username="testuser",
+                    password="HASHED_PASSWORD")
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_each_message_gets_its_own_timestamp(self):
+        """Are timestamps taken at insert time, in id order?"""
+
+        first = Message(text="first", user_id=self.user_id)
+        db.session.add(first)
+        db.session.commit()
+        time.sleep(0.01)
+
+        second = Message(text="second", user_id=self.user_id)
+        db.session.add(second)
+        db.session.commit()
+
+        self.assertLess(first.id, second.id)
+        self.assertLess(first.timestamp, second.timestamp)
+        self.assertLess(datetime.utcnow() - second.timestamp,
+                        timedelta(minutes=1))
+        self.assertEqual(snowflake.timestamp_of(second.id), second.timestamp)
+
+    def test_backdated_message(self):
+        """Does a message with an explicit timestamp get an id at that time?"""
+
+        when = datetime(2019, 5, 1, 12, 0)
+        msg = Message(text="old", user_id=self.user_id, timestamp=when)
+        db.session.add(msg)
+        db.session.commit()
+
+        self.assertEqual(snowflake.timestamp_of(msg.id), when)
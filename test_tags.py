@@ -0,0 +1,119 @@
+"""Hashtag and mention tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_tags.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, MessageTag, Mention
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import tags
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class TagsTestCase(TestCase):
+    """Test hashtag and mention extraction and pages."""
+
+    def setUp(self):
+        """Create test client and users."""
+
+        MessageTag.query.delete()
+        Mention.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        self.client = app.test_client()
+
+        self.testuser = User.signup(username="testuser",
+                                    email="test@test.com",
+                                    password="testuser",
+                                    image_url=None)
+        self.birder = User.signup(username="birder",
+                                  email="birder@test.com",
+                                  password="birder",
+                                  image_url=None)
+        db.session.commit()
+
+        self.testuser_id = self.testuser.id
+        self.birder_id = self.birder.id
+
+    def post(self, text):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+            c.post("/messages/new", data={"text": text})
+
+        return Message.query.filter_by(text=text).one()
+
+    def test_extract(self):
+        """Are hashtags lowercased and mentions kept as written?"""
+
+        hashtags, usernames = tags.extract(
+            "#Birds with @birder and @Nobody, not an email a@b.com or a#b")
+
+        self.assertEqual(hashtags, {'birds'})
+        self.assertEqual(usernames, {'birder', 'Nobody'})
+
+    def test_post_records_tags_and_mentions(self):
+        """Does posting write tag rows and mentions of existing users?"""
+
+        m = self.post("Look @birder, a #Warbler! cc @ghost")
+
+        self.assertEqual([(t.tag, t.message_id) for t in MessageTag.query],
+                         [('warbler', m.id)])
+        self.assertEqual([(x.user_id, x.message_id) for x in Mention.query],
+                         [(self.birder_id, m.id)])
+
+    def test_tag_page_pagination(self):
+        """Does the tag page go newest first, one page at a time?"""
+
+        posted = [self.post(f"number {n} #birds") for n in range(3)]
+        self.post("no tags here")
+
+        first, before = tags.tagged_messages('BIRDS', limit=2)
+        second, last = tags.tagged_messages('birds', before=before, limit=2)
+
+        self.assertEqual([m.id for m in first],
+                         [posted[2].id, posted[1].id])
+        self.assertEqual([m.id for m in second], [posted[0].id])
+        self.assertIsNone(last)
+
+    def test_tag_page(self):
+        """Does /tags/<tag> show tagged messages?"""
+
+        self.post("Spring is here #birds")
+
+        resp = self.client.get('/tags/birds')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(b'<p>Spring is here #birds</p>', resp.data)
+
+    def test_mentions_page(self):
+        """Does a user's mentions page show messages mentioning them?"""
+
+        self.post("Hello @birder")
+
+        resp = self.client.get(f'/users/{self.birder_id}/mentions')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(b'<p>Hello @birder</p>', resp.data)
+
+    def test_backfill(self):
+        """Does backfill index messages inserted without the write path?"""
+
+        m = Message(text="Old #news for @birder", user_id=self.testuser_id)
+        db.session.add(m)
+        db.session.commit()
+
+        self.assertEqual(tags.backfill(), 1)
+        self.assertEqual(MessageTag.query.one().message_id, m.id)
+        self.assertEqual(Mention.query.one().user_id, self.birder_id)
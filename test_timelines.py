@@ -0,0 +1,146 @@
+"""Home timeline tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_timelines.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, User, Message, Follows
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from timelines import RecentPosts, recent_posts
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+START = datetime(2021, 1, 1)
+
+
+class TimelineTestCase(TestCase):
+    """Test timelines merged from per-author buffers."""
+
+    def setUp(self):
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+        db.session.commit()
+        recent_posts.clear()
+
+        self.client = app.test_client()
+
+        users = [User(email=f"{name}@test.com", username=name,
+                      password="HASHED_PASSWORD")
+                 for name in ('reader', 'alice', 'bob')]
+        db.session.add_all(users)
+        db.session.commit()
+
+        self.reader_id, self.alice_id, self.bob_id = [u.id for u in users]
+        db.session.add_all([
+            Follows(user_following_id=self.reader_id,
+                    user_being_followed_id=self.alice_id),
+            Follows(user_following_id=self.reader_id,
+                    user_being_followed_id=self.bob_id),
+        ])
+
+        # alice posts on even minutes, bob on odd ones
+        for minute in range(10):
+            author_id = self.alice_id if minute % 2 == 0 else self.bob_id
+            db.session.add(Message(text=f"minute {minute}", user_id=author_id,
+                                   timestamp=START + timedelta(minutes=minute)))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_merge_order(self):
+        """Are followed authors' posts interleaved newest first?"""
+
+        posts = RecentPosts(size=3)
+        ids = posts.timeline([self.alice_id, self.bob_id], limit=4)
+        texts = [Message.query.get(message_id).text for message_id in ids]
+
+        self.assertEqual(texts, ['minute 9', 'minute 8', 'minute 7',
+                                 'minute 6'])
+
+    def test_new_posts_from_other_processes(self):
+        """Does /timeline/new find posts the warm buffers haven't heard of?"""
+
+        seen = Message.query.filter_by(text="minute 9").one().id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.reader_id
+            c.get("/")
+
+            # posted through another worker: this process's buffers miss it
+            db.session.execute(Message.__table__.insert().values(
+                id=seen + 1, text="Elsewhere", user_id=self.bob_id,
+                timestamp=START))
+            db.session.commit()
+
+            html = c.get(f"/timeline/new?after={seen}").get_data(
+                as_text=True)
+            self.assertIn("Elsewhere", html)
+            self.assertNotIn("minute 9", html)
+
+    def test_warm_authors_skip_database(self):
+        """Are buffered authors served without another load?"""
+
+        posts = RecentPosts()
+        posts.timeline([self.alice_id, self.bob_id])
+        posts.timeline([self.alice_id, self.bob_id])
+
+        self.assertEqual(posts.db_loads, 1)
+
+    def test_record_and_forget(self):
+        """Do new posts join a warm buffer, and deletes leave it?"""
+
+        posts = RecentPosts(size=3)
+        posts.timeline([self.alice_id])
+
+        newest = Message.query.order_by(Message.id.desc()).first().id
+        posts.record_post(self.alice_id, newest + 1)
+        self.assertEqual(posts.timeline([self.alice_id], limit=1), [newest + 1])
+        self.assertEqual(posts.db_loads, 1)
+
+        posts.forget_post(self.alice_id, newest + 1)
+        self.assertNotIn(newest + 1, posts.timeline([self.alice_id]))
+        self.assertEqual(posts.db_loads, 2)
+
+    def test_homepage(self):
+        """Does the homepage show posts by followed users, newest first?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.reader_id
+
+            resp = c.get("/")
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertLess(html.index('minute 9'), html.index('minute 0'))
+
+    def test_new_post_shows_on_follower_homepage(self):
+        """Is a post made after the timeline was cached shown?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.reader_id
+            c.get("/")
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.alice_id
+            c.post("/messages/new", data={"text": "Fresh warble"})
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.reader_id
+            html = c.get("/").get_data(as_text=True)
+
+            self.assertIn('Fresh warble', html)
@@ -0,0 +1,172 @@
+"""Trending tracker tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_trending.py
+
+
+import os
+import tempfile
+from unittest import TestCase
+
+from trending import Trending, TrendingWindow
+
+HOUR = 60 * 60
+
+
+class TrendingWindowTestCase(TestCase):
+    """Test decayed scores and the top-K heap."""
+
+    def test_ranked_by_likes(self):
+        """Does the most-liked message come first?"""
+
+        window = TrendingWindow(HOUR, size=10)
+        for message_id, likes in [(1, 1), (2, 3), (3, 2)]:
+            for _ in range(likes):
+                window.add(message_id, window.epoch)
+
+        self.assertEqual([m for m, _ in window.top(window.epoch)], [2, 3, 1])
+
+    def test_recent_likes_outweigh_old(self):
+        """Does a fresh like beat an older one?"""
+
+        window = TrendingWindow(HOUR, size=10)
+        now = window.epoch
+        window.add(1, now)
+        window.add(2, now + HOUR / 2)
+
+        self.assertEqual([m for m, _ in window.top(now + HOUR / 2)], [2, 1])
+
+    def test_bounded_top_k(self):
+        """Is only the top K kept, evicting the weakest?"""
+
+        window = TrendingWindow(HOUR, size=2)
+        now = window.epoch
+        for message_id, likes in [(1, 1), (2, 2), (3, 3)]:
+            for _ in range(likes):
+                window.add(message_id, now)
+
+        self.assertEqual([m for m, _ in window.top(now)], [3, 2])
+
+    def test_unlike_demotes(self):
+        """Does removing likes let another message back into the top K?"""
+
+        window = TrendingWindow(HOUR, size=1)
+        now = window.epoch
+        window.add(1, now)
+        window.add(1, now)
+        window.add(2, now)
+        window.remove(1)
+        window.remove(1)
+
+        self.assertEqual([m for m, _ in window.top(now)], [2])
+
+    def test_old_likes_fall_out(self):
+        """Are messages not liked within the window pruned?"""
+
+        window = TrendingWindow(HOUR, size=10)
+        now = window.epoch
+        window.add(1, now)
+
+        self.assertEqual(window.top(now + 2 * HOUR), [])
+
+    def test_rebase_keeps_order(self):
+        """Does rebasing the epoch keep scores finite and order intact?"""
+
+        window = TrendingWindow(1, size=10)
+        now = window.epoch
+        window.add(1, now + 100)
+        window.add(1, now + 100)
+        window.add(2, now + 100)
+
+        self.assertEqual(window.epoch, now + 100)
+        self.assertEqual([m for m, _ in window.top(now + 100)], [1, 2])
+
+
+class TrendingTestCase(TestCase):
+    """Test the tracker and its snapshots."""
+
+    def test_snapshot_round_trip(self):
+        """Does a saved snapshot restore the same rankings?"""
+
+        tracker = Trending()
+        tracker.record_like(5)
+        tracker.record_like(5)
+        tracker.record_like(6)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'trending.json')
+            tracker.save(path)
+
+            restored = Trending()
+            self.assertTrue(restored.load(path))
+
+        self.assertEqual([m for m, _ in restored.top('1h')], [5, 6])
+        self.assertEqual([m for m, _ in restored.top('24h')], [5, 6])
+
+    def test_discard(self):
+        """Is a deleted message removed from every window?"""
+
+        tracker = Trending()
+        tracker.record_like(5)
+        tracker.discard(5)
+
+        self.assertEqual(tracker.top('1h'), [])
+        self.assertEqual(tracker.top('24h'), [])
+
+    def test_workers_share_rankings(self):
+        """Are other processes' snapshots, and not our own, added in?"""
+
+        with tempfile.TemporaryDirectory() as tmp:
+            tracker = Trending()
+            tracker.snapshot_dir = tmp
+            tracker.record_like(5)
+            tracker.record_like(5)
+            tracker.save()
+
+            other = Trending()
+            for _ in range(3):
+                other.record_like(6)
+            other.record_like(7)
+            other.save(os.path.join(tmp, 'trending-1-0.json'))
+
+            top = tracker.top('1h')
+
+        self.assertEqual([m for m, _ in top], [6, 5, 7])
+
+    def test_flush(self):
+        """Is a snapshot written when there are changes, and only then?"""
+
+        with tempfile.TemporaryDirectory() as tmp:
+            tracker = Trending()
+            tracker.snapshot_dir = tmp
+            tracker.record_like(5)
+            tracker.flush()
+
+            path = tracker.snapshot_path()
+            restored = Trending()
+            self.assertTrue(restored.load(path))
+            self.assertEqual([m for m, _ in restored.top('1h')], [5])
+
+            os.remove(path)
+            tracker.flush()
+            self.assertFalse(os.path.exists(path))
+
+    def test_deletes_shared(self):
+        """Are messages deleted in any process dropped everywhere?"""
+
+        with tempfile.TemporaryDirectory() as tmp:
+            tracker = Trending()
+            tracker.snapshot_dir = tmp
+            tracker.record_like(5)
+
+            other = Trending()
+            for message_id in (5, 6, 7):
+                other.record_like(message_id)
+            other.discard(5)
+            other.save(os.path.join(tmp, 'trending-1-0.json'))
+
+            self.assertEqual(sorted(m for m, _ in tracker.top('1h')), [6, 7])
+
+            tracker.discard(6)
+            self.assertEqual([m for m, _ in tracker.top('1h')], [7])
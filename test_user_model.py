@@ -8,6 +8,8 @@
 import os
 from unittest import TestCase
 
+from sqlalchemy.exc import IntegrityError
+
 from models import db, User, Message, Follows
 
 # BEFORE we import our app, let's set an environmental variable
@@ -115,6 +117,33 @@ class UserModelTestCase(TestCase):
         self.assertEqual(len(u1.following), 0)
         self.assertFalse(u1.is_following(u2))
 
+    def test_user_following_ids(self):
+        """Are followed and liked ids returned as sets?"""
+
+        u1 = User(
+            email="test1@test.com",
+            username="testuser1",
+            password="HASHED_PASSWORD"
+        )
+        u2 = User(
+            email="test2@test.com",
+            username="testuser2",
+            password="HASHED_PASSWORD"
+        )
+
+        db.session.add_all([u1, u2])
+        db.session.commit()
+
+        m = Message(text="Hello", user_id=u2.id)
+        u1.following.append(u2)
+        u1.likes.append(m)
+        db.session.commit()
+
+        self.assertEqual(u1.following_ids(), {u2.id})
+        self.assertEqual(u1.following_ids_list(), [u2.id])
+        self.assertIn(m.id, u1.liked_message_ids())
+        self.assertEqual(u2.following_ids(), frozenset())
+
     def test_user_followed_by(self):
         """Detect followed by?"""
 
@@ -173,8 +202,9 @@ class UserModelTestCase(TestCase):
         old_user = User.signup("username", "test@test.com", "testpassword",
                                'https://images.unsplash.com/photo-1508214751196-bcfd4ca60f91?ixid=MXwxMjA3fDB8MHx0b3BpYy1mZWVkfDZ8dG93SlpGc2twR2d8fGVufDB8fHw%3D&ixlib=rb-1.2.1&auto=format&fit=crop&w=800&q=60')
 
-        new_user = User.signup("username", "test1@test.com", "test1password",
-                               'https://images.unsplash.com/photo-1474176857210-7287d38d27c6?ixid=MXwxMjA3fDB8MHx0b3BpYy1mZWVkfDV8dG93SlpGc2twR2d8fGVufDB8fHw%3D&ixlib=rb-1.2.1&auto=format&fit=crop&w=800&q=60')
+        with self.assertRaises(IntegrityError):
+            User.signup("username", "test1@test.com", "test1password",
+                        'https://images.unsplash.com/photo-1474176857210-7287d38d27c6?ixid=MXwxMjA3fDB8MHx0b3BpYy1mZWVkfDV8dG93SlpGc2twR2d8fGVufDB8fHw%3D&ixlib=rb-1.2.1&auto=format&fit=crop&w=800&q=60')
 
         new_user = User.get_by_email("test1@test.com")
         self.assertIsNone(new_user)
@@ -185,8 +215,9 @@ class UserModelTestCase(TestCase):
         old_user = User.signup("username", "test@test.com", "testpassword",
                                'https://images.unsplash.com/photo-1508214751196-bcfd4ca60f91?ixid=MXwxMjA3fDB8MHx0b3BpYy1mZWVkfDZ8dG93SlpGc2twR2d8fGVufDB8fHw%3D&ixlib=rb-1.2.1&auto=format&fit=crop&w=800&q=60')
 
-        new_user = User.signup("username1", "test@test.com", "test1password",
-                               'https://images.unsplash.com/photo-1474176857210-7287d38d27c6?ixid=MXwxMjA3fDB8MHx0b3BpYy1mZWVkfDV8dG93SlpGc2twR2d8fGVufDB8fHw%3D&ixlib=rb-1.2.1&auto=format&fit=crop&w=800&q=60')
+        with self.assertRaises(IntegrityError):
+            User.signup("username1", "test@test.com", "test1password",
+                        'https://images.unsplash.com/photo-1474176857210-7287d38d27c6?ixid=MXwxMjA3fDB8MHx0b3BpYy1mZWVkfDV8dG93SlpGc2twR2d8fGVufDB8fHw%3D&ixlib=rb-1.2.1&auto=format&fit=crop&w=800&q=60')
 
         new_user = User.get_by_email("username1")
         self.assertIsNone(new_user)
@@ -273,3 +273,47 @@ class UserViewTestCase(TestCase):
 
 
 
+
+    def test_user_follow_twice(self):
+        """Is following someone already followed a no-op?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser1.id
+
+            u2 = User.get_by_username('testuser2')
+            c.post(f"users/follow/{u2.id}")
+            resp = c.post(f"users/follow/{u2.id}")
+
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(Follows.query.count(), 1)
+
+    def test_user_stop_follow_missing(self):
+        """Is unfollowing a missing or unfollowed user a no-op?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser1.id
+
+            u2 = User.get_by_username('testuser2')
+            resp = c.post(f"users/stop-following/{u2.id}")
+            self.assertEqual(resp.status_code, 302)
+
+            resp = c.post("users/stop-following/999999")
+            self.assertEqual(resp.status_code, 302)
+
+    def test_delete_user_with_messages(self):
+        """Can a user with messages and follows delete their profile?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser1.id
+
+            u2 = User.get_by_username('testuser2')
+            c.post(f"users/follow/{u2.id}")
+            resp = c.post("/users/delete")
+
+            self.assertEqual(resp.status_code, 302)
+            self.assertIsNone(User.get_by_username('testuser1'))
+            self.assertEqual(Message.query.count(), 0)
+            self.assertEqual(Follows.query.count(), 0)
@@ -0,0 +1,199 @@
+"""NDJSON export and import tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_userdata.py
+
+
+import json
+import os
+from collections import Counter
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import (db, User, Message, Follows, Likes, ArchivedMessage,
+                    ArchivedLike, MessagePartition, SearchPosting, MessageTag)
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import archive
+import jobs
+import userdata
+
+db.create_all()
+
+
+class UserDataTestCase(TestCase):
+    """Test streaming exports and idempotent imports."""
+
+    def clear(self):
+        ArchivedLike.query.delete()
+        ArchivedMessage.query.delete()
+        MessagePartition.query.delete()
+        Likes.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+        db.session.commit()
+        archive._boundary = (None, 0)
+
+    def setUp(self):
+        self.clear()
+        self.client = app.test_client()
+
+        users = [User(email=f"{name}@test.com", username=name,
+                      password="HASHED_PASSWORD")
+                 for name in ('alice', 'bob', 'carol')]
+        db.session.add_all(users)
+        db.session.commit()
+        self.alice_id, self.bob_id, self.carol_id = [u.id for u in users]
+
+        db.session.add_all([
+            Follows(user_following_id=self.alice_id,
+                    user_being_followed_id=self.bob_id),
+            Follows(user_following_id=self.carol_id,
+                    user_being_followed_id=self.alice_id),
+            Follows(user_following_id=self.bob_id,
+                    user_being_followed_id=self.carol_id),
+        ])
+        messages = [Message(text="Tabs\tand\nnewlines \\ #birds",
+                            user_id=self.alice_id),
+                    Message(text="From bob", user_id=self.bob_id)]
+        db.session.add_all(messages)
+        db.session.commit()
+        self.alice_message_id, self.bob_message_id = [m.id for m in messages]
+
+        db.session.add(Likes(user_id=self.alice_id,
+                             message_id=self.bob_message_id))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def records(self, lines):
+        return [json.loads(line) for line in ''.join(lines).splitlines()]
+
+    def test_export_endpoint(self):
+        """Does a user download only their own data, without a password?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.alice_id
+
+            resp = c.get("/users/export")
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.mimetype, 'application/x-ndjson')
+            records = self.records(resp.get_data(as_text=True))
+
+        types = [record['type'] for record in records]
+        self.assertEqual(types, ['user', 'message', 'follow', 'follow',
+                                 'like'])
+        self.assertEqual(records[0]['username'], 'alice')
+        self.assertNotIn('password', records[0])
+        self.assertEqual(records[1]['text'], "Tabs\tand\nnewlines \\ #birds")
+
+    def test_export_requires_login(self):
+        resp = self.client.get("/users/export")
+        self.assertEqual(resp.status_code, 302)
+
+    def test_messages_endpoint(self):
+        """Are archived warbles exported along with hot ones?"""
+
+        db.session.add(ArchivedMessage(
+            id=1, text="Old one", user_id=self.bob_id,
+            timestamp=datetime(2000, 1, 1), partition='2000-01'))
+        db.session.commit()
+
+        resp = self.client.get(f"/users/{self.bob_id}/messages.ndjson")
+        records = self.records(resp.get_data(as_text=True))
+
+        self.assertEqual([record['text'] for record in records],
+                         ["Old one", "From bob"])
+
+    def test_round_trip(self):
+        """Does an import restore an export, and is a second one a no-op?"""
+
+        lines = list(userdata.export_lines(passwords=True))
+        self.clear()
+
+        importer = userdata.import_lines(lines, batch_size=2)
+
+        self.assertEqual(importer.inserted, Counter(user=3, message=2,
+                                                    follow=3, like=1))
+        self.assertEqual(User.query.get(self.alice_id).password,
+                         "HASHED_PASSWORD")
+        self.assertEqual(Message.query.get(self.alice_message_id).text,
+                         "Tabs\tand\nnewlines \\ #birds")
+
+        # indexed afterwards, by a job
+        self.assertEqual(SearchPosting.query.count(), 0)
+        jobs.run_pending('batch')
+        self.assertTrue(SearchPosting.query.filter_by(
+            term='newlines', message_id=self.alice_message_id).count())
+        self.assertTrue(MessageTag.query.filter_by(
+            tag='birds', message_id=self.alice_message_id).count())
+
+        again = userdata.import_lines(lines)
+        self.assertEqual(sum(again.inserted.values()), 0)
+        self.assertEqual(again.existing, Counter(user=3, message=2,
+                                                 follow=3, like=1))
+
+        # the id sequence was moved past the imported ids
+        db.session.add(User(email="new@test.com", username="new",
+                            password="HASHED_PASSWORD"))
+        db.session.commit()
+
+    def test_reimport_after_rollover(self):
+        """Do archived messages and their likes stay in the archive?"""
+
+        old = Message(text="Ancient", user_id=self.bob_id,
+                      timestamp=datetime.utcnow() - timedelta(days=365))
+        db.session.add(old)
+        db.session.commit()
+        old_id = old.id
+        db.session.add(Likes(message_id=old_id, user_id=self.carol_id))
+        db.session.commit()
+        archive.rollover()
+
+        lines = list(userdata.export_lines(passwords=True))
+        self.assertIn({'type': 'like', 'user_id': self.carol_id,
+                       'message_id': old_id},
+                      [json.loads(line) for line in lines])
+
+        again = userdata.import_lines(lines)
+
+        self.assertEqual(sum(again.inserted.values()), 0)
+        self.assertEqual(again.existing['message'], 3)
+        self.assertEqual(again.existing['like'], 2)
+        self.assertIsNone(Message.query.get(old_id))
+
+        # a missing archived like is restored to the archive
+        ArchivedLike.query.delete()
+        db.session.commit()
+        again = userdata.import_lines(lines)
+        self.assertEqual(again.inserted['like'], 1)
+        self.assertEqual(ArchivedLike.query.one().user_id, self.carol_id)
+
+    def test_missing_references_skipped(self):
+        """Are rows about unknown users or messages skipped and counted?"""
+
+        lines = [
+            json.dumps(dict(type='like', user_id=self.alice_id,
+                            message_id=12345)),
+            json.dumps(dict(type='follow', user_following_id=self.alice_id,
+                            user_being_followed_id=999999)),
+            # bob's id, but somebody else's username
+            json.dumps(dict(type='user', id=self.bob_id, username='mallory',
+                            email='mallory@test.com')),
+            json.dumps(dict(type='message', id=777, text="Not bob's",
+                            timestamp='2021-01-01T00:00:00',
+                            user_id=self.bob_id)),
+        ]
+        importer = userdata.import_lines(lines)
+
+        self.assertEqual(importer.skipped, Counter(like=1, follow=1,
+                                                   message=1))
+        self.assertEqual(sum(importer.inserted.values()), 0)
+        self.assertIsNone(Message.query.get(777))
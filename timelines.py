@@ -0,0 +1,184 @@
+"""Home timelines assembled from per-author recent-post buffers.
+
+Each process keeps, for recently seen authors, a ring buffer of the ids of
+their newest TIMELINE_SIZE messages, oldest first; message ids are
+time-ordered (see snowflake.py). A home timeline is a k-way merge of the
+buffers of every followed author, newest first, cut at TIMELINE_SIZE; since
+no single author can contribute more than that, the newest TIMELINE_SIZE
+posts per author are all the merge ever needs. Authors without a buffer
+("cold") are loaded from the database together in one query, a LATERAL
+join that reads each author's newest posts as a short backward scan of
+ix_messages_user_id_id, and the merged ids are then fetched in one primary
+key lookup.
+
+Posts and deletes made through this process update its buffers right away.
+Buffers are reloaded after TTL seconds, which bounds how long another
+process's posts can be missing here; ids of messages deleted elsewhere
+simply aren't found when the timeline's messages are loaded. Fetches of
+just the posts newer than one already shown (newer_messages) go to the
+database instead, since they follow announcements of posts made anywhere.
+"""
+
+import heapq
+import threading
+import time
+from collections import OrderedDict, deque
+from itertools import islice
+
+from sqlalchemy import text
+
+import readmodels
+from models import db, Message
+
+TIMELINE_SIZE = 100
+MAX_AUTHORS = 50000
+TTL = 60
+
+
+class RecentPosts:
+    """LRU of per-author ring buffers of message ids."""
+
+    def __init__(self, size=TIMELINE_SIZE, max_authors=MAX_AUTHORS, ttl=TTL):
+        self.size = size
+        self.max_authors = max_authors
+        self.ttl = ttl
+        # author id -> (loaded at, deque of message ids, oldest first)
+        self._buffers = OrderedDict()
+        self._lock = threading.Lock()
+        self.db_loads = 0
+
+    def record_post(self, author_id, message_id):
+        """Add a new message to its author's buffer, if the author is warm."""
+
+        with self._lock:
+            cached = self._buffers.get(author_id)
+            if cached is None:
+                return
+
+            buffer = cached[1]
+            if not buffer or message_id > buffer[-1]:
+                # the usual case: a new post is the newest
+                buffer.append(message_id)
+            elif message_id not in buffer:
+                merged = sorted([*buffer, message_id])[-self.size:]
+                buffer.clear()
+                buffer.extend(merged)
+
+    def forget_post(self, author_id, message_id):
+        """Drop a deleted message from its author's buffer.
+
+        The buffer may now hold fewer than `size` posts while the author has
+        older ones in the database, so it is reloaded on next use.
+        """
+
+        with self._lock:
+            cached = self._buffers.get(author_id)
+            if cached is not None and message_id in cached[1]:
+                del self._buffers[author_id]
+
+    def forget_author(self, author_id):
+        with self._lock:
+            self._buffers.pop(author_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._buffers.clear()
+
+    def recent(self, author_ids):
+        """Return {author id: [message id, ...] oldest first}."""
+
+        now = time.monotonic()
+        found = {}
+        cold = []
+
+        with self._lock:
+            for author_id in author_ids:
+                cached = self._buffers.get(author_id)
+                if cached is None or now - cached[0] > self.ttl:
+                    cold.append(author_id)
+                else:
+                    self._buffers.move_to_end(author_id)
+                    found[author_id] = list(cached[1])
+
+        if cold:
+            loaded = self._load(cold)
+            with self._lock:
+                for author_id in cold:
+                    buffer = deque(loaded.get(author_id, ()), maxlen=self.size)
+                    self._buffers[author_id] = (now, buffer)
+                    self._buffers.move_to_end(author_id)
+                    found[author_id] = list(buffer)
+
+                while len(self._buffers) > self.max_authors:
+                    self._buffers.popitem(last=False)
+
+        return found
+
+    def timeline(self, author_ids, limit=TIMELINE_SIZE):
+        """Ids of the newest `limit` messages by `author_ids`, newest first."""
+
+        buffers = self.recent(author_ids).values()
+        merged = heapq.merge(*(reversed(buffer) for buffer in buffers),
+                             reverse=True)
+        return list(islice(merged, limit))
+
+    def _load(self, author_ids):
+        """Each author's newest `size` posts, in one query."""
+
+        self.db_loads += 1
+
+        loaded = {}
+        for author_id, message_id in db.session.execute(
+                LATEST_POSTS, {'author_ids': list(author_ids),
+                               'size': self.size}):
+            loaded.setdefault(author_id, []).append(message_id)
+
+        # newest first from the query; buffers are oldest first
+        for message_ids in loaded.values():
+            message_ids.reverse()
+        return loaded
+
+
+# one index range scan per author, however many posts they have
+LATEST_POSTS = text("""
+    SELECT authors.user_id, latest.id
+    FROM unnest(CAST(:author_ids AS integer[])) AS authors (user_id)
+    CROSS JOIN LATERAL (
+        SELECT messages.id
+        FROM messages
+        WHERE messages.user_id = authors.user_id
+        ORDER BY messages.id DESC
+        LIMIT :size
+    ) AS latest
+""")
+
+
+recent_posts = RecentPosts()
+
+record_post = recent_posts.record_post
+forget_post = recent_posts.forget_post
+
+
+def home_timeline(author_ids, limit=TIMELINE_SIZE):
+    """The newest `limit` messages by `author_ids`, newest first."""
+
+    return readmodels.messages_by_ids(recent_posts.timeline(author_ids, limit))
+
+
+def newer_messages(author_ids, after, limit=TIMELINE_SIZE):
+    """Messages by `author_ids` newer than id `after`, newest first.
+
+    Read from the database rather than the buffers, so posts made through
+    other processes are found as soon as push.py announces them.
+    """
+
+    if not author_ids:
+        return []
+
+    messages = Message.__table__
+    return readmodels.message_items(
+        readmodels.select_messages()
+        .where(messages.c.user_id.in_(author_ids))
+        .where(messages.c.id > after)
+        .order_by(messages.c.id.desc())
+        .limit(limit))
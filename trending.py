@@ -0,0 +1,443 @@
+"""Trending warbles, kept in memory and updated as likes happen.
+
+Each window (1h, 24h) holds a time-decayed like score per message. A like
+at time t adds exp((t - epoch) / span) to the message's score, so scores
+never need decaying as time passes: comparing them at any moment gives the
+same order as comparing exp(-(now - t) / span) sums. The epoch is moved
+forward now and then to keep the numbers finite.
+
+A bounded min-heap per window tracks the top K messages, so a like costs
+O(log K) and reading the trending page costs no database work beyond
+loading the K messages themselves.
+
+Each process only sees the likes it handles itself, and under server.py
+there are several processes. So a thread in every process writes its
+scores, when they have changed, every SNAPSHOT_INTERVAL seconds to a
+snapshot file of its own in the snapshot directory (atomically: a temp
+file, then os.replace), and server.py workers write theirs once more
+before they exit. Rankings add up the process's live scores and every
+other snapshot in the directory, read again at most every
+SNAPSHOT_INTERVAL. All processes therefore serve the same ranking, give or
+take SNAPSHOT_INTERVAL seconds of other processes' likes, and the likes of
+recycled or restarted processes keep counting until they age out of the
+windows. Snapshots also list the messages deleted through their process,
+which every process drops from its rankings. Snapshots older than the
+longest window are deleted. An unlike only takes back a like handled by
+the same process.
+"""
+
+import glob
+import heapq
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+WINDOWS = {'1h': 60 * 60, '24h': 24 * 60 * 60}
+TOP_K = 100
+SNAPSHOT_INTERVAL = 60
+# rebase scores once exponents get this large (e**50 is still tiny for a float)
+MAX_EXPONENT = 50
+
+
+class TrendingWindow:
+    """Decayed like scores for one window, with a top-K heap."""
+
+    def __init__(self, span, size=TOP_K):
+        self.span = span
+        self.size = size
+        self.epoch = time.time()
+        # message id -> [score, like count, last liked at]
+        self.scores = {}
+        # (score, message id) of the current top K, smallest first; entries
+        # whose score is out of date are skipped and cleaned up lazily
+        self._heap = []
+        self._members = set()
+        self._dirty = False
+        self._pruned_at = self.epoch
+
+    def add(self, message_id, now):
+        """Count a like of `message_id` made at `now`."""
+
+        if (now - self.epoch) / self.span > MAX_EXPONENT:
+            self._rebase(now)
+
+        entry = self.scores.setdefault(message_id, [0.0, 0, now])
+        entry[0] += math.exp((now - self.epoch) / self.span)
+        entry[1] += 1
+        entry[2] = now
+
+        self._offer(message_id, entry[0])
+
+    def remove(self, message_id):
+        """Take back one like of `message_id`.
+
+        Like times aren't kept, so the removed like is assumed to be worth
+        the average of that message's likes.
+        """
+
+        entry = self.scores.get(message_id)
+        if entry is None:
+            return
+
+        if entry[1] <= 1:
+            self.discard(message_id)
+            return
+
+        entry[0] *= (entry[1] - 1) / entry[1]
+        entry[1] -= 1
+        if message_id in self._members:
+            self._dirty = True
+
+    def discard(self, message_id):
+        """Forget `message_id` entirely (e.g. it was deleted)."""
+
+        if self.scores.pop(message_id, None) is not None:
+            if message_id in self._members:
+                self._dirty = True
+
+    def prune(self, now):
+        """Drop messages that haven't been liked within the window."""
+
+        cutoff = now - self.span
+        stale = [message_id for message_id, entry in self.scores.items()
+                 if entry[2] < cutoff]
+        for message_id in stale:
+            self.discard(message_id)
+        self._pruned_at = now
+
+    def top(self, now, k=None):
+        """Return up to `k` (message id, score) pairs, highest first.
+
+        Scores are decayed to `now`, so they read as "effective likes".
+        """
+
+        if now - self._pruned_at > self.span / 10:
+            self.prune(now)
+        if self._dirty:
+            self._rebuild()
+
+        decay = math.exp(-(now - self.epoch) / self.span)
+        ranked = sorted(((self.scores[message_id][0], message_id)
+                         for message_id in self._members), reverse=True)
+        return [(message_id, score * decay)
+                for score, message_id in ranked[:k or self.size]]
+
+    def _offer(self, message_id, score):
+        if self._dirty:
+            self._rebuild()
+
+        if message_id in self._members:
+            heapq.heappush(self._heap, (score, message_id))
+            if len(self._heap) > 4 * self.size:
+                self._rebuild()
+            return
+
+        if len(self._members) < self.size:
+            heapq.heappush(self._heap, (score, message_id))
+            self._members.add(message_id)
+            return
+
+        self._drop_stale()
+        if score > self._heap[0][0]:
+            _, evicted = heapq.heapreplace(self._heap, (score, message_id))
+            self._members.discard(evicted)
+            self._members.add(message_id)
+
+    def _is_stale(self, item):
+        score, message_id = item
+        entry = self.scores.get(message_id)
+        return (message_id not in self._members
+                or entry is None or entry[0] != score)
+
+    def _drop_stale(self):
+        while self._heap and self._is_stale(self._heap[0]):
+            heapq.heappop(self._heap)
+
+    def _rebuild(self):
+        top = heapq.nlargest(self.size, ((entry[0], message_id)
+                                         for message_id, entry
+                                         in self.scores.items()))
+        heapq.heapify(top)
+        self._heap = top
+        self._members = {message_id for _, message_id in top}
+        self._dirty = False
+
+    def _rebase(self, now):
+        factor = math.exp(-(now - self.epoch) / self.span)
+        for entry in self.scores.values():
+            entry[0] *= factor
+        self.epoch = now
+        self._rebuild()
+
+    def dump(self):
+        return {'epoch': self.epoch,
+                'scores': [[message_id] + entry
+                           for message_id, entry in self.scores.items()]}
+
+    def load(self, data):
+        self.epoch = data['epoch']
+        self.scores = {message_id: [score, likes, last_liked]
+                       for message_id, score, likes, last_liked
+                       in data['scores']}
+        self._rebuild()
+
+    def merge(self, other):
+        """Add `other`'s scores (for the same span) into this window."""
+
+        epoch = max(self.epoch, other.epoch)
+        if epoch != self.epoch:
+            self._rebase(epoch)
+
+        factor = math.exp((other.epoch - epoch) / self.span)
+        for message_id, (score, likes, last_liked) in other.scores.items():
+            entry = self.scores.setdefault(message_id, [0.0, 0, last_liked])
+            entry[0] += score * factor
+            entry[1] += likes
+            entry[2] = max(entry[2], last_liked)
+        self._rebuild()
+
+    def top_with(self, other, now, k=None):
+        """top() of this window's scores plus `other`'s, without merging.
+
+        Only this window's messages and `other`'s own top K can be in the
+        combined top K: any other message has K messages ahead of it in
+        `other` alone. So the cost is this window's size plus K.
+        """
+
+        k = k or self.size
+        if now - self._pruned_at > self.span / 10:
+            self.prune(now)
+
+        # other.top() prunes `other` first, so read its scores after
+        other_top = other.top(now, k)
+        mine = math.exp(-(now - self.epoch) / self.span)
+        theirs = math.exp(-(now - other.epoch) / self.span)
+
+        totals = {}
+        for message_id, entry in self.scores.items():
+            other_entry = other.scores.get(message_id)
+            totals[message_id] = entry[0] * mine + (
+                other_entry[0] * theirs if other_entry else 0)
+        for message_id, score in other_top:
+            totals.setdefault(message_id, score)
+
+        return heapq.nlargest(k, totals.items(), key=lambda item: item[1])
+
+
+class Trending:
+    """All trending windows, safe to share between request threads."""
+
+    def __init__(self, windows=WINDOWS, size=TOP_K):
+        self.windows = {name: TrendingWindow(span, size)
+                        for name, span in windows.items()}
+        self.snapshot_dir = None
+        self._lock = threading.Lock()
+        # unsaved changes, and the process whose thread saves them
+        self._changed = False
+        self._saver_pid = None
+        # this process's snapshot file, named once it has forked
+        self._pid = None
+        self._snapshot_path = None
+        # message id -> when it was deleted through this process
+        self._discarded = {}
+        # other processes' windows, summed, as of _read_at
+        self._others = {}
+        self._read_at = 0
+
+    def record_like(self, message_id, now=None):
+        now = now or time.time()
+        with self._lock:
+            for window in self.windows.values():
+                window.add(message_id, now)
+            self._touch()
+
+    def record_unlike(self, message_id, now=None):
+        with self._lock:
+            for window in self.windows.values():
+                window.remove(message_id)
+            self._touch()
+
+    def discard(self, message_id, now=None):
+        """Forget a deleted message, here and in other processes' scores.
+
+        The deletion is saved with this process's snapshot, so other
+        processes drop the message from theirs, too.
+        """
+
+        with self._lock:
+            for window in self.windows.values():
+                window.discard(message_id)
+            for window in self._others.values():
+                window.discard(message_id)
+            self._discarded[message_id] = now or time.time()
+            self._touch()
+
+    def top(self, window='24h', k=None, now=None):
+        """Top (message id, score) pairs across every process's likes."""
+
+        now = now or time.time()
+        self._other_windows(now)
+        with self._lock:
+            others = self._others.get(window)
+            if others is None:
+                return self.windows[window].top(now, k)
+            return self.windows[window].top_with(others, now, k)
+
+    def snapshot_path(self):
+        """This process's snapshot file in the snapshot directory."""
+
+        if self._pid != os.getpid():
+            # forked: a new process, with a file of its own
+            self._pid = os.getpid()
+            self._snapshot_path = os.path.join(
+                self.snapshot_dir,
+                f"trending-{self._pid}-{int(time.time() * 1000)}.json")
+        return self._snapshot_path
+
+    def flush(self):
+        """Save this process's snapshot, if anything changed since the last.
+
+        Called every SNAPSHOT_INTERVAL by a thread, and by server.py before
+        a worker exits.
+        """
+
+        if self.snapshot_dir and self._changed:
+            self._changed = False
+            self.save()
+
+    def save(self, path=None):
+        """Write all windows to a JSON file, atomically."""
+
+        path = path or self.snapshot_path()
+        now = time.time()
+        expired = now - max(window.span for window in self.windows.values())
+        with self._lock:
+            self._discarded = {message_id: at for message_id, at
+                               in self._discarded.items() if at > expired}
+            data = {'saved_at': now,
+                    'windows': {name: window.dump()
+                                for name, window in self.windows.items()},
+                    'discarded': list(self._discarded.items())}
+
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        """Restore windows from a snapshot; return False if there is none."""
+
+        snapshot = self.read(path)
+        if snapshot is None:
+            return False
+
+        with self._lock:
+            self.windows.update(snapshot[0])
+        return True
+
+    def read(self, path):
+        """Return ({window name: TrendingWindow}, deleted message ids).
+
+        None if there is no readable snapshot at `path`.
+        """
+
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        windows = {}
+        for name, window_data in data['windows'].items():
+            if name in self.windows:
+                window = TrendingWindow(self.windows[name].span,
+                                        self.windows[name].size)
+                window.load(window_data)
+                windows[name] = window
+        discarded = {message_id for message_id, _
+                     in data.get('discarded', ())}
+        return windows, discarded
+
+    def _other_windows(self, now):
+        """Re-read and sum other processes' snapshots, if it's time.
+
+        Messages deleted through any process are dropped from the sums and
+        from this process's own windows.
+        """
+
+        if not self.snapshot_dir or now - self._read_at < SNAPSHOT_INTERVAL:
+            return
+        self._read_at = now
+
+        own = self.snapshot_path()
+        expired = now - max(window.span for window in self.windows.values())
+        others = {}
+        discarded = set()
+        for path in glob.glob(os.path.join(self.snapshot_dir,
+                                           'trending-*.json')):
+            if path == own:
+                continue
+            try:
+                if os.path.getmtime(path) < expired:
+                    os.remove(path)
+                    continue
+            except OSError:
+                continue
+
+            snapshot = self.read(path)
+            if snapshot is None:
+                continue
+            windows, deleted = snapshot
+            discarded |= deleted
+            for name, window in windows.items():
+                if name in others:
+                    others[name].merge(window)
+                else:
+                    others[name] = window
+
+        with self._lock:
+            discarded |= self._discarded.keys()
+            for message_id in discarded:
+                for window in (*others.values(), *self.windows.values()):
+                    window.discard(message_id)
+            self._others = others
+
+    def _touch(self):
+        # with the lock held
+        self._changed = True
+        if self.snapshot_dir and self._saver_pid != os.getpid():
+            # threads don't survive fork(); each process starts its own
+            self._saver_pid = os.getpid()
+            threading.Thread(target=self._save_periodically, daemon=True,
+                             name='trending-snapshots').start()
+
+    def _save_periodically(self):
+        while True:
+            time.sleep(SNAPSHOT_INTERVAL)
+            try:
+                self.flush()
+            except OSError:
+                logger.exception("Could not save trending snapshot")
+
+
+tracker = Trending()
+
+record_like = tracker.record_like
+record_unlike = tracker.record_unlike
+discard = tracker.discard
+top = tracker.top
+flush = tracker.flush
+
+
+def init_app(app):
+    """Point the tracker at the app's snapshot directory."""
+
+    path = app.config.get('TRENDING_SNAPSHOT_DIR')
+    if path:
+        os.makedirs(path, exist_ok=True)
+        tracker.snapshot_dir = path
@@ -0,0 +1,511 @@
+"""Bulk export and import of users' data as NDJSON.
+
+An export is one JSON object per line, each with a "type" of "user",
+"message", "follow" or "like", in that order so that a file can be
+imported in one pass. Rows are read through server-side cursors a batch at
+a time, so an export of any size runs in constant memory, whether it is
+streamed to a browser (/users/export, /users/<id>/messages.ndjson) or
+written by `flask data export`. A user's messages and likes include any
+that have been rolled into the archive.
+
+`flask data import` reads such a file in batches and writes each batch
+with one multi-row INSERT per table, skipping rows that are already
+there, so importing the same file twice changes nothing. Ids are kept,
+which is what makes re-imports idempotent; rows that refer to a user or
+message missing from the target database (or to a user id held by a
+different username) are skipped and counted. Imported messages are added
+to the search, hashtag and mention indexes afterwards, by a queued
+index_imported_messages job (or before `flask data import --index-now`
+returns), so the import itself writes no postings. Messages already in the
+archive are left there rather than imported into `messages` again, and
+likes of them go to `archived_likes`, so re-importing an export into the
+database it came from is a no-op after a rollover, too.
+
+Imports are bounded by Postgres, not Python: bench_import.py measures
+about 40k messages and 30k follows or likes a second on one core, where
+decoding and COPY formatting alone run at over 120k, and about half of
+each INSERT is the per-row foreign key checks. That is short of 100k rows
+a second, which would take dropping the constraints for the import.
+Indexing runs at about 3k messages a second, a dozen or so postings each.
+"""
+
+import io
+import json
+import secrets
+from collections import Counter, namedtuple
+from datetime import datetime
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import or_, select, text
+from sqlalchemy.dialects.postgresql import insert
+
+import archive
+import search
+import snowflake
+import tags
+from jobs import task, enqueue
+from models import (db, bcrypt, User, Message, Follows, Likes, MessageTag,
+                    Mention, SearchPosting, ArchivedMessage, ArchivedLike)
+from readmodels import execute
+
+FETCH_SIZE = 5000
+BATCH_SIZE = 10000
+
+USER_COLUMNS = ('id', 'username', 'email', 'image_url', 'header_image_url',
+                'bio', 'location')
+
+KINDS = ('user', 'message', 'follow', 'like')
+
+# just enough of a Message for the search and tag indexers
+Row = namedtuple('Row', 'id text')
+
+
+##############################################################################
+# Export
+
+
+def stream_rows(query, bind=None):
+    """Yield dicts for the rows of a Core `query`, via a server-side cursor."""
+
+    conn = db.get_engine(bind=bind).connect()
+    try:
+        result = conn.execution_options(stream_results=True).execute(query)
+        while True:
+            rows = result.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                yield dict(row)
+    finally:
+        conn.close()
+
+
+def dump(kind, row):
+    for key, value in row.items():
+        if isinstance(value, datetime):
+            row[key] = value.isoformat()
+    row['type'] = kind
+    return json.dumps(row) + '\n'
+
+
+def message_lines(user_id=None):
+    """NDJSON lines for messages, archived then hot, oldest first."""
+
+    hot = Message.__table__
+    archived = ArchivedMessage.__table__
+
+    hot_query = select([hot.c.id, hot.c.text, hot.c.timestamp,
+                        hot.c.user_id]).order_by(hot.c.id)
+    archived_query = select([archived.c.id, archived.c.text,
+                             archived.c.timestamp,
+                             archived.c.user_id]).order_by(archived.c.id)
+    if user_id is not None:
+        hot_query = hot_query.where(hot.c.user_id == user_id)
+        archived_query = archived_query.where(archived.c.user_id == user_id)
+
+    for row in stream_rows(archived_query, bind='archive'):
+        yield dump('message', row)
+    for row in stream_rows(hot_query):
+        yield dump('message', row)
+
+
+def export_lines(user_id=None, passwords=False):
+    """NDJSON lines for one user's data, or everyone's.
+
+    A user's export has their profile, messages, likes and the follows on
+    either side of them. Password hashes are only included if asked for.
+    """
+
+    users = User.__table__
+    follows = Follows.__table__
+    likes = Likes.__table__
+    archived_likes = ArchivedLike.__table__
+
+    columns = [users.c[name] for name in USER_COLUMNS]
+    if passwords:
+        columns.append(users.c.password)
+    user_query = select(columns).order_by(users.c.id)
+    follow_query = select([follows.c.user_following_id,
+                           follows.c.user_being_followed_id])
+    like_query = select([likes.c.user_id, likes.c.message_id]).order_by(
+        likes.c.id)
+    archived_like_query = select([archived_likes.c.user_id,
+                                  archived_likes.c.message_id]).order_by(
+        archived_likes.c.message_id, archived_likes.c.user_id)
+
+    if user_id is not None:
+        user_query = user_query.where(users.c.id == user_id)
+        follow_query = follow_query.where(or_(
+            follows.c.user_following_id == user_id,
+            follows.c.user_being_followed_id == user_id))
+        like_query = like_query.where(likes.c.user_id == user_id)
+        archived_like_query = archived_like_query.where(
+            archived_likes.c.user_id == user_id)
+
+    for row in stream_rows(user_query):
+        yield dump('user', row)
+    yield from message_lines(user_id)
+    for row in stream_rows(follow_query):
+        yield dump('follow', row)
+    for row in stream_rows(archived_like_query, bind='archive'):
+        yield dump('like', row)
+    for row in stream_rows(like_query):
+        yield dump('like', row)
+
+
+def chunked(lines, size=FETCH_SIZE):
+    """Join lines into larger chunks, for fewer writes to a response."""
+
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= size:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+##############################################################################
+# Import
+
+
+COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n',
+                              '\r': '\\r'})
+
+
+def copy_value(value):
+    """`value` as a field of COPY's text format."""
+
+    if value is None:
+        return '\\N'
+    if not isinstance(value, str):
+        return str(value)
+    # most text has nothing to escape; skip the translate
+    if '\\' in value or '\t' in value or '\n' in value or '\r' in value:
+        return value.translate(COPY_ESCAPES)
+    return value
+
+
+def copy_rows(cursor, table, columns, rows):
+    """COPY dicts `rows` into `table` in one round trip."""
+
+    buffer = io.StringIO()
+    buffer.writelines(['\t'.join([copy_value(row.get(column))
+                                  for column in columns]) + '\n'
+                       for row in rows])
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN",
+                       buffer)
+
+
+class Importer:
+    """Writes NDJSON records in batches; see the module docstring.
+
+    Each batch is COPYed into a temporary staging table shaped like its
+    model's table, then moved across with one INSERT ... SELECT that drops
+    rows whose users or messages are missing here and skips rows already
+    present.
+    """
+
+    # kind -> (model, columns, extra condition on staged rows `s`)
+    TABLES = {
+        'user': (User, USER_COLUMNS + ('password',), "TRUE"),
+        'message': (Message, ('id', 'text', 'timestamp', 'user_id'),
+                    "EXISTS (SELECT 1 FROM users u WHERE u.id = s.user_id)"
+                    " AND s.user_id <> ALL(%(conflicts)s)"),
+        'follow': (Follows, ('user_following_id', 'user_being_followed_id'),
+                   "EXISTS (SELECT 1 FROM users u"
+                   " WHERE u.id = s.user_following_id)"
+                   " AND EXISTS (SELECT 1 FROM users u"
+                   " WHERE u.id = s.user_being_followed_id)"
+                   " AND s.user_following_id <> ALL(%(conflicts)s)"
+                   " AND s.user_being_followed_id <> ALL(%(conflicts)s)"),
+        'like': (Likes, ('user_id', 'message_id'),
+                 "EXISTS (SELECT 1 FROM users u WHERE u.id = s.user_id)"
+                 " AND EXISTS (SELECT 1 FROM messages m"
+                 " WHERE m.id = s.message_id)"
+                 " AND s.user_id <> ALL(%(conflicts)s)"),
+    }
+
+    def __init__(self, batch_size=BATCH_SIZE):
+        self.batch_size = batch_size
+        self.pending = {kind: [] for kind in KINDS}
+        self.inserted = Counter()
+        self.existing = Counter()
+        self.skipped = Counter()
+        # imported user ids already taken by a different username
+        self.conflicts = set()
+        # (first, last) id of the messages inserted, for indexing
+        self.message_range = None
+        self._unusable_password = None
+
+    def add(self, record):
+        kind = record.pop('type', None)
+        if kind not in self.pending:
+            self.skipped['unknown'] += 1
+            return
+
+        self.pending[kind].append(record)
+        if len(self.pending[kind]) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write everything pending, parents before children, and commit."""
+
+        cursor = db.session.connection().connection.cursor()
+        for kind in KINDS:
+            rows, self.pending[kind] = self.pending[kind], []
+            if rows:
+                self.write(cursor, kind, rows)
+        db.session.commit()
+
+    def finish(self, index=True):
+        """Write what's left; queue indexing of the new messages, unless
+        `index` is False (the caller indexes them itself)."""
+
+        self.flush()
+        if self.inserted['user']:
+            # ids were given explicitly, so move the sequence past them
+            db.session.execute(text(
+                "SELECT setval(pg_get_serial_sequence('users', 'id'), "
+                "(SELECT max(id) FROM users))"))
+            db.session.commit()
+
+        if index and self.message_range is not None:
+            first_id, last_id = self.message_range
+            enqueue('index_imported_messages',
+                    {'first_id': first_id, 'last_id': last_id})
+            db.session.commit()
+
+    def write(self, cursor, kind, rows):
+        model, columns, condition = self.TABLES[kind]
+        table = model.__tablename__
+        staging = f"import_{table}"
+        column_list = ', '.join(columns)
+        params = {'conflicts': list(self.conflicts)}
+
+        getattr(self, f'prepare_{kind}s', lambda rows: None)(rows)
+        if kind in ('message', 'like'):
+            rows = self.divert_archived(kind, rows)
+            if not rows:
+                return
+
+        cursor.execute(f"CREATE TEMP TABLE {staging} ON COMMIT DROP AS "
+                       f"SELECT {column_list} FROM {table} WITH NO DATA")
+        copy_rows(cursor, staging, columns, rows)
+
+        cursor.execute(f"SELECT count(*) FROM {staging} s "
+                       f"WHERE NOT ({condition})", params)
+        skipped, = cursor.fetchone()
+
+        returning = " RETURNING id" if kind == 'message' else ""
+        cursor.execute(f"INSERT INTO {table} ({column_list}) "
+                       f"SELECT DISTINCT {column_list} FROM {staging} s "
+                       f"WHERE {condition} "
+                       f"ON CONFLICT DO NOTHING{returning}", params)
+        inserted = cursor.rowcount
+
+        if kind == 'user':
+            cursor.execute(f"SELECT s.id FROM {staging} s "
+                           f"JOIN users u ON u.id = s.id "
+                           f"WHERE u.username <> s.username")
+            self.conflicts.update(user_id for user_id, in cursor)
+        elif kind == 'message' and inserted:
+            ids = [message_id for message_id, in cursor]
+            if self.message_range is not None:
+                ids.extend(self.message_range)
+            self.message_range = (min(ids), max(ids))
+
+        self.inserted[kind] += inserted
+        self.skipped[kind] += skipped
+        self.existing[kind] += len(rows) - inserted - skipped
+
+    def prepare_users(self, rows):
+        for row in rows:
+            if not row.get('password'):
+                row['password'] = self.unusable_password()
+
+    def prepare_messages(self, rows):
+        for row in rows:
+            if not row.get('timestamp'):
+                row['timestamp'] = snowflake.timestamp_of(row['id'])
+
+    def divert_archived(self, kind, rows):
+        """Handle rows about archived messages; return the others.
+
+        Messages already in the archive are counted as present rather than
+        put back into `messages`, and likes of archived messages go to
+        `archived_likes`. The archive may be another database, so this is
+        a lookup there rather than part of the INSERT ... SELECT.
+        """
+
+        if archive.hot_boundary() is None:
+            return rows
+
+        key = 'id' if kind == 'message' else 'message_id'
+        archived_messages = ArchivedMessage.__table__
+        archived_ids = {message_id for message_id, in execute(
+            select([archived_messages.c.id])
+            .where(archived_messages.c.id.in_({row[key] for row in rows})),
+            ArchivedMessage)}
+        if not archived_ids:
+            return rows
+
+        hot = [row for row in rows if row[key] not in archived_ids]
+        archived = [row for row in rows if row[key] in archived_ids]
+
+        if kind == 'message':
+            self.existing[kind] += len(archived)
+            return hot
+
+        users = User.__table__
+        known = {user_id for user_id, in db.session.execute(
+            select([users.c.id])
+            .where(users.c.id.in_({row['user_id'] for row in archived})))}
+        likes = [dict(message_id=row['message_id'], user_id=row['user_id'])
+                 for row in archived
+                 if row['user_id'] in known
+                 and row['user_id'] not in self.conflicts]
+
+        inserted = 0
+        if likes:
+            with db.get_engine(bind='archive').begin() as conn:
+                inserted = conn.execute(insert(ArchivedLike.__table__)
+                                        .values(likes)
+                                        .on_conflict_do_nothing()).rowcount
+        self.inserted[kind] += inserted
+        self.existing[kind] += len(likes) - inserted
+        self.skipped[kind] += len(archived) - len(likes)
+        return hot
+
+    def unusable_password(self):
+        """A hash nobody knows the password for, for users without one."""
+
+        if self._unusable_password is None:
+            self._unusable_password = bcrypt.generate_password_hash(
+                secrets.token_hex()).decode('UTF-8')
+        return self._unusable_password
+
+
+@task(queue='batch', max_attempts=3)
+def index_imported_messages(first_id, last_id):
+    """Index messages with ids first_id..last_id; return how many were read.
+
+    Builds their search postings, hashtags and mentions a batch at a time
+    and moves each table's rows in with a COPY and one INSERT ... SELECT
+    that skips rows already there, so ranges may overlap earlier imports
+    and a retried job does no harm.
+    """
+
+    messages = Message.__table__
+
+    count = 0
+    after = first_id - 1
+    while True:
+        batch = [Row(*row) for row in db.session.execute(
+            select([messages.c.id, messages.c.text])
+            .where(messages.c.id > after)
+            .where(messages.c.id <= last_id)
+            .order_by(messages.c.id)
+            .limit(BATCH_SIZE))]
+        if not batch:
+            break
+
+        postings = [posting for message in batch
+                    for posting in search.postings_for(message)]
+        tag_rows, mention_rows = tags.rows_for(batch)
+
+        cursor = db.session.connection().connection.cursor()
+        for model, rows in ((SearchPosting, postings),
+                            (MessageTag, tag_rows),
+                            (Mention, mention_rows)):
+            if rows:
+                insert_new(cursor, model.__tablename__, tuple(rows[0]), rows)
+        db.session.commit()
+
+        count += len(batch)
+        after = batch[-1].id
+
+    search.schedule_stats_refresh()
+    db.session.commit()
+    return count
+
+
+def insert_new(cursor, table, columns, rows):
+    """COPY dicts `rows` into `table`, skipping rows already there."""
+
+    staging = f"new_{table}"
+    column_list = ', '.join(columns)
+    cursor.execute(f"CREATE TEMP TABLE {staging} ON COMMIT DROP AS "
+                   f"SELECT {column_list} FROM {table} WITH NO DATA")
+    copy_rows(cursor, staging, columns, rows)
+    cursor.execute(f"INSERT INTO {table} ({column_list}) "
+                   f"SELECT {column_list} FROM {staging} "
+                   f"ON CONFLICT DO NOTHING")
+
+
+def import_lines(lines, batch_size=BATCH_SIZE, index=True):
+    """Import NDJSON lines; return the Importer, for its counts.
+
+    New messages are indexed by a queued job; see Importer.finish().
+    """
+
+    importer = Importer(batch_size)
+    for line in lines:
+        if line.strip():
+            importer.add(json.loads(line))
+    importer.finish(index)
+    return importer
+
+
+##############################################################################
+# CLI: `flask data ...`
+
+data_cli = AppGroup('data', help="Export and import users' data as NDJSON.")
+
+
+@data_cli.command('export')
+@click.option('--user', 'username', help="Only this user's data.")
+@click.option('--output', '-o', type=click.File('w'), default='-',
+              help="File to write (default: stdout).")
+@click.option('--passwords/--no-passwords', default=True,
+              help="Include password hashes.")
+def export_command(username, output, passwords):
+    """Write users, messages, follows and likes as NDJSON."""
+
+    user_id = None
+    if username:
+        user = User.get_by_username(username)
+        if user is None:
+            raise click.BadParameter(f"no user {username!r}")
+        user_id = user.id
+
+    for chunk in chunked(export_lines(user_id, passwords)):
+        output.write(chunk)
+
+
+@data_cli.command('import')
+@click.argument('source', type=click.File('r'))
+@click.option('--batch', 'batch_size', default=BATCH_SIZE,
+              help="Rows written per statement.")
+@click.option('--index-now', is_flag=True,
+              help="Index new messages before returning, instead of "
+                   "queueing a job for the worker.")
+def import_command(source, batch_size, index_now):
+    """Import an NDJSON export; rows already present are skipped."""
+
+    importer = import_lines(source, batch_size, index=not index_now)
+    for kind in KINDS:
+        click.echo(f"{kind + 's':<9} {importer.inserted[kind]:>10} imported"
+                   f" {importer.existing[kind]:>10} already present"
+                   f" {importer.skipped[kind]:>10} skipped")
+
+    if importer.message_range is None:
+        return
+    if index_now:
+        count = index_imported_messages(*importer.message_range)
+        click.echo(f"Indexed {count} messages.")
+    else:
+        click.echo("Queued indexing of the new messages.")